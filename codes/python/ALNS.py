@@ -0,0 +1,148 @@
+import timeit
+from collections import OrderedDict, defaultdict
+from Instance import Type
+from Optimizer import Optimizer
+from FixOptimize import FixAndOptimize, Neighbourhood
+import Util
+
+# Adaptive large neighbourhood search on top of fix-and-optimize. Every
+# iteration picks a destroy operator with a probability proportional to its
+# weight, frees the neighbourhood it returns and repairs it with a short solve
+# while the rest of the schedule stays fixed. The weight of an operator follows
+# the improvement per second of its recent repairs.
+
+
+class ALNS:
+    def __init__(self, optimizer: Optimizer, seed=0):
+        self.engine = FixAndOptimize(optimizer, seed)
+        self.optimizer = optimizer
+        self.setting = optimizer.setting
+        self.random = self.engine.random
+        self.size = self.setting.alns_size
+        self.decay = self.setting.alns_decay
+        self.horizon = len(optimizer.slot_indices)
+        self.slots_per_day = optimizer.instance.time.slots_per_day
+        self.operators = OrderedDict(
+            (
+                ("window", self.destroy_window),
+                ("random", self.destroy_random),
+                ("precedence", self.destroy_precedence),
+                ("peak", self.destroy_peak),
+                ("battery_day", self.destroy_battery_day),
+            )
+        )
+        self.weights = OrderedDict((name, 1.0) for name in self.operators)
+        self.calls = defaultdict(int)
+        self.improvements = defaultdict(float)
+        self.dependants = defaultdict(list)
+        for ap, activity in optimizer.activities.items():
+            for a in activity.prerequisites:
+                self.dependants[a].append(ap)
+
+    def _free_anywhere(self, neighbourhood, activities):
+        for a in activities:
+            neighbourhood.activities[a] = (0, self.horizon - 1)
+        return neighbourhood
+
+    def destroy_window(self):
+        first = self.random.randrange(self.horizon)
+        last = min(first + self.engine.window_slots, self.horizon) - 1
+        return self.engine.window(first, last)
+
+    def destroy_random(self):
+        activities = list(self.optimizer.activities_o)
+        chosen = self.random.sample(activities, min(self.size, len(activities)))
+        return self._free_anywhere(Neighbourhood("random"), chosen)
+
+    def destroy_precedence(self):
+        # a chain of prerequisites and dependants around a random activity
+        activities = list(self.optimizer.activities_o)
+        if not activities:
+            return Neighbourhood("precedence")
+        queue = [self.random.choice(activities)]
+        chain = []
+        while queue and len(chain) < self.size:
+            a = queue.pop(0)
+            if a in chain or self.optimizer.activities[a].type == Type.R:
+                continue
+            chain.append(a)
+            queue.extend(self.optimizer.activities[a].prerequisites)
+            queue.extend(self.dependants[a])
+        return self._free_anywhere(Neighbourhood("precedence"), chain)
+
+    def destroy_peak(self):
+        # activities in progress at the peak slot of any scenario, and the
+        # battery modes of the days of these peaks
+        loads = self.engine.loads
+        peak_slots = set(
+            max(self.optimizer.slot_indices, key=lambda t: abs(loads[t][s]))
+            for s in self.optimizer.scenarios
+        )
+        overlapping = []
+        for a, start in self.engine.activity_start.items():
+            activity = self.optimizer.activities[a]
+            if activity.type == Type.R:
+                continue
+            if any(start <= t < start + activity.duration for t in peak_slots):
+                overlapping.append(a)
+        self.random.shuffle(overlapping)
+        neighbourhood = self._free_anywhere(
+            Neighbourhood("peak"), overlapping[: self.size]
+        )
+        for t in peak_slots:
+            first = t - t % self.slots_per_day
+            neighbourhood.battery_slots.update(
+                (b, tp)
+                for b in self.optimizer.batteries
+                for tp in range(first, min(first + self.slots_per_day, self.horizon))
+            )
+        return neighbourhood
+
+    def destroy_battery_day(self):
+        neighbourhood = Neighbourhood("battery_day")
+        if not self.optimizer.batteries:
+            return neighbourhood
+        b = self.random.choice(list(self.optimizer.batteries))
+        first = self.random.randrange(0, self.horizon, self.slots_per_day)
+        neighbourhood.battery_slots.update(
+            (b, t) for t in range(first, min(first + self.slots_per_day, self.horizon))
+        )
+        return neighbourhood
+
+    def select(self):
+        names = list(self.weights)
+        weights = list(self.weights.values())
+        floor = 0.1 * sum(weights) / len(weights) + 1e-9
+        return self.random.choices(names, [w + floor for w in weights])[0]
+
+    def run(self, time_limit):
+        start_time = timeit.default_timer()
+        while True:
+            remaining = time_limit - (timeit.default_timer() - start_time)
+            if remaining <= 1:
+                break
+            name = self.select()
+            neighbourhood = self.operators[name]()
+            improvement, elapsed = self.engine.solve_neighbourhood(
+                neighbourhood, min(self.engine.window_time_limit, remaining)
+            )
+            self.calls[name] += 1
+            self.improvements[name] += improvement
+            reward = improvement / max(elapsed, 1e-3)
+            self.weights[name] = (
+                self.decay * self.weights[name] + (1 - self.decay) * reward
+            )
+        for name in self.operators:
+            Util.writeln(
+                self.optimizer.log_file,
+                f"Operator={name} Calls={self.calls[name]} "
+                f"Improvement={self.improvements[name]:.4f} "
+                f"Weight={self.weights[name]:.6f}",
+            )
+        # leave the incumbent as the current solution of the model, with the
+        # bounds of before
+        self.engine.solve_neighbourhood(
+            Neighbourhood("incumbent"), self.engine.window_time_limit
+        )
+        self.engine.release()
+        self.info = self.engine.info
@@ -1,6 +1,12 @@
 import timeit
 from gurobipy import GRB
 from Optimizer import Optimizer
+from Decomposition import BendersOptimizer
+import Multiresolution
+from FixOptimize import FixAndOptimize
+from ALNS import ALNS
+from Dispatch import BatteryDispatcher
+from ColumnGeneration import ColumnGeneration
 from Solution import Solution
 from Instance import Instance
 import Util
@@ -222,3 +228,116 @@ class Algorithm:
             solution.export()
             return summary, solution
 
+        if self.setting.algorithm == 13:
+            optimizer = BendersOptimizer(self.instance)
+            optimizer.formulate()
+            summary = optimizer.solve()
+            solution = Solution(optimizer)
+            solution.export()
+            return summary, solution
+
+        if self.setting.algorithm == 14:
+            factor = self.setting.coarse_factor
+            coarse = Multiresolution.coarsen(self.instance, factor)
+            coarse_optimizer = Optimizer(coarse)
+            coarse_optimizer.formulate()
+            coarse_optimizer.model.setParam(GRB.Param.TimeLimit, 0.3 * self.time_limit)
+            coarse_optimizer.solve()
+            optimizer = Optimizer(self.instance)
+            optimizer.formulate()
+            if coarse_optimizer.model.SolCount == 0:
+                # nothing to project, a plain fine solve
+                optimizer.model.setParam(GRB.Param.TimeLimit, 0.7 * self.time_limit)
+                summary = optimizer.solve()
+                if optimizer.model.SolCount == 0:
+                    return summary, None
+                solution = Solution(optimizer)
+                solution.export()
+                return summary, solution
+            activity_start, battery_bt_mode = Multiresolution.project(
+                coarse_optimizer, optimizer, factor
+            )
+            optimizer.set_start(activity_start, battery_bt_mode)
+            optimizer.restrict_activity_starts(
+                activity_start, self.setting.coarse_width
+            )
+            optimizer.model.setParam(GRB.Param.TimeLimit, 0.4 * self.time_limit)
+            summary = optimizer.solve()
+            if optimizer.model.SolCount:
+                Solution(optimizer).export()
+            # the projection (kept as the start without an incumbent) in the
+            # full neighbourhood
+            optimizer.undo_restrict_activity_starts()
+            optimizer.model.setParam(GRB.Param.TimeLimit, 0.3 * self.time_limit)
+            summary = optimizer.solve()
+            if optimizer.model.SolCount == 0:
+                return summary, None
+            solution = Solution(optimizer)
+            solution.export()
+            return summary, solution
+
+        if self.setting.algorithm == 15:
+            optimizer = Optimizer(self.instance)
+            optimizer.formulate()
+            optimizer.model.setParam(GRB.Param.TimeLimit, 0.2 * self.time_limit)
+            summary = optimizer.solve()
+            if optimizer.model.SolCount == 0:
+                return summary, None
+            Solution(optimizer).export()
+            engine = FixAndOptimize(optimizer, self.setting.solver.seed)
+            engine.run(self.time_limit - self._elapsed())
+            summary = engine.info
+            solution = Solution(optimizer)
+            solution.export()
+            return summary, solution
+
+        if self.setting.algorithm == 16:
+            optimizer = Optimizer(self.instance)
+            optimizer.formulate()
+            optimizer.model.setParam(GRB.Param.TimeLimit, 0.2 * self.time_limit)
+            summary = optimizer.solve()
+            if optimizer.model.SolCount == 0:
+                return summary, None
+            Solution(optimizer).export()
+            alns = ALNS(optimizer, self.setting.solver.seed)
+            alns.run(self.time_limit - self._elapsed())
+            summary = alns.info
+            solution = Solution(optimizer)
+            solution.export()
+            return summary, solution
+
+        if self.setting.algorithm == 17:
+            optimizer = Optimizer(self.instance)
+            optimizer.formulate()
+            optimizer.exclude_batteries()
+            optimizer.model.setParam(GRB.Param.TimeLimit, 0.95 * self.time_limit)
+            summary = optimizer.solve()
+            if optimizer.model.SolCount == 0:
+                return summary, None
+            Solution(optimizer).export()
+            activity_start = {
+                a: t for (a, t), var in optimizer.Z_VAR.items() if var.x >= 0.5
+            }
+            battery_bt_mode = BatteryDispatcher(optimizer).run(activity_start)
+            optimizer.fix_activities()
+            optimizer.fix_batteries(battery_bt_mode)
+            optimizer.model.setParam(GRB.Param.TimeLimit, 0.05 * self.time_limit)
+            summary = optimizer.solve()
+            solution = Solution(optimizer)
+            solution.export()
+            return summary, solution
+
+        if self.setting.algorithm == 18:
+            optimizer = Optimizer(self.instance)
+            optimizer.formulate()
+            optimizer.model.setParam(GRB.Param.TimeLimit, 0.2 * self.time_limit)
+            summary = optimizer.solve()
+            if optimizer.model.SolCount == 0:
+                return summary, None
+            Solution(optimizer).export()
+            engine = ColumnGeneration(optimizer)
+            engine.run(self.time_limit - self._elapsed())
+            summary = engine.info or summary
+            solution = Solution(optimizer)
+            solution.export()
+            return summary, solution
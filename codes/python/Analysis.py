@@ -0,0 +1,128 @@
+import math
+from collections import OrderedDict, defaultdict
+import numpy as np
+from Instance import Instance, Type
+import Util
+
+# Analysis of the once-off activities before the model is built. Scheduling an
+# activity at a start time whose slots have a non-negative load in every
+# scenario, whatever the batteries do, cannot lower any peak, so it gains at
+# most its revenue minus the expected price cost of its load (and its penalty).
+# An activity that gains nothing at all of its start times, and whose
+# dependants cannot start, is dropped (no start times). Identical activities
+# (rooms, load, duration, revenue, penalty, prerequisites and dependants) are
+# interchangeable, and the optimizer schedules each such class in order.
+
+
+def get_dependants(instance: Instance):
+    dependants = defaultdict(set)
+    for ap, activity in enumerate(instance.activities):
+        for a in activity.prerequisites:
+            dependants[a].add(ap)
+    return dependants
+
+
+def get_expected_prices(instance: Instance):
+    prices = np.array([s.price for s in instance.scenarios], dtype=float)
+    probabilities = np.array([s.probability for s in instance.scenarios])
+    return probabilities @ prices / (instance.time.slots_per_hour * 1000)
+
+
+def get_nonnegative_slots(instance: Instance):
+    net_loads = np.array(
+        [np.subtract(s.base_load, s.solar_load) for s in instance.scenarios],
+        dtype=float,
+    )
+    discharge = sum(math.sqrt(b.efficiency) * b.max_power for b in instance.batteries)
+    return net_loads.min(axis=0) - discharge >= 0
+
+
+def prune_activities(instance: Instance):
+    cumulative_price = np.concatenate(([0], np.cumsum(get_expected_prices(instance))))
+    cumulative_negative = np.concatenate(
+        ([0], np.cumsum(~get_nonnegative_slots(instance)))
+    )
+    dependants = get_dependants(instance)
+    pruned = []
+    changed = True
+    while changed:
+        changed = False
+        for a, activity in enumerate(instance.activities):
+            if activity.type != Type.O or not activity.start_times:
+                continue
+            if any(instance.activities[ap].start_times for ap in dependants[a]):
+                continue
+            power = activity.load_per_room * (
+                activity.small_rooms + activity.large_rooms
+            )
+            penalty_times = set(activity.penalty_times)
+            dominated = True
+            for t in activity.start_times:
+                end = t + activity.duration
+                if cumulative_negative[end] > cumulative_negative[t]:
+                    dominated = False
+                    break
+                cost = power * (cumulative_price[end] - cumulative_price[t])
+                if t in penalty_times:
+                    cost += activity.penalty
+                if cost < activity.revenue:
+                    dominated = False
+                    break
+            if dominated:
+                activity.start_times = []
+                activity.progress_times = []
+                activity.penalty_times = []
+                pruned.append(a)
+                changed = True
+    return pruned
+
+
+def get_symmetric_classes(instance: Instance):
+    dependants = get_dependants(instance)
+    classes = OrderedDict()
+    for a, activity in enumerate(instance.activities):
+        if activity.type != Type.O or not activity.start_times:
+            continue
+        key = (
+            activity.small_rooms,
+            activity.large_rooms,
+            activity.load_per_room,
+            activity.duration,
+            activity.revenue,
+            activity.penalty,
+            tuple(sorted(activity.prerequisites)),
+            tuple(sorted(dependants[a])),
+            tuple(activity.start_times),
+        )
+        classes.setdefault(key, []).append(a)
+    return [members for members in classes.values() if len(members) > 1]
+
+
+def canonical_start(activity_start, classes):
+    # the scheduled members of a class take its start times in order
+    canonical = OrderedDict(activity_start)
+    for members in classes:
+        starts = sorted(canonical.pop(a) for a in members if a in canonical)
+        canonical.update(zip(members, starts))
+    return OrderedDict(sorted(canonical.items()))
+
+
+def analyse_activities(instance: Instance):
+    pruned = prune_activities(instance)
+    instance.pruned_activities = pruned
+    instance.symmetric_classes = get_symmetric_classes(instance)
+    for a in pruned:
+        instance.sol_activity_start.pop(a, None)
+    instance.sol_activity_start = canonical_start(
+        instance.sol_activity_start, instance.symmetric_classes
+    )
+    message = (
+        f"Pruned {len(pruned)} once-off activities: "
+        f"{' '.join(str(instance.activities[a].key) for a in pruned)}, "
+        f"{len(instance.symmetric_classes)} symmetric classes: "
+        + " ".join(
+            "(" + " ".join(str(instance.activities[a].key) for a in members) + ")"
+            for members in instance.symmetric_classes
+        )
+    )
+    Util.writeln(Util.joinpath(instance.folder, "analysis.log"), message, mode="w")
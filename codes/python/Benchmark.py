@@ -0,0 +1,321 @@
+import sys
+import copy
+import math
+import random
+import timeit
+import tempfile
+import gurobipy as gp
+from gurobipy import GRB
+from Setting import Setting
+from Instance import Instance, Type
+from Optimizer import Optimizer
+from Solution import Solution
+from Generator import Generator, GeneratorSetting
+import Time
+import Util
+
+# Micro-benchmarks of the pure-Python parts of the engine (parsing, time slots,
+# activity times and the generation of the model rows). The solver is replaced
+# by a sink model, so no Gurobi license is needed to run this file:
+#   python Benchmark.py            -> scales 1 4 16
+#   python Benchmark.py 1 2 4 8    -> custom scales
+# Both the horizon and the number of activities grow with the scale, so the
+# reported order is 1 for linear and 2 for T*A (or quadratic) loops.
+
+BASE_DAYS = 7
+BASE_ACTIVITIES_R = 10
+BASE_ACTIVITIES_O = 10
+BASE_SCENARIOS = 2
+BUILDINGS = 6
+BATTERIES = 2
+SCALES = [1, 4, 16]
+REPEAT = 3
+SEED = 0
+
+
+class SinkExpr:
+    def _absorb(self, *args):
+        return SINK
+
+    __add__ = __radd__ = __sub__ = __rsub__ = _absorb
+    __mul__ = __rmul__ = __truediv__ = __neg__ = _absorb
+    __eq__ = __le__ = __ge__ = _absorb
+    __hash__ = object.__hash__
+
+
+SINK = SinkExpr()
+
+
+class SinkVar(SinkExpr):
+    def __init__(self):
+        self.x = 0
+        self.start = GRB.UNDEFINED
+        self.lb = 0
+        self.ub = 1
+        self.VType = GRB.CONTINUOUS
+
+
+class SinkModel:
+    def __init__(self):
+        self.objVal = 0
+        self.var_count = 0
+        self.constr_count = 0
+
+    def setParam(self, *args):
+        pass
+
+    def addVars(self, keys, **kwargs):
+        variables = gp.tupledict({key: SinkVar() for key in keys})
+        self.var_count += len(variables)
+        return variables
+
+    def addConstrs(self, constrs, name=""):
+        self.constr_count += sum(1 for _ in constrs)
+
+    def addLConstr(self, *args, **kwargs):
+        self.constr_count += 1
+        return SINK
+
+    def setObjective(self, expr, sense=None):
+        pass
+
+    def getAttr(self, attr):
+        return {GRB.Attr.Status: GRB.OPTIMAL, GRB.Attr.SolCount: 1}.get(attr, 0)
+
+    def getVars(self):
+        return []
+
+    def update(self):
+        pass
+
+    def optimize(self, callback=None):
+        pass
+
+    def remove(self, items):
+        pass
+
+
+class SinkOptimizer(Optimizer):
+    def new_model(self):
+        return SinkModel()
+
+
+def get_setting(main_dir, scale):
+    setting = Setting()
+    setting.dataset_keys = [f"benchmark_x{scale}"]
+    setting.name = f"benchmark_x{scale}"
+    setting.main_dir = main_dir
+    setting.startsol_dir = Util.joinpath(main_dir, "startsol")
+    setting.input_dir = Util.joinpath(main_dir, "inputs")
+    setting.solver.setstart = False
+    setting.solver.fixsol = False
+    return setting
+
+
+def write_inputs(setting: Setting, scale, seed=SEED):
+    config = GeneratorSetting()
+    config.name = setting.dataset_keys[0]
+    config.seed = seed
+    config.buildings = BUILDINGS
+    config.batteries = BATTERIES
+    config.recurring = BASE_ACTIVITIES_R * scale
+    config.onceoff = BASE_ACTIVITIES_O * scale
+    config.days = BASE_DAYS * scale
+    config.scenarios = BASE_SCENARIOS
+    config.real_data = True
+    Generator(setting, config).run()
+
+
+def get_instance(setting: Setting, load=True):
+    key = setting.dataset_keys[0]
+    instance = Instance(key, setting)
+    if load:
+        instance.load_ppoi(get_instance_file(setting))
+        instance.load_scenario(get_scenario_files(setting))
+        instance.set_activity_times()
+    return instance
+
+
+def get_instance_file(setting: Setting):
+    key = setting.dataset_keys[0]
+    return Util.getFileList(Util.joinpath(setting.input_dir, key + "_instances"))[0]
+
+
+def get_scenario_files(setting: Setting):
+    key = setting.dataset_keys[0]
+    return Util.getFileList(Util.joinpath(setting.input_dir, key + "_scenarios"))
+
+
+def set_synthetic_schedule(optimizer: Optimizer, seed=SEED):
+    rnd = random.Random(seed)
+    for a, activity in optimizer.activities.items():
+        if not activity.start_times:
+            continue
+        if activity.type == Type.O and rnd.random() < 0.5:
+            continue
+        start = rnd.choice(activity.start_times)
+        optimizer.Z_VAR[a, start].x = 1
+        optimizer.W_VAR[a].x = 1
+        for t in range(start, start + activity.duration):
+            if (a, t) in optimizer.V_VAR:
+                optimizer.V_VAR[a, t].x = 1
+    for b, t in optimizer.X_VAR:
+        if t % 8 == 0:
+            optimizer.X_VAR[b, t].x = 1
+        elif t % 8 == 4:
+            optimizer.Y_VAR[b, t].x = 1
+
+
+def get_cases(setting: Setting):
+    cache = {}
+
+    def instance():
+        if "instance" not in cache:
+            cache["instance"] = get_instance(setting)
+        return cache["instance"]
+
+    def formulated():
+        if "optimizer" not in cache:
+            optimizer = SinkOptimizer(instance())
+            optimizer.formulate()
+            set_synthetic_schedule(optimizer)
+            cache["optimizer"] = optimizer
+        return cache["optimizer"]
+
+    def solution():
+        if "solution" not in cache:
+            cache["solution"] = Solution(formulated())
+        return cache["solution"]
+
+    def with_variables():
+        optimizer = SinkOptimizer(instance())
+        optimizer.create_variables()
+        return optimizer
+
+    def unformulated(activity_formulation):
+        def setup():
+            optimizer = SinkOptimizer(instance())
+            optimizer.setting = copy.copy(optimizer.setting)
+            optimizer.setting.activity_formulation = activity_formulation
+            return optimizer
+
+        return setup
+
+    def with_ppoi():
+        fresh = get_instance(setting, load=False)
+        fresh.load_ppoi(get_instance_file(setting))
+        return fresh
+
+    def with_real_data(cache):
+        def setup():
+            fresh = with_ppoi()
+            fresh.setting = copy.copy(fresh.setting)
+            fresh.setting.use_real_data = True
+            fresh.setting.real_data_cache = cache
+            if cache:
+                # the files are read (and cached) once before the timing
+                warm = with_ppoi()
+                warm.setting = fresh.setting
+                warm.load_scenario(get_scenario_files(fresh.setting))
+            return fresh
+
+        return setup
+
+    def index_of(time):
+        horizon = len(time.slots)
+        for t in range(0, horizon, max(1, horizon // 100)):
+            time.index_of(time.slots[t].interval.a)
+
+    def load_real_data(fresh):
+        fresh.load_scenario(get_scenario_files(fresh.setting))
+
+    return [
+        (
+            "Time._get_all_slots",
+            lambda: setting,
+            lambda s: Time._get_all_slots(s.start_date, s.end_date, s.slot_minutes),
+        ),
+        ("Time.index_of", lambda: Time.Time(setting), index_of),
+        (
+            "Instance.load_ppoi",
+            lambda: get_instance(setting, load=False),
+            lambda fresh: fresh.load_ppoi(get_instance_file(setting)),
+        ),
+        (
+            "Instance.load_scenario",
+            with_ppoi,
+            lambda fresh: fresh.load_scenario(get_scenario_files(setting)),
+        ),
+        ("Instance.load_real_data", with_real_data(False), load_real_data),
+        ("Instance.load_real_data[cached]", with_real_data(True), load_real_data),
+        (
+            "Instance.set_activity_times",
+            with_ppoi,
+            lambda fresh: fresh.set_activity_times(),
+        ),
+        ("Instance.max_load_ub", instance, lambda i: i.max_load_ub),
+        (
+            "Optimizer.create_constraints",
+            with_variables,
+            lambda optimizer: optimizer.create_constraints(),
+        ),
+        (
+            "Optimizer.formulate",
+            unformulated("standard"),
+            lambda optimizer: optimizer.formulate(),
+        ),
+        (
+            "Optimizer.formulate[vfree]",
+            unformulated("vfree"),
+            lambda optimizer: optimizer.formulate(),
+        ),
+        ("Solution", formulated, lambda optimizer: Solution(optimizer)),
+        ("Solution.export_ppoi", solution, lambda sol: sol.export_ppoi()),
+    ]
+
+
+def measure(setup, func, repeat=REPEAT):
+    best = math.inf
+    for _ in range(repeat):
+        state = setup()
+        start = timeit.default_timer()
+        func(state)
+        best = min(best, timeit.default_timer() - start)
+    return best
+
+
+def run(scales, repeat=REPEAT):
+    results = []
+    with tempfile.TemporaryDirectory() as main_dir:
+        for scale in scales:
+            setting = get_setting(main_dir, scale)
+            write_inputs(setting, scale)
+            for name, setup, func in get_cases(setting):
+                seconds = measure(setup, func, repeat)
+                results.append((name, scale, seconds))
+                print(f"{name:32} x{scale:<4} {seconds:10.4f}s")
+    return results
+
+
+def report(results, filepath):
+    writer = Util.Writer(filepath, sep=",")
+    writer.pretty_out(["CASE", "SCALE", "SECONDS", "ORDER"], 4)
+    previous = {}
+    for name, scale, seconds in results:
+        order = math.nan
+        if name in previous:
+            prev_scale, prev_seconds = previous[name]
+            if prev_seconds > 0 and seconds > 0:
+                order = math.log(seconds / prev_seconds) / math.log(scale / prev_scale)
+        previous[name] = (scale, seconds)
+        writer.pretty_out([name, scale, seconds, order], 4)
+        if not math.isnan(order):
+            print(f"{name:32} x{scale:<4} order {order:5.2f}")
+
+
+if __name__ == "__main__":
+    scales = [int(s) for s in sys.argv[1:]] or SCALES
+    results = run(scales)
+    folder = Util.joinpath(Setting().main_dir, "output", "benchmark")
+    Util.mkdir(folder)
+    report(results, Util.joinpath(folder, f"micro_{Util.now()}.csv"))
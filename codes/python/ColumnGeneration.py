@@ -0,0 +1,266 @@
+import bisect
+import math
+import timeit
+from collections import OrderedDict, defaultdict
+import gurobipy as gp
+from gurobipy import GRB
+from Instance import Type
+from Optimizer import Optimizer
+import Util
+
+# Dantzig-Wolfe reformulation of the precedence bundles of an Optimizer with an
+# incumbent. A bundle is a connected component of the precedence graph that is a
+# tree (ignoring the direction of the edges), and a pattern is a set of start
+# times of its activities that satisfies C3-C7 (a recurring activity starts once
+# in the first week, so its start is a weekly template). The start variables of
+# a bundle are linked to a convex combination of its patterns (C23, C24), so
+# rooms, loads, batteries and the objective stay in the compact model and the
+# duals of the linking rows price their starts. The pricing problem of a bundle
+# is a dynamic program over its tree and the start days. Activities without
+# precedences keep their compact variables: the convex hull of the starts of a
+# single activity is already its LP relaxation. After column generation on the
+# LP relaxation, the model is solved as a MIP over the final column pool
+# (price-and-branch).
+
+
+class ColumnGeneration:
+    def __init__(self, optimizer: Optimizer):
+        self.optimizer = optimizer
+        self.model = optimizer.model
+        self.setting = optimizer.setting
+        self.log_file = optimizer.log_file
+        self.tolerance = 1e-6
+        self.dependants = defaultdict(list)
+        for ap, activity in optimizer.activities.items():
+            for a in activity.prerequisites:
+                self.dependants[a].append(ap)
+        self.blocks = self.get_blocks()
+        self.patterns = [OrderedDict() for _ in self.blocks]
+        self.link_constrs = {}
+        self.convexity_constrs = []
+        self.info = None
+
+    def day(self, t):
+        time = self.optimizer.instance.time
+        return (t + time.utc_offset) // time.slots_per_day
+
+    def get_blocks(self):
+        activities = self.optimizer.activities
+        visited = set()
+        blocks = []
+        for root in activities:
+            if root in visited:
+                continue
+            component, stack = [], [root]
+            visited.add(root)
+            while stack:
+                a = stack.pop()
+                component.append(a)
+                for ap in self.neighbours(a):
+                    if ap not in visited:
+                        visited.add(ap)
+                        stack.append(ap)
+            edges = sum(len(activities[a].prerequisites) for a in component)
+            if len(component) < 2 or edges != len(component) - 1:
+                continue
+            if not all(activities[a].start_times for a in component):
+                continue
+            blocks.append(sorted(component))
+        return blocks
+
+    def neighbours(self, a):
+        return list(self.optimizer.activities[a].prerequisites) + self.dependants[a]
+
+    def price(self, block, duals):
+        # scheduled[a][d]: the cheapest subtree of a with a started on day d,
+        # unscheduled[a]: with a not scheduled (its dependants neither), the
+        # subtrees hang from a root and a prerequisite starts on an earlier day
+        activities = self.optimizer.activities
+        root = block[0]
+        parent, order, stack = {root: None}, [], [root]
+        while stack:
+            a = stack.pop()
+            order.append(a)
+            for c in self.neighbours(a):
+                if c not in parent:
+                    parent[c] = a
+                    stack.append(c)
+        children = defaultdict(list)
+        for a in order[1:]:
+            children[parent[a]].append(a)
+        scheduled, unscheduled, starts = {}, {}, {}
+        earlier, later = {}, {}  # a -> (days, running (value, day))
+
+        def running(a, days):
+            result, current = [], (math.inf, None)
+            for d in days:
+                if scheduled[a][d] < current[0]:
+                    current = (scheduled[a][d], d)
+                result.append(current)
+            return days, result
+
+        def before(c, d):
+            days, values = earlier[c]
+            i = bisect.bisect_left(days, d)
+            return values[i - 1] if i > 0 else (math.inf, None)
+
+        def after(c, d):
+            days, values = later[c]
+            i = bisect.bisect_left([-day for day in days], -d)
+            value = values[i - 1] if i > 0 else (math.inf, None)
+            if unscheduled[c] <= value[0]:
+                return unscheduled[c], None
+            return value
+
+        def free(c):
+            value = earlier[c][1][-1] if earlier[c][1] else (math.inf, None)
+            if unscheduled[c] <= value[0]:
+                return unscheduled[c], None
+            return value
+
+        def prerequisite(a, c):
+            return c in activities[a].prerequisites
+
+        for a in reversed(order):
+            starts[a] = {}
+            for t in activities[a].start_times:
+                d = self.day(t)
+                if d not in starts[a] or duals[a, t] < starts[a][d][0]:
+                    starts[a][d] = (duals[a, t], t)
+            scheduled[a] = {}
+            for d, (value, _) in starts[a].items():
+                for c in children[a]:
+                    value += (before(c, d) if prerequisite(a, c) else after(c, d))[0]
+                scheduled[a][d] = value
+            unscheduled[a] = math.inf
+            if activities[a].type == Type.O:
+                unscheduled[a] = sum(
+                    free(c)[0] if prerequisite(a, c) else unscheduled[c]
+                    for c in children[a]
+                )
+            days = sorted(scheduled[a])
+            earlier[a] = running(a, days)
+            later[a] = running(a, days[::-1])
+
+        pattern = []
+
+        def add(a, d):
+            if d is None:
+                for c in children[a]:
+                    add(c, free(c)[1] if prerequisite(a, c) else None)
+                return
+            pattern.append((a, starts[a][d][1]))
+            for c in children[a]:
+                add(c, (before(c, d) if prerequisite(a, c) else after(c, d))[1])
+
+        value, d = free(root)
+        if value == math.inf:
+            return math.inf, None
+        add(root, d)
+        return value, tuple(sorted(pattern))
+
+    def add_pattern(self, k, pattern):
+        if pattern in self.patterns[k]:
+            return None
+        constrs = [self.convexity_constrs[k]] + [
+            self.link_constrs[key] for key in pattern
+        ]
+        coeffs = [1] + [-1] * len(pattern)
+        var = self.model.addVar(
+            lb=0,
+            ub=1,
+            name=f"P[{k},{len(self.patterns[k])}]",
+            column=gp.Column(coeffs, constrs),
+        )
+        self.patterns[k][pattern] = var
+        return var
+
+    def create_master(self, incumbent):
+        for k, block in enumerate(self.blocks):
+            for a in block:
+                for t in self.optimizer.activities[a].start_times:
+                    self.link_constrs[a, t] = self.model.addLConstr(
+                        self.optimizer.Z_VAR[a, t], GRB.EQUAL, 0, name=f"C23[{a},{t}]"
+                    )
+            self.convexity_constrs.append(
+                self.model.addLConstr(gp.LinExpr(), GRB.EQUAL, 1, name=f"C24[{k}]")
+            )
+            self.add_pattern(
+                k, tuple(sorted(key for key in incumbent if key[0] in block))
+            )
+            if all(self.optimizer.activities[a].type == Type.O for a in block):
+                self.add_pattern(k, ())
+
+    def run(self, time_limit):
+        start_time = timeit.default_timer()
+        if self.model.NumSOS:
+            Util.writeln(self.log_file, "Column generation needs binary batteries")
+            return
+        variables = self.model.getVars()
+        vtypes = self.model.getAttr(GRB.Attr.VType, variables)
+        values = self.model.getAttr(GRB.Attr.X, variables)
+        incumbent = [key for key, var in self.optimizer.Z_VAR.items() if var.x >= 0.5]
+        self.model.setAttr(GRB.Attr.VType, variables, [GRB.CONTINUOUS] * len(vtypes))
+        self.model.setParam(GRB.Param.TimeLimit, max(1, time_limit))
+        self.model.optimize()
+        compact_bound = self.model.ObjVal if self.model.SolCount else math.nan
+        self.create_master(incumbent)
+        Util.writeln(
+            self.log_file,
+            f"ColumnGeneration Blocks={len(self.blocks)} "
+            f"Activities={sum(len(block) for block in self.blocks)} "
+            f"CompactLP={compact_bound}",
+        )
+        bound, iteration = -math.inf, 0
+        while iteration < self.setting.cg_iterations:
+            remaining = time_limit - (timeit.default_timer() - start_time)
+            if remaining <= 0:
+                break
+            iteration += 1
+            self.model.setParam(GRB.Param.TimeLimit, remaining)
+            self.model.optimize()
+            if self.model.Status != GRB.OPTIMAL:
+                break
+            duals = dict(
+                zip(
+                    self.link_constrs,
+                    self.model.getAttr(GRB.Attr.Pi, list(self.link_constrs.values())),
+                )
+            )
+            sigmas = self.model.getAttr(GRB.Attr.Pi, self.convexity_constrs)
+            added, lagrangian = 0, self.model.ObjVal
+            for k, block in enumerate(self.blocks):
+                value, pattern = self.price(block, duals)
+                if pattern is None:
+                    continue
+                reduced_cost = value - sigmas[k]
+                lagrangian += min(0, reduced_cost)
+                if reduced_cost < -self.tolerance and self.add_pattern(k, pattern):
+                    added += 1
+            bound = max(bound, lagrangian)
+            Util.writeln(
+                self.log_file,
+                f"Iteration={iteration} MasterLP={self.model.ObjVal:.4f} "
+                f"Bound={bound:.4f} Added={added} "
+                f"Columns={sum(len(patterns) for patterns in self.patterns)}",
+            )
+            if not added:
+                break
+        # price-and-branch over the final column pool from the incumbent
+        self.model.setAttr(GRB.Attr.VType, variables, vtypes)
+        self.model.setAttr(GRB.Attr.Start, variables, values)
+        columns = [var for patterns in self.patterns for var in patterns.values()]
+        self.model.setAttr(GRB.Attr.VType, columns, [GRB.BINARY] * len(columns))
+        for k, block in enumerate(self.blocks):
+            key = tuple(sorted(key for key in incumbent if key[0] in block))
+            for pattern, var in self.patterns[k].items():
+                var.Start = 1 if pattern == key else 0
+        self.optimizer.start_vars.extend(variables + columns)
+        remaining = time_limit - (timeit.default_timer() - start_time)
+        self.model.setParam(GRB.Param.TimeLimit, max(1, remaining))
+        self.info = self.optimizer.solve()
+        Util.writeln(
+            self.log_file,
+            f"PriceAndBranch CompactLP={compact_bound} Bound={bound} "
+            f"LB={self.info.LB} UB={self.info.UB} Nodes={self.info.NOD}",
+        )
@@ -0,0 +1,314 @@
+import sys
+import copy
+from collections import OrderedDict, defaultdict
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+import gurobipy as gp
+from gurobipy import GRB
+from Instance import Type
+import Util
+
+# Problem-specific cuts separated at the root node (user cuts in a MIPNODE
+# callback, chained with any callback the optimizer already has):
+#   peak:   the load of a scenario is at least base_load - solar_load - the
+#           largest discharge of all batteries, plus the load of every activity
+#           in progress, so if activity a starts at t the peak is at least the
+#           largest such value over its slots: ETA_s >= m_s + sum_t c_ats Z_at.
+#           (The average load of a window is implied by C16 in the LP.)
+#   clique: activities that need more than half of the small (large) rooms can
+#           not overlap: sum V_at <= 1 over them in every slot.
+#   cover:  minimal covers of the room rows C12 and C13 at the relaxation.
+
+FAMILIES = ["peak", "clique", "cover"]
+
+
+class CutSeparator:
+    def __init__(self, optimizer, families):
+        self.optimizer = optimizer
+        self.instance = optimizer.instance
+        self.families = [f for f in families if f != "peak" or self.has_peak()]
+        self.tolerance = 1e-4
+        self.previous = optimizer.callback
+        self.reset()
+        self.z_keys = list(optimizer.Z_VAR.keys())
+        self.z_vars = list(optimizer.Z_VAR.values())
+        self.capacities = {
+            "small": self.instance.small_room_count,
+            "large": self.instance.large_room_count,
+        }
+        self.cliques = {kind: self.get_clique(kind) for kind in self.capacities}
+        if "peak" in self.families:
+            self.eta_vars = [optimizer.ETA_VAR[s] for s in optimizer.scenarios]
+            self.set_peak_coefficients()
+        optimizer.model.setParam(GRB.Param.PreCrush, 1)
+
+    def has_peak(self):
+        return hasattr(self.optimizer, "ETA_VAR")
+
+    def set_peak_coefficients(self):
+        optimizer = self.optimizer
+        net_loads = np.array(
+            [np.subtract(s.base_load, s.solar_load) for s in self.instance.scenarios],
+            dtype=float,
+        )
+        discharge = sum(
+            np.sqrt(b.efficiency) * b.max_power for b in self.instance.batteries
+        )
+        horizon = len(optimizer.slot_indices)
+        # the largest net load over the slots that map to a slot of the first
+        # week (recurring activities repeat every week)
+        mapped = np.array([optimizer.map_time(t) for t in range(horizon)])
+        weekly = np.full_like(net_loads, -np.inf)
+        for s in range(len(net_loads)):
+            np.maximum.at(weekly[s], mapped, net_loads[s])
+        self.peak_base = np.maximum(net_loads.max(axis=1) - discharge, 0)
+        self.peak_coefficients = OrderedDict()
+        windows = {}
+        for a, activity in optimizer.activities.items():
+            if not activity.start_times or activity.duration < 1:
+                continue
+            loads = weekly if activity.type == Type.R else net_loads
+            key = (activity.type, activity.duration)
+            if key not in windows:
+                padded = np.pad(
+                    loads, ((0, 0), (0, activity.duration - 1)), constant_values=-np.inf
+                )
+                windows[key] = sliding_window_view(
+                    padded, activity.duration, axis=1
+                ).max(axis=2)
+            power = activity.load_per_room * (
+                activity.small_rooms + activity.large_rooms
+            )
+            times = np.array(activity.start_times)
+            peaks = windows[key][:, times] - discharge + power
+            coefficients = np.maximum(peaks - self.peak_base[:, None], 0)
+            if coefficients.max() > self.tolerance:
+                self.peak_coefficients[a] = (times, coefficients)
+
+    def get_clique(self, kind):
+        capacity = self.capacities[kind]
+        members = sorted(
+            (
+                a
+                for a, activity in self.optimizer.activities.items()
+                if activity.start_times and self.room_count(a, kind) * 2 > capacity
+            ),
+            key=lambda a: -self.room_count(a, kind),
+        )
+        while len(members) >= 2 and (
+            self.room_count(members[-1], kind) + self.room_count(members[-2], kind)
+            <= capacity
+        ):
+            members.pop()
+        return members if len(members) >= 2 else []
+
+    def room_count(self, a, kind):
+        activity = self.optimizer.activities[a]
+        return activity.small_rooms if kind == "small" else activity.large_rooms
+
+    def progress_key(self, a, t):
+        if self.optimizer.activities[a].type == Type.R:
+            return a, self.optimizer.map_time(t)
+        return a, t
+
+    def get_progress(self, z):
+        # the relaxation values of V from those of Z, by slot of the horizon
+        progress = defaultdict(float)
+        for (a, t), value in z.items():
+            if value <= self.tolerance:
+                continue
+            for tp in range(t, t + self.optimizer.activities[a].duration):
+                progress[a, tp] += value
+        by_slot = defaultdict(list)
+        recurring = defaultdict(list)
+        for (a, t), value in progress.items():
+            if self.optimizer.activities[a].type == Type.R:
+                recurring[t].append((a, value))
+            else:
+                by_slot[t].append((a, value))
+        return by_slot, recurring
+
+    def slot_entries(self, by_slot, recurring, t):
+        return by_slot.get(t, []) + recurring.get(self.optimizer.map_time(t), [])
+
+    def separate_peak(self, z, eta):
+        cuts = []
+        for a, (times, coefficients) in self.peak_coefficients.items():
+            values = np.array([z[a, t] for t in times])
+            if values.max() <= self.tolerance:
+                continue
+            lhs = self.peak_base + coefficients @ values
+            for s in np.nonzero(lhs > np.array(eta) + self.tolerance)[0]:
+                s = int(s)
+                used = np.nonzero(coefficients[s] > self.tolerance)[0]
+                cuts.append(
+                    self.optimizer.ETA_VAR[s]
+                    >= float(self.peak_base[s])
+                    + gp.quicksum(
+                        float(coefficients[s, i])
+                        * self.optimizer.Z_VAR[a, int(times[i])]
+                        for i in used
+                    )
+                )
+        return cuts
+
+    def separate_clique(self, by_slot, recurring):
+        cuts = []
+        seen = set()
+        for kind, members in self.cliques.items():
+            if not members:
+                continue
+            members = set(members)
+            for t in self.optimizer.slot_indices:
+                entries = [
+                    (a, value)
+                    for a, value in self.slot_entries(by_slot, recurring, t)
+                    if a in members
+                ]
+                if sum(value for _, value in entries) <= 1 + self.tolerance:
+                    continue
+                keys = frozenset(
+                    key
+                    for key in (self.progress_key(a, t) for a in members)
+                    if key in self.optimizer.V_VAR
+                )
+                if keys in seen:
+                    continue
+                seen.add(keys)
+                cuts.append(
+                    gp.quicksum(self.optimizer.V_VAR[key] for key in sorted(keys)) <= 1
+                )
+        return cuts
+
+    def separate_cover(self, by_slot, recurring):
+        cuts = []
+        seen = set()
+        for kind, capacity in self.capacities.items():
+            for t in self.optimizer.slot_indices:
+                entries = [
+                    (a, value, self.room_count(a, kind))
+                    for a, value in self.slot_entries(by_slot, recurring, t)
+                    if self.room_count(a, kind) > 0
+                ]
+                if sum(rooms for _, _, rooms in entries) <= capacity:
+                    continue
+                # greedy cover by (1 - value) / rooms, then made minimal
+                entries.sort(key=lambda e: (1 - e[1]) / e[2])
+                cover, weight = [], 0
+                for entry in entries:
+                    cover.append(entry)
+                    weight += entry[2]
+                    if weight > capacity:
+                        break
+                for entry in sorted(cover, key=lambda e: e[1]):
+                    if weight - entry[2] > capacity:
+                        cover.remove(entry)
+                        weight -= entry[2]
+                value = sum(entry[1] for entry in cover)
+                if value <= len(cover) - 1 + self.tolerance:
+                    continue
+                keys = frozenset(self.progress_key(a, t) for a, _, _ in cover)
+                if keys in seen:
+                    continue
+                seen.add(keys)
+                cuts.append(
+                    gp.quicksum(self.optimizer.V_VAR[key] for key in sorted(keys))
+                    <= len(cover) - 1
+                )
+        return cuts
+
+    def reset(self):
+        # the rounds and the statistics of one solve
+        self.rounds = self.optimizer.setting.cut_rounds
+        self.root_bound = None
+        self.counts = OrderedDict((family, 0) for family in self.families)
+
+    def __call__(self, model, where):
+        if self.previous is not None:
+            self.previous(model, where)
+        if where != GRB.Callback.MIPNODE:
+            return
+        if model.cbGet(GRB.Callback.MIPNODE_STATUS) != GRB.OPTIMAL:
+            return
+        if model.cbGet(GRB.Callback.MIPNODE_NODCNT) > 0:
+            return
+        self.root_bound = model.cbGet(GRB.Callback.MIPNODE_OBJBND)
+        if self.rounds <= 0:
+            return
+        self.rounds -= 1
+        z = dict(zip(self.z_keys, model.cbGetNodeRel(self.z_vars)))
+        by_slot, recurring = self.get_progress(z)
+        for family in self.families:
+            if family == "peak":
+                cuts = self.separate_peak(z, model.cbGetNodeRel(self.eta_vars))
+            elif family == "clique":
+                cuts = self.separate_clique(by_slot, recurring)
+            else:
+                cuts = self.separate_cover(by_slot, recurring)
+            for cut in cuts:
+                model.cbCut(cut)
+            self.counts[family] += len(cuts)
+
+    def write_stats(self):
+        Util.writeln(
+            self.optimizer.log_file,
+            " ".join(f"Cuts[{family}]={count}" for family, count in self.counts.items())
+            + f" RootBound={self.root_bound}",
+        )
+
+
+def compare(instance, configurations=None):
+    # solves the instance without cuts, with every family alone and with all of
+    # them, and reports the root bound, its gap closure and the node count
+    from Optimizer import Optimizer
+
+    configurations = configurations or [[]] + [[f] for f in FAMILIES] + [FAMILIES]
+    rows = []
+    for families in configurations:
+        instance.setting = copy.copy(instance.setting)
+        instance.setting.cut_families = families
+        optimizer = Optimizer(instance)
+        optimizer.formulate()
+        if not families:
+            optimizer.callback = CutSeparator(optimizer, [])
+        info = optimizer.solve()
+        rows.append(
+            (
+                "+".join(families) or "none",
+                optimizer.callback.root_bound,
+                info.LB,
+                info.UB,
+                info.GAP,
+                info.NOD,
+                info.CPU,
+                sum(optimizer.callback.counts.values()),
+            )
+        )
+    best = min(row[3] for row in rows)
+    base = rows[0][1]
+    folder = Util.joinpath(instance.setting.main_dir, "output", "cuts")
+    Util.mkdir(folder)
+    writer = Util.Writer(
+        Util.joinpath(folder, f"{instance.name}_{Util.now()}.csv"), sep=","
+    )
+    fields = ["FAMILIES", "ROOT", "CLOSURE", "LB", "UB", "GAP", "NOD", "CPU", "CUTS"]
+    writer.pretty_out(fields, len(fields))
+    for name, root, lb, ub, gap, nodes, cpu, cuts in rows:
+        closure = np.nan
+        if root is not None and base is not None and best - base > 1e-9:
+            closure = (root - base) / (best - base)
+        values = [name, root, closure, lb, ub, gap, nodes, cpu, cuts]
+        writer.pretty_out(values, len(values))
+        print(f"{name:20} root {root} closure {closure:.4f} nodes {nodes} cuts {cuts}")
+    return rows
+
+
+if __name__ == "__main__":
+    from Setting import Setting
+    from Data import Data
+
+    setting = Setting()
+    key = sys.argv[1] if len(sys.argv) > 1 else setting.dataset_keys[0]
+    index = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+    setting.dataset_keys = [key]
+    compare(Data(setting).get_instance_by_index(key, index))
@@ -1,5 +1,9 @@
+import copy
 from collections import OrderedDict
 from Instance import Instance
+import Reduction
+import Analysis
+from Transfer import transfer_solution
 import Util
 from Setting import Setting
 
@@ -9,6 +13,7 @@ class Data:
         self.setting = setting
         self.datasets = OrderedDict()
         self.scenarios = OrderedDict()
+        self.transfer_source = None
         for key in setting.dataset_keys:
             instance_dir = Util.joinpath(setting.input_dir, key + "_instances")
             scenario_dir = Util.joinpath(setting.input_dir, key + "_scenarios")
@@ -29,9 +34,26 @@ class Data:
         instance = Instance(name, self.setting)
         instance.load_ppoi(file_path)
         instance.load_scenario(scenario_dir)
+        Reduction.reduce_scenarios(instance, self.setting.scenario_reduction)
         instance.set_activity_times()
         sol_name = instance.name.replace("instance", "instance_solution")
         sol_path = Util.joinpath(self.setting.startsol_dir, sol_name + ".txt")
-        instance.load_start_solution(sol_path)
+        if self.setting.transfer_source and not Util.exists(sol_path):
+            transfer_solution(self.get_transfer_source(), instance)
+        else:
+            instance.load_start_solution(sol_path)
+        if self.setting.analyse_activities and not self.setting.solver.fixsol:
+            Analysis.analyse_activities(instance)
         return instance
 
+    def get_transfer_source(self):
+        # the solved instance whose start solution is transferred to the
+        # instances without one, in the month of its phase
+        if self.transfer_source is None:
+            phase, index = self.setting.transfer_source
+            setting = copy.copy(self.setting)
+            setting.set_phase(phase)
+            setting.transfer_source = None
+            key = setting.dataset_keys[0]
+            self.transfer_source = Data(setting).get_instance_by_index(key, index)
+        return self.transfer_source
@@ -0,0 +1,186 @@
+import os
+import numpy as np
+import gurobipy as gp
+from gurobipy import GRB
+from Instance import Instance
+from Optimizer import Optimizer, SolutionInfo
+from Shared import SharedArray
+import Util
+
+# L-shaped (Benders) decomposition over the forecast scenarios. The master
+# problem keeps the activity schedule, the battery decisions and a single
+# controllable load C_t per slot. The price cost is linear in C and enters the
+# master as an expectation; the peak cost of every scenario,
+# 0.005 * max_t |C_t + base_t - solar_t| ** 2, is convex in C and is replaced by
+# THETA_s and the optimality cuts of the scenario evaluations. The evaluations
+# are closed-form and run in a pool of worker processes (that share the net
+# loads, see Shared.py) whenever the solver finds a new incumbent (lazy
+# constraints) or solves the root relaxation.
+
+PEAK_SLOTS = 8  # cuts per scenario and evaluation
+ROOT_ROUNDS = 20  # evaluations of the root relaxation per solve
+_net_loads = None
+
+
+def _init_worker(net_loads: SharedArray):
+    global _net_loads
+    _net_loads = net_loads.array
+
+
+def _evaluate_in_worker(args):
+    indices, load = args
+    return evaluate_peaks(_net_loads, indices, load)
+
+
+def evaluate_peaks(net_loads, indices, load, count=PEAK_SLOTS):
+    # the count largest absolute loads (and their slots) of every scenario
+    loads = net_loads[indices] + load
+    count = min(count, loads.shape[1])
+    peak_slots = np.argpartition(-np.abs(loads), count - 1, axis=1)[:, :count]
+    peaks = np.take_along_axis(loads, peak_slots, axis=1)
+    return indices, peak_slots, peaks
+
+
+class BendersOptimizer(Optimizer):
+    def __init__(self, instance: Instance) -> None:
+        self.net_loads = np.array(
+            [np.subtract(s.base_load, s.solar_load) for s in instance.scenarios]
+        )
+        self.probabilities = np.array([s.probability for s in instance.scenarios])
+        super().__init__(instance)
+        self.workers = self.setting.solver.workers or os.cpu_count()
+        self.pool = None
+        self.cut_count = 0
+        self.root_rounds = ROOT_ROUNDS
+        self.tolerance = 1e-4
+        self.callback = self.add_benders_cuts
+        self.model.setParam(GRB.Param.LazyConstraints, 1)
+        self.model.setParam(GRB.Param.PreCrush, 1)
+
+    def create_load_variables(self):
+        self.C_VAR = self.model.addVars(
+            self.slot_indices,
+            name="C",
+            lb=-GRB.INFINITY,
+            ub=GRB.INFINITY,
+            vtype=GRB.CONTINUOUS,
+        )
+
+        self.THETA_VAR = self.model.addVars(
+            (s for s in self.scenarios),
+            name="THETA",
+            vtype=GRB.CONTINUOUS,
+        )
+
+    def load_cost(self):
+        prices = np.array([s.price for s in self.instance.scenarios], dtype=float)
+        prices = prices / (self.slots_per_hour * 1000)
+        expected_price = self.probabilities @ prices
+        constant = float(self.probabilities @ (prices * self.net_loads).sum(axis=1))
+        return (
+            gp.quicksum(self.C_VAR[t] * expected_price[t] for t in self.slot_indices)
+            + constant
+            + gp.quicksum(
+                self.THETA_VAR[s] * self.probabilities[s] for s in self.scenarios
+            )
+        )
+
+    def create_load_constraints(self):
+        self.model.addConstrs(
+            (self.C_VAR[t] == self.controllable_load(t) for t in self.slot_indices),
+            name="C11",
+        )
+        self.c_vars = [self.C_VAR[t] for t in self.slot_indices]
+        self.theta_vars = [self.THETA_VAR[s] for s in self.scenarios]
+        self.add_initial_cuts()
+
+    def add_initial_cuts(self):
+        # cuts at the uncontrolled load bound THETA from the start
+        self.initial_cuts = []
+        for cut, _ in self.get_cuts(np.zeros(len(self.slot_indices))):
+            self.initial_cuts.append(self.model.addLConstr(cut))
+            self.cut_count += 1
+
+    def evaluate(self, load):
+        if self.pool is None:
+            return [
+                evaluate_peaks(self.net_loads, np.arange(len(self.scenarios)), load)
+            ]
+        chunks = np.array_split(np.arange(len(self.scenarios)), self.workers)
+        return self.pool.map(
+            _evaluate_in_worker, [(chunk, load) for chunk in chunks if len(chunk)]
+        )
+
+    def get_cuts(self, load):
+        # f(C) >= 0.005 * (C_t + base_t - solar_t) ** 2 for every slot t, so the
+        # tangents at the largest loads are valid optimality cuts
+        cuts = []
+        for indices, peak_slots, peaks in self.evaluate(load):
+            for s, slots, values in zip(indices, peak_slots, peaks):
+                for t, peak in zip(slots, values):
+                    s, t, peak = int(s), int(t), float(peak)
+                    value = 0.005 * peak**2
+                    cut = self.THETA_VAR[s] >= value + 0.01 * peak * (
+                        self.C_VAR[t] - float(load[t])
+                    )
+                    cuts.append((cut, (s, value)))
+        return cuts
+
+    def add_benders_cuts(self, model, where):
+        if where == GRB.Callback.MIPSOL:
+            load = np.array(model.cbGetSolution(self.c_vars))
+            theta = model.cbGetSolution(self.theta_vars)
+            add = model.cbLazy
+        elif where == GRB.Callback.MIPNODE:
+            if model.cbGet(GRB.Callback.MIPNODE_STATUS) != GRB.OPTIMAL:
+                return
+            if model.cbGet(GRB.Callback.MIPNODE_NODCNT) > 0 or self.root_rounds <= 0:
+                return
+            self.root_rounds -= 1
+            load = np.array(model.cbGetNodeRel(self.c_vars))
+            theta = model.cbGetNodeRel(self.theta_vars)
+            add = model.cbCut
+        else:
+            return
+        for cut, (s, value) in self.get_cuts(load):
+            if theta[s] < value - self.tolerance * max(1, value):
+                add(cut)
+                self.cut_count += 1
+
+    def solve(self) -> SolutionInfo:
+        self.root_rounds = ROOT_ROUNDS
+        net_loads = None
+        if self.workers > 1 and len(self.scenarios) > 1:
+            # the workers attach to the net loads instead of copying them
+            net_loads = SharedArray.publish(self.net_loads)
+            self.pool = Util.get_pool(self.workers, _init_worker, (net_loads,))
+        try:
+            info = super().solve()
+        finally:
+            if self.pool is not None:
+                self.pool.close()
+                self.pool.join()
+                self.pool = None
+                net_loads.release()
+        Util.writeln(self.log_file, f"BendersCuts={self.cut_count}")
+        return info
+
+    def update_forecasts(self, base_load, solar_load, price, probabilities=None):
+        # the forecasts are in net_loads, the objective (expected price and
+        # constant) and the initial cuts; the lazy cuts of a solve do not stay
+        base_load, solar_load, price = self.set_forecasts(
+            base_load, solar_load, price, probabilities
+        )
+        self.net_loads = base_load - solar_load
+        self.probabilities = np.array([s.probability for s in self.instance.scenarios])
+        self.model.remove(self.initial_cuts)
+        self.add_initial_cuts()
+        self.create_objective()
+
+    def get_loads(self):
+        load = np.array([self.C_VAR[t].x for t in self.slot_indices])
+        return (self.net_loads + load).T.tolist()
+
+    def get_peaks(self):
+        load = np.array([self.C_VAR[t].x for t in self.slot_indices])
+        return np.abs(self.net_loads + load).max(axis=1).tolist()
@@ -0,0 +1,197 @@
+import math
+import timeit
+from collections import OrderedDict
+import numpy as np
+from Instance import Type
+from Optimizer import Optimizer
+import Util
+
+# Battery dispatch for a fixed activity schedule. A battery changes its state
+# of charge by max_power / slots_per_hour in every charging or discharging slot,
+# so its states lie on a lattice and a dynamic program over (slot, state) finds
+# the cheapest modes exactly. The peak term couples slots and batteries: it is
+# replaced by caps on the absolute load of every scenario with a large penalty
+# above the cap, the batteries are dispatched one at a time against the load of
+# the others (coordinate descent), and the cap level is searched on the exact
+# expected cost (price and quadratic peak).
+
+CHARGE, IDLE, DISCHARGE = 0, 1, 2  # as in battery_bt_mode
+ORDER = [IDLE, CHARGE, DISCHARGE]  # idle wins ties
+CAP_PENALTY = 1000  # per kW above a cap
+GRID_POINTS = 9
+SEARCH_ROUNDS = 12
+PASSES = 3
+
+
+def golden_section(func, low, high, rounds=SEARCH_ROUNDS):
+    ratio = (math.sqrt(5) - 1) / 2
+    for _ in range(rounds):
+        left = high - ratio * (high - low)
+        right = low + ratio * (high - low)
+        if func(left) <= func(right):
+            high = right
+        else:
+            low = left
+    return (low + high) / 2
+
+
+class BatteryDispatcher:
+    def __init__(self, optimizer: Optimizer):
+        self.optimizer = optimizer
+        self.instance = optimizer.instance
+        self.horizon = len(optimizer.slot_indices)
+        scenarios = self.instance.scenarios
+        self.probabilities = np.array([s.probability for s in scenarios])
+        self.prices = np.array([s.price for s in scenarios], dtype=float) / (
+            self.instance.time.slots_per_hour * 1000
+        )
+        self.expected_price = self.probabilities @ self.prices
+        self.net_loads = np.array(
+            [np.subtract(s.base_load, s.solar_load) for s in scenarios], dtype=float
+        )
+        self.mapped_times = np.array(
+            [optimizer.map_time(t) for t in range(self.horizon)]
+        )
+        self.deltas = OrderedDict()
+        self.states = OrderedDict()
+        for b, battery in optimizer.batteries.items():
+            step, lowest, highest = optimizer.battery_levels(b)
+            if step <= 0:
+                continue
+            power = battery.max_power / math.sqrt(battery.efficiency)
+            delta = np.zeros(3)
+            delta[CHARGE] = power
+            delta[DISCHARGE] = -battery.efficiency * power
+            self.deltas[b] = delta
+            self.states[b] = (lowest, highest)
+
+    def activity_load(self, activity_start):
+        load = np.zeros(self.horizon)
+        for a, start in activity_start.items():
+            activity = self.optimizer.activities[a]
+            power = activity.load_per_room * (
+                activity.small_rooms + activity.large_rooms
+            )
+            if activity.type == Type.R:
+                in_progress = (self.mapped_times >= start) & (
+                    self.mapped_times < start + activity.duration
+                )
+                load[in_progress] += power
+            else:
+                load[start : start + activity.duration] += power
+        return load
+
+    def battery_load(self, b, modes):
+        return self.deltas[b][modes]
+
+    def cost(self, loads):
+        # expected price and peak cost of the loads of every scenario
+        price_cost = (self.prices * loads).sum(axis=1)
+        peak_cost = 0.005 * np.abs(loads).max(axis=1) ** 2
+        return float(self.probabilities @ (price_cost + peak_cost))
+
+    def dispatch_battery(self, b, other_loads, caps):
+        lowest, highest = self.states[b]
+        count = highest - lowest + 1
+        delta = self.deltas[b]
+        loads = other_loads[None, :, :] + delta[:, None, None]
+        excess = np.maximum(np.abs(loads) - caps[None, :, None], 0)
+        costs = delta[:, None] * self.expected_price[None, :] + CAP_PENALTY * (
+            np.tensordot(self.probabilities, excess, axes=([0], [1]))
+        )
+        value = np.full(count, np.inf)
+        value[-lowest] = 0
+        choices = np.empty((self.horizon, count), dtype=np.int8)
+        candidates = np.empty((3, count))
+        for t in range(self.horizon):
+            # state j is reached from j by idling, j - 1 by charging and j + 1 by
+            # discharging (rows in ORDER)
+            candidates.fill(np.inf)
+            candidates[0] = value + costs[IDLE, t]
+            candidates[1, 1:] = value[:-1] + costs[CHARGE, t]
+            candidates[2, :-1] = value[1:] + costs[DISCHARGE, t]
+            choices[t] = candidates.argmin(axis=0)
+            value = candidates[choices[t], np.arange(count)]
+        modes = np.empty(self.horizon, dtype=np.int64)
+        state = int(value.argmin())
+        for t in range(self.horizon - 1, -1, -1):
+            mode = ORDER[choices[t, state]]
+            modes[t] = mode
+            state += mode - 1
+        return modes
+
+    def dispatch(self, base_loads, caps):
+        modes = OrderedDict(
+            (b, np.full(self.horizon, IDLE, dtype=np.int64)) for b in self.deltas
+        )
+        total = base_loads.copy()
+        for _ in range(PASSES):
+            changed = False
+            for b in self.deltas:
+                other_loads = total - self.battery_load(b, modes[b])
+                new_modes = self.dispatch_battery(b, other_loads, caps)
+                if not np.array_equal(new_modes, modes[b]):
+                    changed = True
+                    modes[b] = new_modes
+                total = other_loads + self.battery_load(b, modes[b])
+            if not changed:
+                break
+        return modes, self.cost(total)
+
+    def run(self, activity_start):
+        start_time = timeit.default_timer()
+        base_loads = self.net_loads + self.activity_load(activity_start)
+        peaks = np.abs(base_loads).max(axis=1)
+        best_modes = OrderedDict(
+            (b, np.full(self.horizon, IDLE, dtype=np.int64)) for b in self.deltas
+        )
+        best_cost = self.cost(base_loads)
+        evaluated = {}
+
+        def evaluate(reductions):
+            nonlocal best_modes, best_cost
+            reductions = tuple(reductions)
+            if reductions not in evaluated:
+                caps = np.maximum(peaks - np.array(reductions), 0)
+                modes, cost = self.dispatch(base_loads, caps)
+                evaluated[reductions] = cost
+                if cost < best_cost:
+                    best_modes, best_cost = modes, cost
+            return evaluated[reductions]
+
+        if self.deltas:
+            # the same reduction of every peak, from caps above the largest
+            # possible peak (price arbitrage only) to the largest possible
+            # reduction, then the reduction of every scenario on its own
+            low = -sum(delta[CHARGE] for delta in self.deltas.values())
+            high = -sum(delta[DISCHARGE] for delta in self.deltas.values())
+            count = len(peaks)
+            grid = np.linspace(low, high, GRID_POINTS).tolist()
+            step = grid[1] - grid[0]
+            uniform = min(grid, key=lambda r: evaluate([r] * count))
+            uniform = golden_section(
+                lambda r: evaluate([r] * count), uniform - step, uniform + step
+            )
+            reductions = [uniform] * count
+            for s in range(count):
+
+                def evaluate_scenario(r):
+                    return evaluate(reductions[:s] + [r] + reductions[s + 1 :])
+
+                reductions[s] = golden_section(
+                    evaluate_scenario, reductions[s] - step, reductions[s] + step
+                )
+        battery_bt_mode = OrderedDict(
+            ((b, t), int(mode))
+            for b, modes in best_modes.items()
+            for t, mode in enumerate(modes)
+            if mode != IDLE
+        )
+        self.elapsed = timeit.default_timer() - start_time
+        self.load_cost = best_cost
+        Util.writeln(
+            self.optimizer.log_file,
+            f"Dispatch Time={self.elapsed:.3f} LoadCost={best_cost:.4f} "
+            f"Evaluations={len(evaluated)}",
+        )
+        return battery_bt_mode
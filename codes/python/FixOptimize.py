@@ -0,0 +1,187 @@
+import random
+import timeit
+from collections import OrderedDict
+from gurobipy import GRB
+from Instance import Type
+from Optimizer import Optimizer
+import Util
+
+# Fix-and-optimize on top of an Optimizer with an incumbent. A neighbourhood
+# frees the start times of some activities (within a range of slots) and the
+# battery modes of some slots, everything else is fixed at the incumbent
+# through bounds (as fix_activities does), and the neighbourhood is re-solved
+# with a short time limit from the incumbent. The peak term is global, so the
+# largest load of every scenario outside the slots a neighbourhood can change
+# is carried into the subproblem as a lower bound of ETA.
+
+
+class Neighbourhood:
+    def __init__(self, name):
+        self.name = name
+        self.activities = OrderedDict()  # activity -> (first, last) start slot
+        self.battery_slots = set()  # (battery, slot)
+
+
+class FixAndOptimize:
+    def __init__(self, optimizer: Optimizer, seed=0):
+        self.optimizer = optimizer
+        self.setting = optimizer.setting
+        self.instance = optimizer.instance
+        self.random = random.Random(seed)
+        self.window_slots = self.setting.window_days * self.instance.time.slots_per_day
+        self.window_time_limit = self.setting.window_runtime
+        self.history = []
+        self.read_incumbent()
+
+    def read_incumbent(self):
+        optimizer = self.optimizer
+        self.objective = optimizer.model.objVal
+        self.activity_start, self.battery_bt_mode = optimizer.get_schedule()
+        self.loads = optimizer.get_loads()
+
+    def window(self, first, last):
+        neighbourhood = Neighbourhood(f"window_{first}_{last}")
+        first_monday = self.instance.first_monday_slot
+        first_week = first < first_monday + self.instance.time.slots_per_week
+        first_week = first_week and last >= first_monday
+        for a, activity in self.optimizer.activities.items():
+            start = self.activity_start.get(a)
+            if activity.type == Type.R and not first_week:
+                continue
+            if start is None or first <= start <= last:
+                neighbourhood.activities[a] = (first, last)
+        neighbourhood.battery_slots.update(
+            (b, t) for b in self.optimizer.batteries for t in range(first, last + 1)
+        )
+        return neighbourhood
+
+    def affected_slots(self, neighbourhood: Neighbourhood):
+        slots = set(t for _, t in neighbourhood.battery_slots)
+        for a, (first, last) in neighbourhood.activities.items():
+            activity = self.optimizer.activities[a]
+            if activity.type == Type.R:
+                return set(self.optimizer.slot_indices)
+            slots.update(range(first, last + activity.duration))
+            if a in self.activity_start:
+                start = self.activity_start[a]
+                slots.update(range(start, start + activity.duration))
+        return slots
+
+    def fix(self, neighbourhood: Neighbourhood):
+        optimizer = self.optimizer
+        if "fix_and_optimize" not in optimizer.snapshots:
+            optimizer.save_bounds(
+                "fix_and_optimize",
+                list(optimizer.Z_VAR.values())
+                + list(optimizer.W_VAR.values())
+                + list(optimizer.X_VAR.values())
+                + list(optimizer.Y_VAR.values())
+                + list(optimizer.ETA_VAR.values()),
+            )
+        z_lbs, z_ubs = [], []
+        for a, t in optimizer.Z_VAR:
+            if a in neighbourhood.activities:
+                first, last = neighbourhood.activities[a]
+                z_lbs.append(0)
+                z_ubs.append(
+                    1 if first <= t <= last or self.activity_start.get(a) == t else 0
+                )
+            else:
+                value = 1 if self.activity_start.get(a) == t else 0
+                z_lbs.append(value)
+                z_ubs.append(value)
+        w_lbs, w_ubs = [], []
+        for a in optimizer.W_VAR:
+            if a in neighbourhood.activities:
+                w_lbs.append(0)
+                w_ubs.append(1)
+            else:
+                value = 1 if a in self.activity_start else 0
+                w_lbs.append(value)
+                w_ubs.append(value)
+        x_lbs, x_ubs, y_lbs, y_ubs = [], [], [], []
+        for key in optimizer.X_VAR:
+            if key in neighbourhood.battery_slots:
+                x_lbs.append(0)
+                y_lbs.append(0)
+                x_ubs.append(0 if key in optimizer.no_charge else 1)
+                y_ubs.append(0 if key in optimizer.no_discharge else 1)
+            else:
+                mode = self.battery_bt_mode.get(key, 1)
+                x_lbs.append(1 if mode == 0 else 0)
+                y_lbs.append(1 if mode == 2 else 0)
+                x_ubs.append(x_lbs[-1])
+                y_ubs.append(y_lbs[-1])
+        affected = self.affected_slots(neighbourhood)
+        eta_lbs = [
+            max(
+                (
+                    abs(self.loads[t][s])
+                    for t in optimizer.slot_indices
+                    if t not in affected
+                ),
+                default=0,
+            )
+            for s in optimizer.ETA_VAR
+        ]
+        for variables, lbs, ubs in [
+            (optimizer.Z_VAR, z_lbs, z_ubs),
+            (optimizer.W_VAR, w_lbs, w_ubs),
+            (optimizer.X_VAR, x_lbs, x_ubs),
+            (optimizer.Y_VAR, y_lbs, y_ubs),
+        ]:
+            optimizer.set_attr(GRB.Attr.LB, variables.values(), lbs)
+            optimizer.set_attr(GRB.Attr.UB, variables.values(), ubs)
+        optimizer.set_attr(GRB.Attr.LB, optimizer.ETA_VAR.values(), eta_lbs)
+
+    def release(self):
+        # back to the bounds before the first neighbourhood was fixed
+        if "fix_and_optimize" in self.optimizer.snapshots:
+            self.optimizer.restore_bounds("fix_and_optimize")
+
+    def solve_neighbourhood(self, neighbourhood: Neighbourhood, time_limit):
+        self.fix(neighbourhood)
+        self.optimizer.set_start(self.activity_start, self.battery_bt_mode)
+        self.optimizer.model.setParam(GRB.Param.TimeLimit, max(1, time_limit))
+        start_time = timeit.default_timer()
+        info = self.info = self.optimizer.solve()
+        elapsed = timeit.default_timer() - start_time
+        improvement = 0
+        if self.optimizer.model.SolCount > 0 and info.UB < self.objective - 1e-6:
+            improvement = self.objective - info.UB
+            self.read_incumbent()
+        self.history.append((neighbourhood.name, elapsed, improvement, self.objective))
+        Util.writeln(
+            self.optimizer.log_file,
+            f"Neighbourhood={neighbourhood.name} Time={elapsed:.2f} "
+            f"Improvement={improvement:.4f} Objective={self.objective:.4f}",
+        )
+        return improvement, elapsed
+
+    def next_window(self, first):
+        horizon = len(self.optimizer.slot_indices)
+        if self.setting.window_randomise:
+            first = self.random.randrange(0, max(1, horizon - self.window_slots // 2))
+        last = min(first + self.window_slots, horizon) - 1
+        return first, last
+
+    def run(self, time_limit):
+        start_time = timeit.default_timer()
+        horizon = len(self.optimizer.slot_indices)
+        step = max(1, self.window_slots // 2)
+        first = 0
+        idle_windows = 0
+        while idle_windows < horizon / step:
+            remaining = time_limit - (timeit.default_timer() - start_time)
+            if remaining <= 1:
+                break
+            first, last = self.next_window(first)
+            improvement, _ = self.solve_neighbourhood(
+                self.window(first, last), min(self.window_time_limit, remaining)
+            )
+            idle_windows = 0 if improvement > 0 else idle_windows + 1
+            first = first + step if first + step < horizon else 0
+        # leave the incumbent as the current solution of the model, with the
+        # bounds of before
+        self.solve_neighbourhood(Neighbourhood("incumbent"), self.window_time_limit)
+        self.release()
@@ -0,0 +1,328 @@
+import os
+import math
+import argparse
+from datetime import timedelta
+import numpy as np
+from Setting import Setting
+from Time import Time, get_datetime
+import Util
+
+# Writes synthetic ppoi instances together with the matching price and
+# forecast (*_submission.csv) files, so larger sites can be studied with the
+# existing Data/Instance loaders. Activities, rooms, batteries and the daily
+# load/solar/price profiles are resampled from the competition files.
+
+TEMPLATE_DIR = Util.joinpath(
+    os.path.dirname(os.path.abspath(__file__)), "..", "..", "COMPETITION DATASET FILES"
+)
+OFFICE_HOURS_PER_WEEK = 5 * 8
+ROOM_UTILISATION = 0.5
+MAX_RECURRING_DEPTH = 5  # a prerequisite must be on an earlier day (Mon-Fri)
+
+
+class GeneratorSetting:
+    def __init__(self):
+        self.name = "synthetic"
+        self.seed = 0
+        self.instances = 1
+        self.buildings = 6
+        self.small_rooms = None  # total over all buildings, None: scaled template
+        self.large_rooms = None
+        self.batteries = 2
+        self.recurring = 50
+        self.onceoff = 20
+        self.precedence_density = None  # mean prerequisites per activity
+        self.days = 30
+        self.scenarios = 6
+        self.real_data = False  # also write an All_data.csv style meter file
+        self.template_dir = TEMPLATE_DIR
+        self.template_key = "phase_2"
+
+
+class SeriesProfile:
+    def __init__(self, series, slots_per_day):
+        days = len(series) // slots_per_day
+        daily = np.array(series[: days * slots_per_day]).reshape(days, slots_per_day)
+        self.shape = daily.mean(axis=0)
+        level = max(abs(self.shape.mean()), 1e-6)
+        self.day_sigma = float(np.std(daily.mean(axis=1)) / level)
+        self.noise = float(np.std(daily - self.shape))
+        self.spread = 0.0
+
+    def sample(self, rng, days, slots_per_day, scale=1.0):
+        shape = np.interp(
+            np.linspace(0, 1, slots_per_day, endpoint=False),
+            np.linspace(0, 1, len(self.shape), endpoint=False),
+            self.shape,
+        )
+        factors = rng.lognormal(0, self.day_sigma, days)
+        series = np.outer(factors, shape).ravel() * scale
+        return series + rng.normal(0, self.noise * scale, len(series))
+
+
+class Profile:
+    def __init__(self, template_dir=TEMPLATE_DIR, key="phase_2"):
+        instance_dir = Util.joinpath(template_dir, key + "_instances")
+        scenario_dir = Util.joinpath(template_dir, key + "_scenarios")
+        self.batteries = []  # (capacity, max_power, efficiency)
+        self.recurring = []  # (rooms, large, load_per_room, duration)
+        self.onceoff = []  # (rooms, large, load_per_room, duration, revenue, penalty)
+        self.prerequisites_r = []
+        self.prerequisites_o = []
+        self.room_ratio = []  # (small_rooms, large_rooms) per recurring activity
+        for file_path in Util.getFileList(instance_dir):
+            self._load_ppoi(file_path)
+        scenario_files = Util.getFileList(scenario_dir)
+        self._load_loads([f for f in scenario_files if "submission" in f])
+        self._load_price([f for f in scenario_files if "PRICE_AND_DEMAND" in f][0])
+
+    def _load_ppoi(self, file_path):
+        with open(file_path, "r") as file:
+            lines = file.readlines()
+        header = Util.rx.findall(lines[0])
+        small, large = 0, 0
+        for l in lines[1:]:
+            line = [float(i) for i in Util.rx.findall(l)]
+            entity = l[0]
+            if entity == "b":
+                small += int(line[1])
+                large += int(line[2])
+            elif entity == "c":
+                self.batteries.append((line[2], line[3], line[4]))
+            elif entity == "r":
+                large_room = "S" not in l
+                self.recurring.append((int(line[1]), large_room, line[2], int(line[3])))
+                self.prerequisites_r.append(int(line[4]))
+            elif entity == "a":
+                large_room = "S" not in l
+                self.onceoff.append(
+                    (int(line[1]), large_room, line[2], int(line[3]), line[4], line[5])
+                )
+                self.prerequisites_o.append(int(line[6]))
+        self.room_ratio.append((small / int(header[3]), large / int(header[3])))
+
+    def _load_loads(self, load_files):
+        series = {}
+        for load_file in load_files:
+            with open(load_file, "r") as file:
+                for l in file.readlines():
+                    line = l.split(",")
+                    series.setdefault(line[0], []).append([float(s) for s in line[1:]])
+        slots_per_day = 24 * 4
+        self.base_load = []
+        self.solar_load = []
+        for name, values in series.items():
+            values = np.array(values)
+            profile = SeriesProfile(values.mean(axis=0), slots_per_day)
+            if len(values) > 1:
+                profile.spread = float(values.std(axis=0).mean())
+            if "Building" in name:
+                self.base_load.append(profile)
+            elif "Solar" in name:
+                self.solar_load.append(profile)
+
+    def _load_price(self, price_file):
+        with open(price_file, "r") as file:
+            price_lines = file.readlines()
+        prices = [float(l.split(",")[3]) for l in price_lines[1:]]
+        self.price = SeriesProfile(prices, 24 * 2)
+
+
+class Generator:
+    def __init__(self, setting: Setting, config: GeneratorSetting):
+        self.setting = setting
+        self.config = config
+        last_day = get_datetime(setting.start_date) + timedelta(days=config.days - 1)
+        setting.end_date = last_day.strftime("%y-%m-%d")
+        setting.dataset_keys = [config.name]
+        self.time = Time(setting)
+        self.profile = Profile(config.template_dir, config.template_key)
+        self.instance_dir = Util.joinpath(setting.input_dir, config.name + "_instances")
+        self.scenario_dir = Util.joinpath(setting.input_dir, config.name + "_scenarios")
+        seeds = np.random.SeedSequence(config.seed).spawn(
+            config.instances + config.scenarios + 1
+        )
+        self.instance_rngs = [
+            np.random.default_rng(s) for s in seeds[: config.instances]
+        ]
+        self.scenario_rngs = [
+            np.random.default_rng(s) for s in seeds[config.instances : -1]
+        ]
+        self.rng = np.random.default_rng(seeds[-1])
+
+    def run(self):
+        Util.mkdir(self.instance_dir)
+        Util.mkdir(self.scenario_dir)
+        for i in range(self.config.instances):
+            file_name = f"{self.config.name}_instance_{i}.txt"
+            self.write_ppoi(Util.joinpath(self.instance_dir, file_name), i)
+        self.write_scenarios()
+
+    def _room_totals(self, rng, recurring):
+        ratio = self.profile.room_ratio[rng.integers(len(self.profile.room_ratio))]
+        totals = [self.config.small_rooms, self.config.large_rooms]
+        for k in range(2):
+            if totals[k] is None:
+                totals[k] = math.ceil(ratio[k] * self.config.recurring)
+            demand = sum(r[0] * r[3] for r in recurring if r[1] == bool(k))
+            office_slots = OFFICE_HOURS_PER_WEEK * self.time.slots_per_hour
+            needed = math.ceil(demand / (office_slots * ROOM_UTILISATION))
+            totals[k] = max(totals[k], needed)
+        return totals
+
+    def _prerequisites(self, rng, count, density, max_depth):
+        depth = []
+        prerequisites = []
+        for i in range(count):
+            candidates = [p for p in range(i) if depth[p] < max_depth]
+            n = min(rng.poisson(density), len(candidates))
+            chosen = sorted(rng.choice(candidates, n, replace=False)) if n else []
+            depth.append(1 + max((depth[p] for p in chosen), default=0))
+            prerequisites.append([int(p) for p in chosen])
+        return prerequisites
+
+    def _fit_rooms(self, rows, totals):
+        fitted = []
+        for row in rows:
+            rooms, large = row[0], row[1]
+            if totals[int(large)] == 0:
+                large = not large
+            rooms = max(1, min(rooms, totals[int(large)]))
+            fitted.append((rooms, large) + tuple(row[2:]))
+        return fitted
+
+    def write_ppoi(self, file_path, index):
+        rng = self.instance_rngs[index]
+        config = self.config
+        profile = self.profile
+        recurring = [
+            profile.recurring[k]
+            for k in rng.integers(len(profile.recurring), size=config.recurring)
+        ]
+        onceoff = [
+            profile.onceoff[k]
+            for k in rng.integers(len(profile.onceoff), size=config.onceoff)
+        ]
+        totals = self._room_totals(rng, recurring)
+        recurring = self._fit_rooms(recurring, totals)
+        onceoff = self._fit_rooms(onceoff, totals)
+        density_r = config.precedence_density
+        density_o = config.precedence_density
+        if density_r is None:
+            density_r = float(np.mean(profile.prerequisites_r))
+            density_o = float(np.mean(profile.prerequisites_o))
+        prerequisites_r = self._prerequisites(
+            rng, config.recurring, density_r, MAX_RECURRING_DEPTH
+        )
+        prerequisites_o = self._prerequisites(
+            rng, config.onceoff, density_o, max(1, config.days * 5 // 7 - 1)
+        )
+        shares = rng.dirichlet(np.ones(config.buildings), size=2)
+        small = rng.multinomial(totals[0], shares[0])
+        large = rng.multinomial(totals[1], shares[1])
+
+        lines = [
+            f"ppoi {config.buildings} {config.buildings} {config.batteries} {config.recurring} {config.onceoff}"
+        ]
+        lines.extend(f"b {b} {small[b]} {large[b]}" for b in range(config.buildings))
+        lines.extend(f"s {b} {b}" for b in range(config.buildings))
+        for c in range(config.batteries):
+            capacity, max_power, efficiency = profile.batteries[
+                rng.integers(len(profile.batteries))
+            ]
+            building = rng.integers(config.buildings)
+            lines.append(
+                f"c {c} {building} {capacity:g} {max_power:g} {efficiency:.2f}"
+            )
+        for r, (rooms, large_room, load, duration) in enumerate(recurring):
+            line = f"r {r} {rooms} {'L' if large_room else 'S'} {load:g} {duration}"
+            line += f" {len(prerequisites_r[r])}"
+            line += "".join(f" {p}" for p in prerequisites_r[r])
+            lines.append(line)
+        for o, (rooms, large_room, load, duration, revenue, penalty) in enumerate(
+            onceoff
+        ):
+            line = f"a {o} {rooms} {'L' if large_room else 'S'} {load:g} {duration}"
+            line += f" {revenue:g} {penalty:g} {len(prerequisites_o[o])}"
+            line += "".join(f" {p}" for p in prerequisites_o[o])
+            lines.append(line)
+        with open(file_path, "w") as file:
+            file.write("\n".join(lines) + "\n")
+
+    def write_scenarios(self):
+        config = self.config
+        profile = self.profile
+        days = config.days
+        slots_per_day = self.time.slots_per_day
+        horizon = len(self.time.slots)
+
+        base_load = []
+        solar_load = []
+        for b in range(config.buildings):
+            scale = 1.0 if b < len(profile.base_load) else self.rng.lognormal(0, 0.3)
+            base = profile.base_load[b % len(profile.base_load)]
+            solar = profile.solar_load[b % len(profile.solar_load)]
+            base_load.append(
+                (base, np.abs(base.sample(self.rng, days, slots_per_day, scale)))
+            )
+            solar_load.append(
+                (
+                    solar,
+                    np.clip(
+                        solar.sample(self.rng, days, slots_per_day, scale), 0, None
+                    ),
+                )
+            )
+
+        lines = ["REGION,SETTLEMENTDATE,TOTALDEMAND,RRP,PERIODTYPE"]
+        price = profile.price.sample(self.rng, days, slots_per_day // 2)
+        demand = self.rng.uniform(3000, 6000, len(price))
+        for index, pr in enumerate(price):
+            date = self.time.slots[2 * index].interval.a.strftime("%Y/%m/%d %H:%M:%S")
+            lines.append(f"VIC1,{date},{demand[index]:.2f},{pr:.2f},TRADE")
+        price_file = f"PRICE_AND_DEMAND_{config.name}.csv"
+        with open(Util.joinpath(self.scenario_dir, price_file), "w") as file:
+            file.write("\n".join(lines) + "\n")
+
+        for s, rng in enumerate(self.scenario_rngs):
+            lines = []
+            for entity, loads in (("Building", base_load), ("Solar", solar_load)):
+                for b, (series_profile, truth) in enumerate(loads):
+                    noise = rng.normal(0, series_profile.spread, horizon)
+                    values = np.clip(truth + noise, 0, None)
+                    lines.append(f"{entity}{b}," + ",".join(f"{v:.4f}" for v in values))
+            file_name = f"{config.name}_{s}_submission.csv"
+            with open(Util.joinpath(self.scenario_dir, file_name), "w") as file:
+                file.write("\n".join(lines) + "\n")
+
+        if config.real_data:
+            lines = []
+            for entity, loads in (("Building", base_load), ("Solar", solar_load)):
+                for b, (_, truth) in enumerate(loads):
+                    for t, slot in enumerate(self.time.slots):
+                        date = slot.interval.a.strftime("%Y-%m-%d %H:%M:%S")
+                        lines.append(
+                            f'"{len(lines)}","{entity}{b}",{date},{truth[t]:.1f}'
+                        )
+            with open(Util.joinpath(self.scenario_dir, "All_data.csv"), "w") as file:
+                file.write("\n".join(lines) + "\n")
+
+
+if __name__ == "__main__":
+    config = GeneratorSetting()
+    parser = argparse.ArgumentParser(description="Synthetic ppoi instance generator")
+    for key, value in vars(config).items():
+        kind = type(value) if value is not None else float
+        if isinstance(value, bool):
+            parser.add_argument(f"--{key}", action="store_true", default=value)
+        else:
+            parser.add_argument(f"--{key}", type=kind, default=value)
+    args = parser.parse_args()
+    for key, value in vars(args).items():
+        setattr(config, key, value)
+    for key in ("small_rooms", "large_rooms"):
+        if getattr(config, key) is not None:
+            setattr(config, key, int(getattr(config, key)))
+    setting = Setting()
+    Generator(setting, config).run()
+    print(f"Wrote {config.name} to {setting.input_dir}")
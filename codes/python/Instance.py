@@ -1,10 +1,15 @@
 from collections import OrderedDict
 from datetime import timedelta, datetime as dt
 from enum import Enum
+import numpy as np
 from Time import Time
 from Setting import Setting
+from Shared import SharedArray
+import RealData
 import Util
 
+FORECASTS = ["base_load", "solar_load", "price"]
+
 
 class Type(Enum):
     O = "once-off"
@@ -48,9 +53,30 @@ class Building:
 class Scenario:
     def __init__(self, planning_horizon, name):
         self.name = name
+        self.probability = 1.0
         self.price = [None for t in planning_horizon]
         self.base_load = [0 for t in planning_horizon]
         self.solar_load = [0 for t in planning_horizon]
+        self.shared = None  # (block, index) of the read-only shared forecasts
+
+    def share(self, block: SharedArray, index):
+        self.shared = (block, index)
+        for i, name in enumerate(FORECASTS):
+            setattr(self, name, block.array[i, index])
+
+    def __getstate__(self):
+        # a shared scenario is pickled without its forecasts, a worker
+        # attaches to the block instead
+        state = self.__dict__.copy()
+        if self.shared is not None:
+            for name in FORECASTS:
+                del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.shared is not None:
+            self.share(*self.shared)
 
 
 class Instance:
@@ -64,6 +90,7 @@ class Instance:
         self.large_room_count = 0
         self.small_room_count = 0
         self.scenarios = []
+        self.full_scenarios = []
         self.activities: list[Activity] = []
         self.activities_r: list[Activity] = []
         self.activities_o: list[Activity] = []
@@ -71,9 +98,41 @@ class Instance:
         self.buildings = []
         self._max_load_ub = None
         self.first_monday_slot = None
+        self.removed_start_times = 0
+        self.removed_prerequisites = 0
+        self.pruned_activities = []
+        self.symmetric_classes = []
         self.sol_battery_bt_mode = OrderedDict()
         self.sol_activity_start = OrderedDict()
 
+    def share_scenarios(self):
+        # the forecasts of all scenarios in one block of shared memory (forecast
+        # x scenario x slot), the scenarios keep read-only numpy views of it
+        scenarios = list(OrderedDict.fromkeys(self.scenarios + self.full_scenarios))
+        block = SharedArray.publish(
+            np.array(
+                [[getattr(s, name) for s in scenarios] for name in FORECASTS],
+                dtype=float,
+            )
+        )
+        for index, scenario in enumerate(scenarios):
+            scenario.share(block, index)
+        return block
+
+    def unshare_scenarios(self):
+        # back to private lists, and the blocks are released
+        blocks = OrderedDict()
+        for scenario in self.scenarios + self.full_scenarios:
+            if scenario.shared is None:
+                continue
+            block = scenario.shared[0]
+            blocks[block.name] = block
+            for name in FORECASTS:
+                setattr(scenario, name, getattr(scenario, name).tolist())
+            scenario.shared = None
+        for block in blocks.values():
+            block.release()
+
     def get_activity_duration_stat(self):
         return Util.Stat([a.duration for a in self.activities])
 
@@ -93,9 +152,9 @@ class Instance:
             + self.large_room_count * max_large_room_load
         )
         for s in self.scenarios:
-            max_load += max(
+            max_load += s.probability * max(
                 s.base_load[t] - s.solar_load[t] for t in self.planning_horizon
-            ) / len(self.scenarios)
+            )
         return int(max_load / 2)
 
     def is_office_hour(self, t):
@@ -123,85 +182,139 @@ class Instance:
             self.time.index_of(first_friday.replace(hour=17)) - self.time.utc_offset
         )
 
-        progress_times_r = [
+        self.progress_times_r = [
             t for t in range(monday_9am, friday_5pm) if self.is_office_hour(t)
         ]
+        self.progress_times_o = [t for t in self.planning_horizon]
+        self.progress_times_o_office = [
+            t for t in self.planning_horizon if self.is_office_hour(t)
+        ]
+        for a in self.activities:
+            self.set_times(a)
+        if self.setting.reduce_activity_times:
+            self.reduce_activity_times()
 
-        for a in self.activities_r:
-            a.progress_times = progress_times_r
+    def set_times(self, a: Activity):
+        if a.type == Type.R:
+            a.progress_times = self.progress_times_r
             a.start_times = [
-                t for t in progress_times_r if self.is_office_hour(t + a.duration - 1)
+                t
+                for t in self.progress_times_r
+                if self.is_office_hour(t + a.duration - 1)
+            ]
+            return
+        a.progress_times = (
+            self.progress_times_o_office
+            if a.revenue <= a.penalty
+            else self.progress_times_o
+        )
+        a.start_times = (
+            [
+                t
+                for t in a.progress_times
+                if t + a.duration <= len(self.planning_horizon)
+                and self.is_office_hour(t + a.duration - 1)
+            ]
+            if a.revenue <= a.penalty
+            else [
+                t
+                for t in a.progress_times
+                if t + a.duration <= len(self.planning_horizon)
+            ]
+        )
+        a.penalty_times = (
+            []
+            if a.revenue <= a.penalty
+            else [
+                t
+                for t in a.start_times
+                if (not self.is_office_hour(t))
+                or (not self.is_office_hour(t + a.duration - 1))
+                or (a.duration > 8 * self.time.slots_per_hour)
             ]
+        )
 
-        progress_times_o = [t for t in self.planning_horizon]
-        progress_times_o_office = [
-            t for t in self.planning_horizon if self.is_office_hour(t)
-        ]
-        for a in self.activities_o:
-            a.progress_times = (
-                progress_times_o_office if a.revenue <= a.penalty else progress_times_o
-            )
-            a.start_times = (
-                [
-                    t
-                    for t in a.progress_times
-                    if t + a.duration <= len(self.planning_horizon)
-                    and self.is_office_hour(t + a.duration - 1)
-                ]
-                if a.revenue <= a.penalty
-                else [
-                    t
-                    for t in a.progress_times
-                    if t + a.duration <= len(self.planning_horizon)
-                ]
-            )
-            a.penalty_times = (
-                []
-                if a.revenue <= a.penalty
-                else [
-                    t
-                    for t in a.start_times
-                    if (not self.is_office_hour(t))
-                    or (not self.is_office_hour(t + a.duration - 1))
-                    or (a.duration > 8 * self.time.slots_per_hour)
-                ]
+    def reduce_activity_times(self):
+        # presolve of the start times: an activity that needs more rooms than
+        # there are never starts, an activity starts at least one day after the
+        # earliest day of every prerequisite (C6), and the prerequisites of a
+        # recurring activity (always scheduled) start at least one day before
+        # its latest day. Prerequisites implied by others are removed (C6 and
+        # C7 hold transitively).
+        def day(t):
+            return (t + self.time.utc_offset) // self.time.slots_per_day
+
+        start_count = sum(len(a.start_times) for a in self.activities)
+        for a in self.activities:
+            if (
+                a.small_rooms > self.small_room_count
+                or a.large_rooms > self.large_room_count
+            ):
+                a.start_times = []
+        changed = True
+        while changed:
+            changed = False
+            for ap in self.activities:
+                prerequisites = [self.activities[a] for a in ap.prerequisites]
+                if any(not a.start_times for a in prerequisites):
+                    start_times = []
+                else:
+                    earliest = max(
+                        (day(a.start_times[0]) + 1 for a in prerequisites), default=0
+                    )
+                    start_times = [t for t in ap.start_times if day(t) >= earliest]
+                if len(start_times) < len(ap.start_times):
+                    ap.start_times = start_times
+                    changed = True
+                if ap.type != Type.R:
+                    continue
+                latest = day(ap.start_times[-1]) - 1 if ap.start_times else -1
+                for a in prerequisites:
+                    start_times = [t for t in a.start_times if day(t) <= latest]
+                    if len(start_times) < len(a.start_times):
+                        a.start_times = start_times
+                        changed = True
+        for a in self.activities:
+            start_times = set(a.start_times)
+            progress_times = set(
+                tp for t in a.start_times for tp in range(t, t + a.duration)
             )
+            a.progress_times = [t for t in a.progress_times if t in progress_times]
+            a.penalty_times = [t for t in a.penalty_times if t in start_times]
+        self.removed_start_times = start_count - sum(
+            len(a.start_times) for a in self.activities
+        )
+
+        ancestors = {}
+
+        def get_ancestors(a):
+            if a not in ancestors:
+                ancestors[a] = set()  # guards against cycles
+                found = set()
+                for ap in self.activities[a].prerequisites:
+                    found.add(ap)
+                    found.update(get_ancestors(ap))
+                ancestors[a] = found
+            return ancestors[a]
+
+        if any(a in get_ancestors(a) for a in range(len(self.activities))):
+            return
+        for a, activity in enumerate(self.activities):
+            prerequisites = list(OrderedDict.fromkeys(activity.prerequisites))
+            implied = set()
+            for ap in prerequisites:
+                implied.update(get_ancestors(ap))
+            reduced = [ap for ap in prerequisites if ap not in implied]
+            self.removed_prerequisites += len(activity.prerequisites) - len(reduced)
+            activity.prerequisites = reduced
 
     def load_real_data(self, scenario_dir):
-        exclude_outliers = True
-        real_load_file = [f for f in scenario_dir if "All_data.csv" in f][0]
-        price_files = [f for f in scenario_dir if "PRICE_AND_DEMAND" in f]
-        valid_buildings = [b.key for b in self.buildings]
-        valid_solars = [b.solar_id for b in self.buildings]
-        with open(real_load_file, "r") as file:
-            load_lines = file.readlines()
-        t = 0
-        for l in load_lines:
-            line = l.split(",")
-            key = int(Util.rx.findall(line[1])[0])
-            load = Util.rx.findall(line[3])
-            load = float(load[0]) if load else 0
-            if exclude_outliers:
-                load = load if load < 1700 else 144
-            if "Building" in l and key in valid_buildings:
-                self.scenarios[0].base_load[t % len(self.time.slots)] += load
-            if "Solar" in l and key in valid_solars:
-                self.scenarios[0].solar_load[t % len(self.time.slots)] += load
-            t += 1
-        with open(price_files[0], "r") as file:
-            price_lines = file.readlines()
-        # assuming 15 minute time slots:
-        index = 0
-        for l in price_lines[1:]:
-            line = l.split(",")
-            pr = float(line[3])
-            self.scenarios[0].price[index] = pr
-            self.scenarios[0].price[index + 1] = pr
-            index += 2
+        RealData.load_real_data(self, scenario_dir)
 
     def load_scenario(self, scenario_dir):
         if self.setting.use_real_data:
             self.scenarios = [Scenario(self.planning_horizon, "real_data")]
+            self.full_scenarios = self.scenarios
             self.load_real_data(scenario_dir)
             return
         price_files = [f for f in scenario_dir if "PRICE_AND_DEMAND" in f]
@@ -211,6 +324,9 @@ class Instance:
         self.scenarios = [
             Scenario(self.planning_horizon, Util.getNameFromPath(l)) for l in load_files
         ]
+        for scenario in self.scenarios:
+            scenario.probability = 1 / len(self.scenarios)
+        self.full_scenarios = self.scenarios
         valid_buildings = [b.key for b in self.buildings]
         valid_solars = [b.solar_id for b in self.buildings]
         with open(price_files[0], "r") as file:
@@ -0,0 +1,257 @@
+import os
+import sys
+import copy
+import socket
+import threading
+import time
+import traceback
+from Setting import Setting
+from Data import Data
+from Algorithm import Algorithm
+from Results import ResultStore
+import Util
+
+# A work queue of (dataset key, instance index, algorithm, seed) jobs in a
+# SQLite database (write-ahead log) on a filesystem shared by the machines, so
+# any number of workers on any number of nodes solve the matrix without a
+# server. A worker claims the oldest pending job in a short transaction with a
+# lease (queue_lease seconds) that a heartbeat thread renews while it solves.
+# A job whose lease runs out (its worker died) is claimed again by the next
+# worker, up to queue_attempts runs, and an error puts it back in the queue
+# until then. Every finished job writes one result row and a run of the
+# results store (Results.py). The filesystem must support the locks of SQLite
+# (a local disk or a shared disk with working POSIX locks).
+#   python JobQueue.py enqueue <algorithms> <seeds>   e.g. enqueue 7,12 0,1,2
+#   python JobQueue.py work                           until the queue is empty
+#   python JobQueue.py status
+
+PENDING, RUNNING, DONE, FAILED = "pending", "running", "done", "failed"
+FIELDS = ["LB", "UB", "GAP", "CPU", "NOD", "ITR", "NNZ", "VARs", "CONs", "STATUS"]
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    dataset_key TEXT NOT NULL,
+    instance_index INTEGER NOT NULL,
+    algorithm INTEGER NOT NULL,
+    seed INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT '{PENDING}',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_until REAL,
+    created REAL,
+    started REAL,
+    finished REAL,
+    error TEXT,
+    UNIQUE (dataset_key, instance_index, algorithm, seed)
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, lease_until);
+CREATE TABLE IF NOT EXISTS results (
+    job_id INTEGER PRIMARY KEY REFERENCES jobs (id),
+    instance TEXT,
+    worker TEXT,
+    finished REAL,
+    {", ".join(f"{field} REAL" for field in FIELDS)}
+);
+"""
+
+
+def get_worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class JobQueue:
+    def __init__(self, file_path, lease=600, attempts=3):
+        self.file_path = file_path
+        self.lease = lease
+        self.attempts = attempts
+        Util.mkdir(Util.getDirFromPath(file_path))
+        self.connection = Util.connect(file_path)
+        self.connection.executescript(SCHEMA)
+
+    def transaction(self):
+        # BEGIN IMMEDIATE takes the write lock first, so two workers never
+        # claim the same job
+        self.connection.execute("BEGIN IMMEDIATE")
+        return self.connection
+
+    def enqueue(self, jobs):
+        # (dataset key, instance index, algorithm, seed), existing jobs stay
+        connection = self.transaction()
+        try:
+            count = 0
+            for job in jobs:
+                cursor = connection.execute(
+                    "INSERT OR IGNORE INTO jobs (dataset_key, instance_index, "
+                    "algorithm, seed, created) VALUES (?, ?, ?, ?, ?)",
+                    (*job, time.time()),
+                )
+                count += cursor.rowcount
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return count
+
+    def claim(self, worker):
+        now = time.time()
+        connection = self.transaction()
+        try:
+            connection.execute(
+                "UPDATE jobs SET status = ?, error = 'lease expired' "
+                "WHERE status = ? AND lease_until < ? AND attempts >= ?",
+                (FAILED, RUNNING, now, self.attempts),
+            )
+            job = connection.execute(
+                "SELECT * FROM jobs WHERE status = ? "
+                "OR (status = ? AND lease_until < ?) ORDER BY id LIMIT 1",
+                (PENDING, RUNNING, now),
+            ).fetchone()
+            if job is not None:
+                connection.execute(
+                    "UPDATE jobs SET status = ?, worker = ?, attempts = attempts + 1, "
+                    "lease_until = ?, started = ? WHERE id = ?",
+                    (RUNNING, worker, now + self.lease, now, job["id"]),
+                )
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return job
+
+    def heartbeat(self, job_id, worker, connection=None):
+        # False if the lease was lost (the job was claimed by another worker)
+        cursor = (connection or self.connection).execute(
+            "UPDATE jobs SET lease_until = ? "
+            "WHERE id = ? AND worker = ? AND status = ?",
+            (time.time() + self.lease, job_id, worker, RUNNING),
+        )
+        return cursor.rowcount == 1
+
+    def complete(self, job_id, worker, instance_name, info):
+        connection = self.transaction()
+        try:
+            cursor = connection.execute(
+                "UPDATE jobs SET status = ?, finished = ?, lease_until = NULL "
+                "WHERE id = ? AND worker = ? AND status = ?",
+                (DONE, time.time(), job_id, worker, RUNNING),
+            )
+            if cursor.rowcount == 1:
+                connection.execute(
+                    f"INSERT OR REPLACE INTO results (job_id, instance, worker, "
+                    f"finished, {', '.join(FIELDS)}) "
+                    f"VALUES ({', '.join('?' * (len(FIELDS) + 4))})",
+                    (job_id, instance_name, worker, time.time())
+                    + tuple(getattr(info, field) for field in FIELDS),
+                )
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return cursor.rowcount == 1
+
+    def fail(self, job_id, worker, error):
+        self.connection.execute(
+            "UPDATE jobs SET status = CASE WHEN attempts >= ? THEN ? ELSE ? END, "
+            "worker = NULL, lease_until = NULL, error = ? "
+            "WHERE id = ? AND worker = ? AND status = ?",
+            (self.attempts, FAILED, PENDING, error, job_id, worker, RUNNING),
+        )
+
+    def counts(self):
+        rows = self.connection.execute(
+            "SELECT status, COUNT(*) AS count FROM jobs GROUP BY status"
+        )
+        return {row["status"]: row["count"] for row in rows}
+
+
+class Heartbeat(threading.Thread):
+    def __init__(self, queue: JobQueue, job_id, worker):
+        super().__init__(daemon=True)
+        self.queue = queue
+        self.job_id = job_id
+        self.worker = worker
+        self.stopped = threading.Event()
+
+    def run(self):
+        # a connection of its own, a connection is not shared by threads
+        connection = Util.connect(self.queue.file_path)
+        while not self.stopped.wait(self.queue.lease / 3):
+            if not self.queue.heartbeat(self.job_id, self.worker, connection):
+                break
+        connection.close()
+
+
+def get_queue(setting: Setting):
+    return JobQueue(setting.queue_file, setting.queue_lease, setting.queue_attempts)
+
+
+def enqueue(setting: Setting, algorithms, seeds):
+    data = Data(setting)
+    jobs = [
+        (key, index, algorithm, seed)
+        for key, files in data.datasets.items()
+        for index in range(len(files))
+        for algorithm in algorithms
+        for seed in seeds
+    ]
+    return get_queue(setting).enqueue(jobs)
+
+
+def solve(setting: Setting, job):
+    setting = copy.copy(setting)
+    setting.solver = copy.copy(setting.solver)
+    setting.algorithm = job["algorithm"]
+    setting.solver.seed = job["seed"]
+    setting.dataset_keys = [job["dataset_key"]]
+    instance = Data(setting).get_instance_by_index(
+        job["dataset_key"], job["instance_index"]
+    )
+    instance.folder = Util.joinpath(instance.folder, f"seed_{job['seed']}")
+    Util.mkdir(instance.folder)
+    summary, solution = Algorithm(instance).run()
+    if summary is None:
+        raise RuntimeError("No summary")
+    if solution is not None:
+        solution.export_ppoi(instance.folder, tag=False)
+    return instance, summary
+
+
+def work(setting: Setting, worker=None, poll=10):
+    # solves jobs until none is pending, and waits for the leases of running
+    # jobs of other workers (they are claimed again if their worker died)
+    queue = get_queue(setting)
+    store = ResultStore(setting.results_file)
+    worker = worker or get_worker_name()
+    solved = 0
+    while True:
+        job = queue.claim(worker)
+        if job is None:
+            if not queue.counts().get(RUNNING):
+                return solved
+            time.sleep(poll)
+            continue
+        heartbeat = Heartbeat(queue, job["id"], worker)
+        heartbeat.start()
+        try:
+            instance, summary = solve(setting, job)
+            if queue.complete(job["id"], worker, instance.name, summary):
+                store.add_summary(instance, summary)
+            solved += 1
+        except Exception:
+            queue.fail(job["id"], worker, traceback.format_exc())
+            traceback.print_exc()
+        finally:
+            heartbeat.stopped.set()
+
+
+if __name__ == "__main__":
+    setting = Setting()
+    command = sys.argv[1] if len(sys.argv) > 1 else "work"
+    if command == "enqueue":
+        algorithms = [int(a) for a in sys.argv[2].split(",")]
+        seeds = [int(s) for s in sys.argv[3].split(",")] if len(sys.argv) > 3 else [0]
+        print(f"Enqueued {enqueue(setting, algorithms, seeds)} jobs")
+    elif command == "work":
+        print(f"Solved {work(setting)} jobs")
+    print(get_queue(setting).counts())
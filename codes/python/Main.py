@@ -1,9 +1,9 @@
-import pandas as pd
 import sys
 import traceback
 from Setting import Setting
 from Data import Data
 from Algorithm import Algorithm
+from Results import ResultStore, get_settings_hash
 import Util
 
 
@@ -19,6 +19,7 @@ else:
 
 setting = Setting()
 data = Data(setting)
+store = ResultStore(setting.results_file)
 for key in data.datasets:
     instances = (
         [data.get_instance_by_index(key, int(i))] if cli else data.get_instances(key)
@@ -28,19 +29,20 @@ for key in data.datasets:
         summary, solution = algorithm.run()
         print(f"\n\nSolved {instance.name}\n\n")
         if setting.solver.fixsol:
-            if not Util.exists(setting.summary_file):
-                solution.csv_header(setting.summary_file)
-            solution.add2csv(setting.summary_file)
+            if solution is not None:
+                store.add_evaluation(solution)
         else:
-            if not Util.exists(setting.summary_file):
-                summary.csv_header(setting.summary_file)
-            summary.add2csv(instance.name, setting.summary_file)
-        solution.export_ppoi(setting.startsol_dir, tag=False)
+            store.add_summary(instance, summary)
+        # None if no incumbent was found in time
+        if solution is not None:
+            solution.export_ppoi(setting.startsol_dir, tag=False)
 
-if setting.solver.fixsol:
-    Util.writeln(setting.summary_file)
-    df = pd.read_csv(setting.summary_file)
-    df = df.loc[:, ~df.columns.str.contains("^Unnamed")]
-    df.describe().loc[["mean", "std", "min", "50%", "max", "count"]].to_csv(
-        setting.summary_file, mode="a", header=True
-    )
+# the runs of these settings, in the layout of summary.csv
+store.export_csv(
+    setting.summary_file,
+    "evaluation" if setting.solver.fixsol else "summary",
+    name=setting.name,
+    algorithm=setting.algorithm,
+    settings_hash=get_settings_hash(setting),
+    phase=setting.phase,
+)
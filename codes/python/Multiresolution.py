@@ -0,0 +1,69 @@
+import copy
+import math
+from collections import OrderedDict
+import numpy as np
+from Instance import Instance, Scenario, Type
+from Optimizer import Optimizer
+
+# Coarse-to-fine solving: the instance is rebuilt on slots of factor times the
+# slot length (aggregated prices and loads, shorter durations), solved, and its
+# schedule is projected back onto the fine slots as a start solution and a
+# neighbourhood of the fine start times. Battery powers are given per hour, so
+# they need no rescaling.
+
+
+def _aggregate(series, factor):
+    values = np.array(series, dtype=float)
+    padding = (-len(values)) % factor
+    if padding:
+        values = np.append(values, np.full(padding, np.nan))
+    return np.nanmean(values.reshape(-1, factor), axis=1).tolist()
+
+
+def coarsen(instance: Instance, factor):
+    setting = copy.copy(instance.setting)
+    setting.slot_minutes = instance.setting.slot_minutes * factor
+    coarse = Instance(f"{instance.name}_{setting.slot_minutes}min", setting)
+    coarse.buildings = instance.buildings
+    coarse.batteries = instance.batteries
+    coarse.small_room_count = instance.small_room_count
+    coarse.large_room_count = instance.large_room_count
+    for activity in instance.activities:
+        coarse_activity = copy.copy(activity)
+        coarse_activity.duration = math.ceil(activity.duration / factor)
+        coarse.activities.append(coarse_activity)
+    coarse.activities_r = [a for a in coarse.activities if a.type == Type.R]
+    coarse.activities_o = [a for a in coarse.activities if a.type == Type.O]
+    for scenario in instance.scenarios:
+        coarse_scenario = Scenario(coarse.planning_horizon, scenario.name)
+        coarse_scenario.probability = scenario.probability
+        coarse_scenario.price = _aggregate(scenario.price, factor)
+        coarse_scenario.base_load = _aggregate(scenario.base_load, factor)
+        coarse_scenario.solar_load = _aggregate(scenario.solar_load, factor)
+        coarse.scenarios.append(coarse_scenario)
+    coarse.full_scenarios = coarse.scenarios
+    coarse.symmetric_classes = instance.symmetric_classes
+    coarse.set_activity_times()
+    return coarse
+
+
+def project(coarse_optimizer: Optimizer, optimizer: Optimizer, factor):
+    activity_start = OrderedDict()
+    for (a, t), var in coarse_optimizer.Z_VAR.items():
+        if var.x < 0.5:
+            continue
+        start_times = optimizer.activities[a].start_times
+        if start_times:
+            activity_start[a] = min(start_times, key=lambda tp: abs(tp - t * factor))
+    battery_bt_mode = OrderedDict()
+    for (b, t), var in coarse_optimizer.X_VAR.items():
+        if var.x >= 0.5:
+            mode = 0
+        elif coarse_optimizer.Y_VAR[b, t].x >= 0.5:
+            mode = 2
+        else:
+            continue
+        for tp in range(t * factor, (t + 1) * factor):
+            if (b, tp) in optimizer.X_VAR:
+                battery_bt_mode[b, tp] = mode
+    return activity_start, battery_bt_mode
@@ -5,6 +5,8 @@ import numpy as np
 import gurobipy as gp
 from gurobipy import GRB
 from Instance import Instance, Type
+import Analysis
+from Cuts import CutSeparator
 import Util
 
 
@@ -59,8 +61,9 @@ class SolutionInfo:
 
 
 class Optimizer:
-    def __init__(self, instance: Instance) -> None:
+    def __init__(self, instance: Instance, env=None) -> None:
         self.solve_count = 0
+        self.env = env  # a started gp.Env, None uses the default environment
         self.setting = instance.setting
         self.instance = instance
         self.slots_per_hour = instance.time.slots_per_hour
@@ -90,13 +93,27 @@ class Optimizer:
         )
         Util.writeln(
             self.log_file,
-            f'Scenarios: {" ".join(s.name for s in self.instance.scenarios)}',
+            f'Scenarios: {" ".join(f"{s.name}({s.probability:.4f})" for s in self.instance.scenarios)}',
+        )
+        Util.writeln(
+            self.log_file,
+            f"RemovedStartTimes={instance.removed_start_times} "
+            f"RemovedPrerequisites={instance.removed_prerequisites} "
+            f"PrunedActivities={len(instance.pruned_activities)} "
+            f"SymmetricClasses={len(instance.symmetric_classes)}",
         )
         Util.writeln(self.log_file, Util.SEPARATOR)
         self.start_vars = []
+        self.snapshots = {}
+        self.toggles = []
         self.total_runtime = 0
         self.temporary_constraints = []
-        self.model = gp.Model()
+        self.no_charge = set()
+        self.no_discharge = set()
+        self.battery_sos = []
+        self.battery_mode_constrs = None
+        self.callback = None
+        self.model = self.new_model()
         self.model.setParam(GRB.Param.LogToConsole, 1)
         self.model.setParam(GRB.Param.LogFile, self.log_file)
         self.model.setParam(GRB.Param.MIPGap, self.setting.solver.gap)
@@ -111,6 +128,11 @@ class Optimizer:
             self.model.setParam(GRB.Param.MIPFocus, self.setting.solver.focus)
         if self.setting.solver.threads:
             self.model.setParam(GRB.Param.Threads, self.setting.solver.threads)
+        if self.setting.solver.seed:
+            self.model.setParam(GRB.Param.Seed, self.setting.solver.seed)
+
+    def new_model(self):
+        return gp.Model(env=self.env)
 
     def formulate(self):
         self.create_variables()
@@ -118,6 +140,8 @@ class Optimizer:
         self.create_constraints()
         self.set_start_values()
         self.fix_solution()
+        if self.setting.cut_families:
+            self.callback = CutSeparator(self, self.setting.cut_families)
         # self.model.write(self.lp_file)
 
     def create_variables(self):
@@ -143,15 +167,18 @@ class Optimizer:
             vtype=GRB.BINARY,
         )
 
-        self.V_VAR = self.model.addVars(
-            (
-                (a, t)
-                for a in self.activities
-                for t in self.activities[a].progress_times
-            ),
-            name="V",
-            vtype=GRB.BINARY,
-        )
+        if self.setting.activity_formulation == "vfree":
+            self.V_VAR = self.progress_expressions()
+        else:
+            self.V_VAR = self.model.addVars(
+                (
+                    (a, t)
+                    for a in self.activities
+                    for t in self.activities[a].progress_times
+                ),
+                name="V",
+                vtype=GRB.BINARY,
+            )
 
         self.S_VAR = self.model.addVars(
             ((b, t) for b in self.batteries for t in self.slot_indices),
@@ -159,14 +186,6 @@ class Optimizer:
             vtype=GRB.CONTINUOUS,
         )
 
-        self.L_VAR = self.model.addVars(
-            ((t, s) for t in self.slot_indices for s in self.scenarios),
-            name="L",
-            lb=-GRB.INFINITY,
-            ub=GRB.INFINITY,
-            vtype=GRB.CONTINUOUS,
-        )
-
         self.W_VAR = self.model.addVars(
             (a for a in self.activities), name="W", vtype=GRB.BINARY,
         )
@@ -179,6 +198,17 @@ class Optimizer:
             (a for a in self.activities), name="D", vtype=GRB.INTEGER,
         )
 
+        self.create_load_variables()
+
+    def create_load_variables(self):
+        self.L_VAR = self.model.addVars(
+            ((t, s) for t in self.slot_indices for s in self.scenarios),
+            name="L",
+            lb=-GRB.INFINITY,
+            ub=GRB.INFINITY,
+            vtype=GRB.CONTINUOUS,
+        )
+
         self.LAMBDA_VAR = self.model.addVars(
             ((i, s) for i in self.load_indices for s in self.scenarios),
             name="LAMBDA",
@@ -191,20 +221,35 @@ class Optimizer:
             (s for s in self.scenarios), name="_E", vtype=GRB.CONTINUOUS,
         )
 
+    def progress_expressions(self):
+        # V[a, t] as the sum of the starts of a within its duration up to t
+        expressions = gp.tupledict()
+        for a, activity in self.activities.items():
+            start_times = set(activity.start_times)
+            for t in activity.progress_times:
+                expressions[a, t] = gp.quicksum(
+                    self.Z_VAR[a, tp]
+                    for tp in range(t - activity.duration + 1, t + 1)
+                    if tp in start_times
+                )
+        return expressions
+
+    def needs_c2(self, a):
+        # without V, C2 follows from C3 only if every slot of every start of a
+        # is one of its progress times (else C2 excludes these starts)
+        if self.setting.activity_formulation != "vfree":
+            return True
+        activity = self.activities[a]
+        progress_times = set(activity.progress_times)
+        return any(
+            t not in progress_times
+            for tp in activity.start_times
+            for t in range(tp, tp + activity.duration)
+        )
+
     def create_objective(self):
         obj = (
-            gp.quicksum(
-                self.L_VAR[t, s]
-                * self.instance.scenarios[s].price[t]
-                / (self.slots_per_hour * 1000 * len(self.instance.scenarios))
-                for t in self.slot_indices
-                for s in self.scenarios
-            )
-            + gp.quicksum(
-                self.LAMBDA_VAR[i, s] * 0.005 * (i ** 2) / len(self.instance.scenarios)
-                for i in self.load_indices
-                for s in self.scenarios
-            )
+            self.load_cost()
             + gp.quicksum(
                 self.U_VAR[a] * self.activities[a].penalty for a in self.activities_o
             )
@@ -215,6 +260,23 @@ class Optimizer:
 
         self.model.setObjective(obj, GRB.MINIMIZE)
 
+    def load_cost(self):
+        return gp.quicksum(
+            self.L_VAR[t, s]
+            * self.instance.scenarios[s].price[t]
+            * self.instance.scenarios[s].probability
+            / (self.slots_per_hour * 1000)
+            for t in self.slot_indices
+            for s in self.scenarios
+        ) + gp.quicksum(
+            self.LAMBDA_VAR[i, s]
+            * 0.005
+            * (i ** 2)
+            * self.instance.scenarios[s].probability
+            for i in self.load_indices
+            for s in self.scenarios
+        )
+
     def map_time(self, t):
         if t < self.instance.first_monday_slot:
             return t
@@ -224,26 +286,36 @@ class Optimizer:
 
     def create_constraints(self):
 
+        # without V, C1 defines nothing
+        if self.setting.activity_formulation != "vfree":
+            self.model.addConstrs(
+                (
+                    (
+                        gp.quicksum(
+                            self.Z_VAR[a, tp]
+                            for tp in range(
+                                t - self.activities[a].duration + 1, t + 1
+                            )
+                            if tp in self.activities[a].start_times
+                        )
+                        == self.V_VAR[a, t]
+                    )
+                    for a in self.activities
+                    for t in self.activities[a].progress_times
+                ),
+                name="C1",
+            )
+
         self.model.addConstrs(
             (
                 (
                     gp.quicksum(
-                        self.Z_VAR[a, tp]
-                        for tp in range(t - self.activities[a].duration + 1, t + 1)
-                        if tp in self.activities[a].start_times
+                        self.V_VAR[a, t] for t in self.activities[a].progress_times
                     )
-                    == self.V_VAR[a, t]
+                    == self.activities[a].duration * self.W_VAR[a]
                 )
                 for a in self.activities
-                for t in self.activities[a].progress_times
-            ),
-            name="C1",
-        )
-
-        self.model.addConstrs(
-            (
-                (self.V_VAR.sum(a, "*") == self.activities[a].duration * self.W_VAR[a])
-                for a in self.activities
+                if self.needs_c2(a)
             ),
             name="C2",
         )
@@ -306,7 +378,7 @@ class Optimizer:
             name="C7",
         )
 
-        self.model.addConstrs(
+        self.initial_state_constrs = self.model.addConstrs(
             (
                 (
                     self.S_VAR[b, 0]
@@ -319,7 +391,7 @@ class Optimizer:
             name="C8",
         )
 
-        self.model.addConstrs(
+        self.state_constrs = self.model.addConstrs(
             (
                 (
                     self.S_VAR[b, t]
@@ -333,93 +405,177 @@ class Optimizer:
             name="C9",
         )
 
-        self.model.addConstrs(
-            (
-                (self.X_VAR[b, t] + self.Y_VAR[b, t] <= 1)
-                for b in self.batteries
-                for t in self.slot_indices
-            ),
-            name="C10",
-        )
+        if self.setting.battery_formulation == "compact":
+            self.create_compact_battery_constraints()
+        else:
+            self.model.addConstrs(
+                (
+                    (self.X_VAR[b, t] + self.Y_VAR[b, t] <= 1)
+                    for b in self.batteries
+                    for t in self.slot_indices
+                ),
+                name="C10",
+            )
 
-        self.model.addConstrs(
+        self.large_room_constrs = self.model.addConstrs(
             (
                 (
-                    self.L_VAR[t, s]
-                    == self.instance.scenarios[s].base_load[t]
-                    - self.instance.scenarios[s].solar_load[t]
-                    + gp.quicksum(
-                        (
-                            self.X_VAR[b, t]
-                            - self.batteries[b].efficiency * self.Y_VAR[b, t]
-                        )
-                        * (
-                            self.batteries[b].max_power
-                            / math.sqrt(self.batteries[b].efficiency)
-                        )
-                        for b in self.batteries
-                    )
-                    + gp.quicksum(
-                        self.V_VAR.get((a, t), 0)
-                        * self.activities[a].load_per_room
-                        * (
-                            self.activities[a].small_rooms
-                            + self.activities[a].large_rooms
-                        )
+                    gp.quicksum(
+                        self.V_VAR.get((a, t), 0) * self.activities[a].large_rooms
                         for a in self.activities_o
                     )
                     + gp.quicksum(
                         self.V_VAR.get((a, self.map_time(t)), 0)
-                        * self.activities[a].load_per_room
-                        * (
-                            self.activities[a].small_rooms
-                            + self.activities[a].large_rooms
-                        )
+                        * self.activities[a].large_rooms
                         for a in self.activities_r
                     )
+                    <= self.instance.large_room_count
                 )
                 for t in self.slot_indices
-                for s in self.scenarios
             ),
-            name="C11",
+            name="C12",
         )
 
-        self.model.addConstrs(
+        self.small_room_constrs = self.model.addConstrs(
             (
                 (
                     gp.quicksum(
-                        self.V_VAR.get((a, t), 0) * self.activities[a].large_rooms
+                        self.V_VAR.get((a, t), 0) * self.activities[a].small_rooms
                         for a in self.activities_o
                     )
                     + gp.quicksum(
                         self.V_VAR.get((a, self.map_time(t)), 0)
-                        * self.activities[a].large_rooms
+                        * self.activities[a].small_rooms
                         for a in self.activities_r
                     )
-                    <= self.instance.large_room_count
+                    <= self.instance.small_room_count
                 )
                 for t in self.slot_indices
             ),
-            name="C12",
+            name="C13",
         )
 
+        self.model.addConstrs(
+            ((self.W_VAR[a] == 1) for a in self.activities_r), name="C18",
+        )
+
+        if self.setting.battery_formulation != "compact":
+            self.capacity_constrs = self.model.addConstrs(
+                (
+                    (self.S_VAR[b, t] <= self.batteries[b].capacity)
+                    for b in self.batteries
+                    for t in self.slot_indices
+                ),
+                name="C19",
+            )
+
+        # self.model.addConstrs(
+        #     ((self.U_VAR[a] <= self.W_VAR[a]) for a in self.activities_o), name="C20",
+        # )
+
+        self.create_symmetry_constraints()
+
+        self.create_load_constraints()
+
+    def battery_levels(self, b):
+        # the state of charge moves by step, so it is initial_state + k * step
+        # for k in [lowest, highest]
+        battery = self.batteries[b]
+        step = battery.max_power / self.slots_per_hour
+        if step <= 0:
+            return step, 0, 0
+        lowest = -math.floor(battery.initial_state / step + 1e-9)
+        highest = math.floor((battery.capacity - battery.initial_state) / step + 1e-9)
+        return step, lowest, highest
+
+    def create_compact_battery_constraints(self):
+        # a three-state mode per slot as an SOS1 of X and Y (instead of C10), the
+        # states of charge reachable after t + 1 slots as bounds of S (instead
+        # of C19), and no charging (discharging) in the slots before the first
+        # one with room (charge) for a full step
+        self.add_battery_sos()
+        for b in self.batteries:
+            step, lowest, highest = self.battery_levels(b)
+            initial_state = self.batteries[b].initial_state
+            for t in self.slot_indices:
+                self.S_VAR[b, t].lb = initial_state + step * max(lowest, -(t + 1))
+                self.S_VAR[b, t].ub = initial_state + step * min(highest, t + 1)
+                if max(lowest, -t) > highest - 1:
+                    self.no_charge.add((b, t))
+                    self.X_VAR[b, t].ub = 0
+                if min(highest, t) < lowest + 1:
+                    self.no_discharge.add((b, t))
+                    self.Y_VAR[b, t].ub = 0
+
+    def add_battery_sos(self):
+        self.battery_sos = [
+            self.model.addSOS(GRB.SOS_TYPE1, [self.X_VAR[key], self.Y_VAR[key]])
+            for key in self.X_VAR
+        ]
+
+    def create_symmetry_constraints(self):
+        # the members of a symmetric class are scheduled in order and start in
+        # order
+        pairs = [
+            (a, ap)
+            for members in self.instance.symmetric_classes
+            for a, ap in zip(members, members[1:])
+        ]
+        self.model.addConstrs(
+            ((self.W_VAR[a] >= self.W_VAR[ap]) for a, ap in pairs), name="C21",
+        )
         self.model.addConstrs(
             (
                 (
                     gp.quicksum(
-                        self.V_VAR.get((a, t), 0) * self.activities[a].small_rooms
-                        for a in self.activities_o
+                        t * self.Z_VAR[a, t] for t in self.activities[a].start_times
                     )
-                    + gp.quicksum(
-                        self.V_VAR.get((a, self.map_time(t)), 0)
-                        * self.activities[a].small_rooms
-                        for a in self.activities_r
+                    <= gp.quicksum(
+                        t * self.Z_VAR[ap, t] for t in self.activities[ap].start_times
                     )
-                    <= self.instance.small_room_count
+                    + len(self.slot_indices) * (1 - self.W_VAR[ap])
+                )
+                for a, ap in pairs
+            ),
+            name="C22",
+        )
+
+    def controllable_load(self, t):
+        return (
+            gp.quicksum(
+                (self.X_VAR[b, t] - self.batteries[b].efficiency * self.Y_VAR[b, t])
+                * (self.batteries[b].max_power / math.sqrt(self.batteries[b].efficiency))
+                for b in self.batteries
+            )
+            + gp.quicksum(
+                self.V_VAR.get((a, t), 0)
+                * self.activities[a].load_per_room
+                * (self.activities[a].small_rooms + self.activities[a].large_rooms)
+                for a in self.activities_o
+            )
+            + gp.quicksum(
+                self.V_VAR.get((a, self.map_time(t)), 0)
+                * self.activities[a].load_per_room
+                * (self.activities[a].small_rooms + self.activities[a].large_rooms)
+                for a in self.activities_r
+            )
+        )
+
+    def create_load_constraints(self):
+        loads = {t: self.controllable_load(t) for t in self.slot_indices}
+
+        self.load_constrs = self.model.addConstrs(
+            (
+                (
+                    self.L_VAR[t, s]
+                    == self.instance.scenarios[s].base_load[t]
+                    - self.instance.scenarios[s].solar_load[t]
+                    + loads[t]
                 )
                 for t in self.slot_indices
+                for s in self.scenarios
             ),
-            name="C13",
+            name="C11",
         )
 
         self.model.addConstrs(
@@ -453,31 +609,19 @@ class Optimizer:
             name="C17",
         )
 
-        self.model.addConstrs(
-            ((self.W_VAR[a] == 1) for a in self.activities_r), name="C18",
-        )
-
-        self.model.addConstrs(
-            (
-                (self.S_VAR[b, t] <= self.batteries[b].capacity)
-                for b in self.batteries
-                for t in self.slot_indices
-            ),
-            name="C19",
-        )
-
-        # self.model.addConstrs(
-        #     ((self.U_VAR[a] <= self.W_VAR[a]) for a in self.activities_o), name="C20",
-        # )
-
     def solve(self) -> SolutionInfo:
         Util.writeln(self.log_file, Util.SEPARATOR)
 
         self.model.update()
 
-        # self.model.optimize(lazyCallback)
-        self.model.optimize()
+        if self.toggles:
+            Util.writeln(self.log_file, f"Toggles={' '.join(self.toggles)}")
+        if isinstance(self.callback, CutSeparator):
+            self.callback.reset()
+        self.model.optimize(self.callback)
         self.solve_count += 1
+        if isinstance(self.callback, CutSeparator):
+            self.callback.write_stats()
         info = SolutionInfo()
         info.STATUS = self.model.getAttr(GRB.Attr.Status)
         # https://www.gurobi.com/documentation/9.1/refman/optimization_status_codes.html
@@ -500,14 +644,406 @@ class Optimizer:
         self.unset_start_values()
         return info
 
+    def get_loads(self):
+        return [
+            [self.L_VAR[t, s].x for s in self.scenarios] for t in self.slot_indices
+        ]
+
+    def get_peaks(self):
+        return [self.ETA_VAR[s].x for s in self.scenarios]
+
+    def get_schedule(self):
+        activity_start = OrderedDict(
+            (a, t) for (a, t), var in self.Z_VAR.items() if var.x >= 0.5
+        )
+        battery_bt_mode = OrderedDict()
+        for key, var in self.X_VAR.items():
+            if var.x >= 0.5:
+                battery_bt_mode[key] = 0
+            elif self.Y_VAR[key].x >= 0.5:
+                battery_bt_mode[key] = 2
+        return activity_start, battery_bt_mode
+
+    def set_forecasts(self, base_load, solar_load, price, probabilities=None):
+        # new forecasts (scenarios x slots) of the scenarios of the instance;
+        # they replace the full ensemble of a scenario reduction
+        if self.instance.pruned_activities:
+            # the once-offs were pruned for the old prices and net loads, and
+            # have no columns
+            raise ValueError(
+                f"{len(self.instance.pruned_activities)} once-offs pruned for the "
+                "old forecasts (update forecasts with analyse_activities = False)"
+            )
+        base_load = np.asarray(base_load, dtype=float)
+        solar_load = np.asarray(solar_load, dtype=float)
+        price = np.asarray(price, dtype=float)
+        for s, scenario in self.scenarios.items():
+            scenario.base_load = base_load[s].tolist()
+            scenario.solar_load = solar_load[s].tolist()
+            scenario.price = price[s].tolist()
+            scenario.shared = None
+            if probabilities is not None:
+                scenario.probability = float(probabilities[s])
+        self.instance.full_scenarios = self.instance.scenarios
+        return base_load, solar_load, price
+
+    def update_forecasts(self, base_load, solar_load, price, probabilities=None):
+        # new forecasts on the live model: the right-hand sides of C11, the
+        # price (and peak) coefficients of the objective and the coefficients
+        # of the peak cuts
+        base_load, solar_load, price = self.set_forecasts(
+            base_load, solar_load, price, probabilities
+        )
+        keys = [(t, s) for t in self.slot_indices for s in self.scenarios]
+        self.model.setAttr(
+            GRB.Attr.RHS,
+            [self.load_constrs[key] for key in keys],
+            [base_load[s, t] - solar_load[s, t] for t, s in keys],
+        )
+        self.model.setAttr(
+            GRB.Attr.Obj,
+            [self.L_VAR[key] for key in keys],
+            [
+                price[s, t]
+                * self.scenarios[s].probability
+                / (self.slots_per_hour * 1000)
+                for t, s in keys
+            ],
+        )
+        max_load_ub = self.instance.max_load_ub
+        if max_load_ub > len(self.load_indices):
+            # the peaks of the new forecasts need more breakpoints
+            self.model.update()
+            for i in range(len(self.load_indices) + 1, max_load_ub + 1):
+                for s in self.scenarios:
+                    self.LAMBDA_VAR[i, s] = self.model.addVar(
+                        obj=0.005 * (i ** 2) * self.scenarios[s].probability,
+                        name=f"LAMBDA[{i},{s}]",
+                        column=gp.Column(
+                            [1, i],
+                            [
+                                self.model.getConstrByName(f"C14[{s}]"),
+                                self.model.getConstrByName(f"C15[{s}]"),
+                            ],
+                        ),
+                    )
+            self.load_indices = range(1, max_load_ub + 1)
+        if probabilities is not None:
+            lambda_keys = list(self.LAMBDA_VAR.keys())
+            self.model.setAttr(
+                GRB.Attr.Obj,
+                [self.LAMBDA_VAR[key] for key in lambda_keys],
+                [
+                    0.005 * (i ** 2) * self.scenarios[s].probability
+                    for i, s in lambda_keys
+                ],
+            )
+        self.update_cuts()
+
+    def update_cuts(self):
+        # the peak cuts depend on the forecasts and the batteries
+        separator = self.callback
+        if isinstance(separator, CutSeparator) and "peak" in separator.families:
+            separator.set_peak_coefficients()
+
+    def reoptimize(self, base_load, solar_load, price, probabilities=None):
+        # re-solves after a forecast update from the current incumbent
+        before = self.get_schedule() if self.model.SolCount else None
+        self.update_forecasts(base_load, solar_load, price, probabilities)
+        if before:
+            self.set_start(*before)
+        info = self.solve()
+        if not before or self.model.SolCount == 0:
+            return info, None
+        diff = self.schedule_diff(before, self.get_schedule())
+        Util.writeln(
+            self.log_file,
+            f"ForecastUpdate Moved={len(diff['moved'])} Added={len(diff['added'])} "
+            f"Removed={len(diff['removed'])} "
+            f"BatterySlots={diff['battery_slots']}",
+        )
+        return info, diff
+
+    @staticmethod
+    def schedule_diff(before, after):
+        start_before, mode_before = before
+        start_after, mode_after = after
+        return {
+            "moved": OrderedDict(
+                (a, (t, start_after[a]))
+                for a, t in start_before.items()
+                if a in start_after and start_after[a] != t
+            ),
+            "added": [a for a in start_after if a not in start_before],
+            "removed": [a for a in start_before if a not in start_after],
+            "battery_slots": sum(
+                mode_before.get(key, 1) != mode_after.get(key, 1)
+                for key in set(mode_before) | set(mode_after)
+            ),
+        }
+
+    def update_battery(self, b, capacity, max_power, efficiency, initial_state):
+        # new parameters of a battery on the live model (binary formulation):
+        # the coefficients of X and Y in C8, C9 and C11 and the right-hand
+        # sides of C8 and C19
+        battery = self.batteries[b]
+        battery.capacity = capacity
+        battery.max_power = max_power
+        battery.efficiency = efficiency
+        battery.initial_state = initial_state
+        step = max_power / self.slots_per_hour
+        charge = max_power / math.sqrt(efficiency)
+        for t in self.slot_indices:
+            row = self.initial_state_constrs[b] if t == 0 else self.state_constrs[b, t]
+            self.model.chgCoeff(row, self.X_VAR[b, t], -step)
+            self.model.chgCoeff(row, self.Y_VAR[b, t], step)
+            for s in self.scenarios:
+                self.model.chgCoeff(self.load_constrs[t, s], self.X_VAR[b, t], -charge)
+                self.model.chgCoeff(
+                    self.load_constrs[t, s], self.Y_VAR[b, t], efficiency * charge
+                )
+        self.initial_state_constrs[b].RHS = initial_state
+        constrs = [self.capacity_constrs[b, t] for t in self.slot_indices]
+        self.model.setAttr(GRB.Attr.RHS, constrs, [capacity] * len(constrs))
+        self.update_cuts()
+
+    def keep_schedule(self, removed=None):
+        # the current schedule (if any) as the start of the next solve
+        if not self.model.SolCount:
+            return
+        try:
+            activity_start, battery_bt_mode = self.get_schedule()
+        except gp.GurobiError:
+            return  # the model changed since the last solve, the start is set
+        activity_start.pop(removed, None)
+        self.set_start(activity_start, battery_bt_mode)
+
+    def progress_columns(self, a):
+        # the coefficients of V[a, t] in C11, C12 and C13 for every progress time
+        activity = self.activities[a]
+        power = activity.load_per_room * (activity.small_rooms + activity.large_rooms)
+        slots = {t: [] for t in activity.progress_times}
+        for t in self.slot_indices:
+            tp = self.map_time(t) if activity.type == Type.R else t
+            if tp in slots:
+                slots[tp].append(t)
+        columns = {}
+        for tp, horizon_slots in slots.items():
+            column = []
+            for t in horizon_slots:
+                column.extend((self.load_constrs[t, s], -power) for s in self.scenarios)
+                if activity.large_rooms:
+                    column.append((self.large_room_constrs[t], activity.large_rooms))
+                if activity.small_rooms:
+                    column.append((self.small_room_constrs[t], activity.small_rooms))
+            columns[tp] = column
+        return columns
+
+    def check_structure(self):
+        # the saved bounds are the variables of the model at the time
+        if self.snapshots:
+            raise ValueError(
+                f"Bounds saved ({' '.join(self.snapshots)}), restore them before "
+                "adding or removing activities"
+            )
+
+    def reset_cuts(self):
+        # the separator keeps the Z variables and the activities of the model
+        separator = self.callback
+        if isinstance(separator, CutSeparator):
+            self.callback = separator.previous
+            self.callback = CutSeparator(self, separator.families)
+
+    def add_activity(self, activity):
+        # a new once-off (times from the instance) on the live model, started
+        # from the current schedule; the index of the activity is returned
+        if activity.type == Type.R:
+            # the recurring activities come first (indices and ppoi files)
+            raise ValueError(f"Recurring activity {activity.key} can not be added")
+        self.check_structure()
+        self.keep_schedule()
+        instance = self.instance
+        a = len(instance.activities)
+        instance.activities.append(activity)
+        instance.set_times(activity)
+        if (
+            activity.small_rooms > instance.small_room_count
+            or activity.large_rooms > instance.large_room_count
+        ):
+            activity.start_times = []
+        self.activities[a] = activity
+        instance.activities_o.append(activity)
+        self.activities_o[a] = activity
+        columns = self.progress_columns(a)
+        start_times = set(activity.start_times)
+        for t in activity.start_times:
+            column = gp.Column()
+            if self.setting.activity_formulation == "vfree":
+                for tp in range(t, t + activity.duration):
+                    for constr, coeff in columns.get(tp, []):
+                        column.addTerms(coeff, constr)
+            self.Z_VAR[a, t] = self.model.addVar(
+                vtype=GRB.BINARY, name=f"Z[{a},{t}]", column=column
+            )
+        for t in activity.progress_times:
+            if self.setting.activity_formulation == "vfree":
+                self.V_VAR[a, t] = gp.quicksum(
+                    self.Z_VAR[a, tp]
+                    for tp in range(t - activity.duration + 1, t + 1)
+                    if tp in start_times
+                )
+            else:
+                column = gp.Column()
+                for constr, coeff in columns[t]:
+                    column.addTerms(coeff, constr)
+                self.V_VAR[a, t] = self.model.addVar(
+                    vtype=GRB.BINARY, name=f"V[{a},{t}]", column=column
+                )
+        self.W_VAR[a] = self.model.addVar(
+            obj=-activity.revenue, vtype=GRB.BINARY, name=f"W[{a}]"
+        )
+        self.D_VAR[a] = self.model.addVar(vtype=GRB.INTEGER, name=f"D[{a}]")
+        if self.setting.activity_formulation != "vfree":
+            for t in activity.progress_times:
+                self.model.addLConstr(
+                    gp.quicksum(
+                        self.Z_VAR[a, tp]
+                        for tp in range(t - activity.duration + 1, t + 1)
+                        if tp in start_times
+                    ),
+                    GRB.EQUAL,
+                    self.V_VAR[a, t],
+                    name=f"C1[{a},{t}]",
+                )
+        if self.needs_c2(a):
+            self.model.addLConstr(
+                gp.quicksum(self.V_VAR[a, t] for t in activity.progress_times),
+                GRB.EQUAL,
+                activity.duration * self.W_VAR[a],
+                name=f"C2[{a}]",
+            )
+        self.model.addLConstr(
+            gp.quicksum(self.Z_VAR[a, t] for t in activity.start_times),
+            GRB.EQUAL,
+            self.W_VAR[a],
+            name=f"C3[{a}]",
+        )
+        self.U_VAR[a] = self.model.addVar(
+            obj=activity.penalty, vtype=GRB.BINARY, name=f"U[{a}]"
+        )
+        self.model.addLConstr(
+            gp.quicksum(self.Z_VAR[a, t] for t in activity.penalty_times),
+            GRB.EQUAL,
+            self.U_VAR[a],
+            name=f"C4[{a}]",
+        )
+        self.model.addLConstr(
+            gp.quicksum(
+                self.Z_VAR[a, t]
+                * ((t + instance.time.utc_offset) // instance.time.slots_per_day)
+                for t in activity.start_times
+            )
+            + math.ceil(
+                1
+                + (len(self.slot_indices) + instance.time.utc_offset)
+                / instance.time.slots_per_day
+            )
+            * (1 - self.W_VAR[a]),
+            GRB.EQUAL,
+            self.D_VAR[a],
+            name=f"C5[{a}]",
+        )
+        for ap in activity.prerequisites:
+            self.add_precedence(a, ap)
+        self.reset_cuts()
+        Util.writeln(
+            self.log_file,
+            f"AddActivity={activity.key} Index={a} StartTimes={len(start_times)}",
+        )
+        return a
+
+    def add_precedence(self, a, ap):
+        # C6 and C7 of prerequisite ap of a
+        self.model.addLConstr(
+            self.D_VAR[ap] + self.W_VAR[ap],
+            GRB.LESS_EQUAL,
+            self.D_VAR[a],
+            name=f"C6[{a},{ap}]",
+        )
+        self.model.addLConstr(
+            self.W_VAR[a], GRB.LESS_EQUAL, self.W_VAR[ap], name=f"C7[{a},{ap}]"
+        )
+
+    def remove_activity(self, a):
+        # drops the starts of an activity and its links to its dependants from
+        # the live model (they inherit its prerequisites); W, U and D stay,
+        # fixed at zero (unscheduled) by C2-C5, and a recurring activity leaves
+        # the recurring activities (and the solution files)
+        self.check_structure()
+        self.keep_schedule(removed=a)
+        activity = self.activities[a]
+        names = {f"C1[{a},{t}]" for t in activity.progress_times}
+        names.add(f"C18[{a}]")
+        for ap, other in self.activities.items():
+            if a in other.prerequisites:
+                names.update((f"C6[{ap},{a}]", f"C7[{ap},{a}]"))
+                other.prerequisites = [p for p in other.prerequisites if p != a]
+                # the prerequisites of a may be implied through a only (the
+                # reduced lists of reduce_activity_times), so they pass on
+                for p in activity.prerequisites:
+                    if p not in other.prerequisites:
+                        other.prerequisites.append(p)
+                        self.add_precedence(ap, p)
+        classes = self.instance.symmetric_classes
+        for members in [members for members in classes if a in members]:
+            for b, bp in zip(members, members[1:]):
+                names.update((f"C21[{b},{bp}]", f"C22[{b},{bp}]"))
+            classes.remove(members)
+        self.model.update()
+        constrs = self.model.getConstrs()
+        constrs = [
+            constr
+            for constr, name in zip(
+                constrs, self.model.getAttr(GRB.Attr.ConstrName, constrs)
+            )
+            if name in names
+        ]
+        variables = [self.Z_VAR.pop((a, t)) for t in activity.start_times]
+        for t in activity.progress_times:
+            var = self.V_VAR.pop((a, t))
+            if self.setting.activity_formulation != "vfree":
+                variables.append(var)
+        self.model.remove(constrs + variables)
+        removed = set(id(var) for var in variables)
+        self.start_vars = [var for var in self.start_vars if id(var) not in removed]
+        activity.start_times = []
+        activity.progress_times = []
+        activity.penalty_times = []
+        if activity.type == Type.R:
+            self.activities_r.pop(a)
+            self.instance.activities_r.remove(activity)
+        self.reset_cuts()
+        Util.writeln(
+            self.log_file,
+            f"RemoveActivity={activity.key} Index={a} Constraints={len(constrs)}",
+        )
+
     def set_start_values(self):
         if not self.setting.solver.setstart:
             return
-        if self.instance.sol_battery_bt_mode:
+        self.set_start(
+            self.instance.sol_activity_start, self.instance.sol_battery_bt_mode
+        )
+
+    def set_start(self, activity_start, battery_bt_mode):
+        activity_start = Analysis.canonical_start(
+            activity_start, self.instance.symmetric_classes
+        )
+        if battery_bt_mode:
             for key in self.X_VAR:
                 self.start_vars.append(self.X_VAR[key])
                 self.start_vars.append(self.Y_VAR[key])
-                mode = self.instance.sol_battery_bt_mode.get(key, 1)
+                mode = battery_bt_mode.get(key, 1)
                 if mode == 0:
                     self.X_VAR[key].start = 1
                     self.Y_VAR[key].start = 0
@@ -519,16 +1055,21 @@ class Optimizer:
                     self.Y_VAR[key].start = 0
         else:
             for key in self.X_VAR:
+                self.start_vars.append(self.X_VAR[key])
+                self.start_vars.append(self.Y_VAR[key])
                 self.X_VAR[key].start = 0
                 self.Y_VAR[key].start = 0
-        if self.instance.sol_activity_start:
+        if activity_start:
+            # replaces the starts set before (e.g. those of the startsol)
+            self.set_attr(GRB.Attr.Start, self.Z_VAR.values(), 0)
+            self.start_vars.extend(self.Z_VAR.values())
             for a in self.activities_o:
                 self.start_vars.append(self.W_VAR[a])
                 self.W_VAR[a].start = 0
-            for a, t in self.instance.sol_activity_start.items():
+            for a, t in activity_start.items():
+                self.start_vars.append(self.W_VAR[a])
                 self.Z_VAR[a, t].start = 1
                 self.W_VAR[a].start = 1
-                self.start_vars.append(self.Z_VAR[a, t])
 
     def fix_solution(self):
         if not self.setting.solver.fixsol:
@@ -558,52 +1099,116 @@ class Optimizer:
                 self.W_VAR[a].lb = 1
 
     def unset_start_values(self):
-        if not self.setting.solver.setstart:
+        # every start is set on a variable of start_vars
+        if not self.start_vars:
             return
-        for var in self.model.getVars():
-            var.start = GRB.UNDEFINED
+        self.set_attr(GRB.Attr.Start, self.start_vars, GRB.UNDEFINED)
         self.start_vars.clear()
 
     def set_start_from_model(self, optimized_model):
         for var in optimized_model.getVars():
             if var.x > 0.01:
-                self.model.getVarByName(var.VarName).start = var.x
+                start_var = self.model.getVarByName(var.VarName)
+                start_var.start = var.x
+                self.start_vars.append(start_var)
+
+    def set_attr(self, attr, variables, values):
+        # one call for a group of variables, values is a list or a scalar
+        variables = list(variables)
+        if not isinstance(values, list):
+            values = [values] * len(variables)
+        if variables:
+            self.model.setAttr(attr, variables, values)
+
+    def save_bounds(self, name, variables=None):
+        # a named snapshot of the bounds and types of the variables (all of
+        # them by default) and of the active toggles
+        self.model.update()
+        variables = self.model.getVars() if variables is None else list(variables)
+        self.snapshots[name] = (
+            variables,
+            self.model.getAttr(GRB.Attr.LB, variables),
+            self.model.getAttr(GRB.Attr.UB, variables),
+            self.model.getAttr(GRB.Attr.VType, variables),
+            list(self.toggles),
+        )
+
+    def restore_bounds(self, name):
+        variables, lbs, ubs, vtypes, toggles = self.snapshots.pop(name)
+        self.set_attr(GRB.Attr.LB, variables, lbs)
+        self.set_attr(GRB.Attr.UB, variables, ubs)
+        self.set_attr(GRB.Attr.VType, variables, vtypes)
+        self.toggles = toggles
+
+    def toggle(self, name, active=True):
+        if active and name not in self.toggles:
+            self.toggles.append(name)
+        elif not active and name in self.toggles:
+            self.toggles.remove(name)
 
     def exclude_penalized_activities(self):
-        for _, var in self.U_VAR.items():
-            var.ub = 0
+        self.set_attr(GRB.Attr.UB, self.U_VAR.values(), 0)
+        self.toggle("exclude_penalized_activities")
 
     def include_penalized_activities(self):
-        for _, var in self.U_VAR.items():
-            var.ub = 1
+        self.set_attr(GRB.Attr.UB, self.U_VAR.values(), 1)
+        self.toggle("exclude_penalized_activities", False)
 
     def exclude_batteries(self):
-        for idx in self.X_VAR:
-            self.X_VAR[idx].ub = 0
-            self.Y_VAR[idx].ub = 0
+        self.set_attr(GRB.Attr.UB, self.X_VAR.values(), 0)
+        self.set_attr(GRB.Attr.UB, self.Y_VAR.values(), 0)
+        self.toggle("exclude_batteries")
 
     def include_batteries(self):
-        for idx in self.X_VAR:
-            self.X_VAR[idx].ub = 1
-            self.Y_VAR[idx].ub = 1
+        self.set_attr(GRB.Attr.LB, self.X_VAR.values(), 0)
+        self.set_attr(GRB.Attr.LB, self.Y_VAR.values(), 0)
+        self.set_attr(
+            GRB.Attr.UB,
+            self.X_VAR.values(),
+            [0 if idx in self.no_charge else 1 for idx in self.X_VAR],
+        )
+        self.set_attr(
+            GRB.Attr.UB,
+            self.Y_VAR.values(),
+            [0 if idx in self.no_discharge else 1 for idx in self.Y_VAR],
+        )
+        for name in ["exclude_batteries", "fix_batteries", "restrict_charge_discharge"]:
+            self.toggle(name, False)
+
+    def fix_batteries(self, battery_bt_mode):
+        modes = [battery_bt_mode.get(key, 1) for key in self.X_VAR]
+        charge = [1 if mode == 0 else 0 for mode in modes]
+        discharge = [1 if mode == 2 else 0 for mode in modes]
+        for attr in [GRB.Attr.LB, GRB.Attr.UB]:
+            self.set_attr(attr, self.X_VAR.values(), charge)
+            self.set_attr(attr, self.Y_VAR.values(), discharge)
+        self.toggle("fix_batteries")
 
     def restrict_charge_discharge_times(self):
-        for b in self.batteries:
-            for t in self.slot_indices:
-                if self.instance.is_office_hour(t):
-                    self.X_VAR[b, t].ub = 0
-                else:
-                    self.Y_VAR[b, t].ub = 0
+        office = {t: self.instance.is_office_hour(t) for t in self.slot_indices}
+        self.set_attr(
+            GRB.Attr.UB,
+            [var for (b, t), var in self.X_VAR.items() if office[t]],
+            0,
+        )
+        self.set_attr(
+            GRB.Attr.UB,
+            [var for (b, t), var in self.Y_VAR.items() if not office[t]],
+            0,
+        )
+        self.toggle("restrict_charge_discharge")
 
     def use_restricted_activity_starts(self):
-        for a, t in self.Z_VAR:
-            if t % 2 == 1:
-                self.Z_VAR[a, t].ub = 0
+        self.set_attr(
+            GRB.Attr.UB, [var for (a, t), var in self.Z_VAR.items() if t % 2 == 1], 0
+        )
+        self.toggle("restricted_activity_starts")
 
     def undo_restricted_activity_starts(self):
-        for a, t in self.Z_VAR:
-            if t % 2 == 1:
-                self.Z_VAR[a, t].ub = 1
+        self.set_attr(
+            GRB.Attr.UB, [var for (a, t), var in self.Z_VAR.items() if t % 2 == 1], 1
+        )
+        self.toggle("restricted_activity_starts", False)
 
     def use_double_bubble_slots(self):
         self.use_restricted_activity_starts()
@@ -619,36 +1224,72 @@ class Optimizer:
                     )
                     self.temporary_constraints.append(x_const)
                     self.temporary_constraints.append(y_const)
+        self.toggle("double_bubble_slots")
 
     def undo_double_bubble_slots(self):
         self.undo_restricted_activity_starts()
         self.model.remove(self.temporary_constraints)
         self.temporary_constraints.clear()
+        self.toggle("double_bubble_slots", False)
+
+    def restrict_activity_starts(self, activity_start, width):
+        self.set_attr(
+            GRB.Attr.UB,
+            [
+                var
+                for (a, t), var in self.Z_VAR.items()
+                if a not in activity_start or abs(t - activity_start[a]) > width
+            ],
+            0,
+        )
+        self.toggle("restrict_activity_starts")
+
+    def undo_restrict_activity_starts(self):
+        self.set_attr(GRB.Attr.UB, self.Z_VAR.values(), 1)
+        self.toggle("restrict_activity_starts", False)
 
     def fix_activities(self, flexible=False):
-        related_vars = {}
         width = 1
-        for (a, t), var in self.Z_VAR.items():
-            if var.x > 0.1:
-                related_vars[a, t] = var
-            if self.W_VAR[a].x > 0.1:
-                var.ub = 0
-        for (a, t), var in related_vars.items():
-            self.W_VAR[a].lb = 1
+        z_values = self.model.getAttr(GRB.Attr.X, self.Z_VAR)
+        w_values = self.model.getAttr(GRB.Attr.X, self.W_VAR)
+        starts = [key for key, value in z_values.items() if value > 0.1]
+        lbs, ubs = {}, {}
+        for a, t in self.Z_VAR:
+            if w_values[a] > 0.1:
+                ubs[a, t] = 0
+        for a, t in starts:
             if flexible:
                 for tp in range(t - width, t + width + 1):
                     if (a, tp) in self.Z_VAR:
-                        self.Z_VAR[a, tp].ub = 1
+                        ubs[a, tp] = 1
             else:
-                var.lb = 1
-                var.ub = 1
+                lbs[a, t] = ubs[a, t] = 1
+        self.set_attr(GRB.Attr.LB, [self.W_VAR[a] for a, _ in starts], 1)
+        self.set_attr(GRB.Attr.LB, [self.Z_VAR[key] for key in lbs], list(lbs.values()))
+        self.set_attr(GRB.Attr.UB, [self.Z_VAR[key] for key in ubs], list(ubs.values()))
+        self.toggle("fix_activities")
 
     def use_continuous_battery_variables(self):
-        for idx in self.X_VAR:
-            self.X_VAR[idx].VType = GRB.CONTINUOUS
-            self.Y_VAR[idx].VType = GRB.CONTINUOUS
+        self.set_attr(GRB.Attr.VType, self.X_VAR.values(), GRB.CONTINUOUS)
+        self.set_attr(GRB.Attr.VType, self.Y_VAR.values(), GRB.CONTINUOUS)
+        if self.battery_sos:
+            # the rows of C10 instead of the SOS1 sets of the compact mode, so
+            # the batteries are a linear relaxation
+            self.model.update()
+            for sos in self.battery_sos:
+                self.model.remove(sos)
+            self.battery_sos = []
+            self.battery_mode_constrs = self.model.addConstrs(
+                (self.X_VAR[key] + self.Y_VAR[key] <= 1 for key in self.X_VAR),
+                name="C10",
+            )
+        self.toggle("continuous_battery_variables")
 
     def use_binary_battery_variables(self):
-        for idx in self.X_VAR:
-            self.X_VAR[idx].VType = GRB.BINARY
-            self.Y_VAR[idx].VType = GRB.BINARY
+        self.set_attr(GRB.Attr.VType, self.X_VAR.values(), GRB.BINARY)
+        self.set_attr(GRB.Attr.VType, self.Y_VAR.values(), GRB.BINARY)
+        if self.battery_mode_constrs is not None:
+            self.model.remove(self.battery_mode_constrs)
+            self.battery_mode_constrs = None
+            self.add_battery_sos()
+        self.toggle("continuous_battery_variables", False)
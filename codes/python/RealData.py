@@ -0,0 +1,252 @@
+import os
+import json
+import timeit
+import hashlib
+import itertools
+from collections import OrderedDict
+import numpy as np
+import Util
+
+# Streaming ingestion of the metered loads ("All_data*.csv": id, series, start
+# of the interval in UTC, kW) and the prices ("PRICE_AND_DEMAND*.csv": region,
+# end of the interval, demand, price) for use_real_data, so a long history
+# (e.g. a year of meter data for a backtest) is read in chunks of
+# real_data_chunk rows with bounded memory. A chunk is parsed with numpy; rows
+# outside the time slots are skipped. The interval of a file is the most
+# common step of its series (any length, e.g. 5, 15 or 30 minutes), and every
+# interval is spread over the time slots it overlaps, so a slot gets the
+# time-weighted mean of its intervals. The timestamps are moved to the clock of
+# the time slots (meter_utc_hours and price_utc_hours, None keeps the clock of
+# the slots). An NA meter reading is no load, as before. Slots without data
+# (no rows, or NA prices) are gaps: a gap of up to real_data_max_gap slots is
+# interpolated, a longer one raises an error. The series of the time slots are
+# cached as binary files ("output/cache"), keyed by the files (size and
+# modification time) and the settings, so the next instance of the month reads
+# them at once (unless real_data_cache is off). The counts are written to
+# "real_data.log".
+
+OUTLIER = 1700  # meter readings from OUTLIER up are replaced by OUTLIER_LOAD
+OUTLIER_LOAD = 144
+
+
+def read_chunks(file_path, rows, skip=0):
+    with open(file_path, "r") as file:
+        for line in itertools.islice(file, skip):
+            pass
+        while chunk := list(itertools.islice(file, rows)):
+            yield chunk
+
+
+def split(lines, columns):
+    fields = np.array([line.rstrip("\n").split(",") for line in lines])
+    return [np.char.strip(fields[:, column], '"') for column in columns]
+
+
+def parse_values(values):
+    # empty and NA readings are nan
+    return np.where(np.isin(values, ["", "NA"]), "nan", values).astype(float)
+
+
+def parse_meter(lines):
+    names, times, values = split(lines, [1, 2, 3])
+    values = parse_values(values)
+    values = np.where(values >= OUTLIER, OUTLIER_LOAD, values)
+    return names, times.astype("datetime64[m]"), values
+
+
+def parse_price(lines):
+    # the timestamps are the ends of the intervals
+    names, times, values = split(lines, [0, 1, 3])
+    times = np.char.replace(times, "/", "-").astype("datetime64[m]")
+    return names, times, parse_values(values)
+
+
+def get_period(names, times, default):
+    # the most common step (minutes) between the rows of a series
+    steps = np.diff(times).astype(np.int64)[names[1:] == names[:-1]]
+    steps = steps[steps > 0]
+    if not len(steps):
+        return default
+    values, counts = np.unique(steps, return_counts=True)
+    return int(values[counts.argmax()])
+
+
+class Resampler:
+    def __init__(self, start, slot_minutes, slot_count):
+        self.start = np.datetime64(start, "m")
+        self.slot_minutes = slot_minutes
+        self.slot_count = slot_count
+        self.names = OrderedDict()  # series -> row
+        self.weighted = np.zeros((0, slot_count))
+        self.covered = np.zeros((0, slot_count))
+        self.stats = OrderedDict(
+            (name, 0) for name in ["rows", "outside", "missing", "partial"]
+        )
+        self.stats.update(overlapping=0, interpolated=0)
+
+    def get_rows(self, names):
+        unique, inverse = np.unique(names, return_inverse=True)
+        for name in unique:
+            if name not in self.names:
+                self.names[name] = len(self.names)
+        empty = np.zeros((len(self.names) - len(self.weighted), self.slot_count))
+        self.weighted = np.vstack([self.weighted, empty])
+        self.covered = np.vstack([self.covered, empty])
+        rows = np.array([self.names[name] for name in unique], dtype=np.int64)
+        return rows[inverse]
+
+    def add(self, names, starts, period, values, missing=None):
+        # intervals [start, start + period) in the clock of the slots, a nan
+        # value is missing (None) or the given value
+        slot = self.slot_minutes
+        begin = (starts - self.start).astype(np.int64)
+        end = begin + period
+        inside = (end > 0) & (begin < self.slot_count * slot)
+        self.stats["rows"] += len(values)
+        self.stats["outside"] += int((~inside).sum())
+        self.stats["missing"] += int((inside & np.isnan(values)).sum())
+        if missing is not None:
+            values = np.where(np.isnan(values), missing, values)
+        valid = inside & ~np.isnan(values)
+        rows = self.get_rows(names[valid])
+        begin, end, values = begin[valid], end[valid], values[valid]
+        first = begin // slot
+        for j in range(-(-period // slot) + 1):
+            t = first + j
+            overlap = np.minimum(end, (t + 1) * slot) - np.maximum(begin, t * slot)
+            mask = (overlap > 0) & (t >= 0) & (t < self.slot_count)
+            cells = rows[mask] * self.slot_count + t[mask]
+            size = self.weighted.size
+            self.weighted += np.bincount(
+                cells, values[mask] * overlap[mask], size
+            ).reshape(self.weighted.shape)
+            self.covered += np.bincount(cells, overlap[mask], size).reshape(
+                self.covered.shape
+            )
+
+    def get_series(self, max_gap):
+        covered = self.covered
+        self.stats["partial"] = int(
+            ((covered > 0) & (covered < self.slot_minutes)).sum()
+        )
+        self.stats["overlapping"] = int((covered > self.slot_minutes).sum())
+        series = np.divide(
+            self.weighted,
+            covered,
+            out=np.full(covered.shape, np.nan),
+            where=covered > 0,
+        )
+        slots = np.arange(self.slot_count)
+        for name, row in self.names.items():
+            gaps = np.isnan(series[row])
+            if not gaps.any():
+                continue
+            if gaps.all():
+                raise ValueError(f"No real data of {name} in the time slots")
+            # the longest run of missing slots
+            edges = np.diff(np.concatenate([[0], gaps.astype(np.int8), [0]]))
+            starts, ends = np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+            longest = (ends - starts).argmax()
+            if ends[longest] - starts[longest] > max_gap:
+                raise ValueError(
+                    f"{ends[longest] - starts[longest]} slots of {name} without "
+                    f"real data from slot {starts[longest]}"
+                )
+            series[row, gaps] = np.interp(slots[gaps], slots[~gaps], series[row, ~gaps])
+            self.stats["interpolated"] += int(gaps.sum())
+        return list(self.names), series
+
+
+def get_shift(instance, utc_hours):
+    # minutes from the timestamps of a file to the clock of the time slots
+    if utc_hours is None:
+        return 0
+    # the slots are in UTC (utc_offset is the 11 hours to the local time) or
+    # in the local time
+    time = instance.time
+    slot_hours = 11 - time.utc_offset // time.slots_per_hour
+    return int((slot_hours - utc_hours) * 60)
+
+
+def get_cache_file(instance, kind, files, shift):
+    setting = instance.setting
+    key = [kind, shift, setting.slot_minutes, setting.real_data_max_gap]
+    key += [str(instance.time.slots[0].interval.a), len(instance.time.slots)]
+    key += [
+        (os.path.abspath(f), os.path.getsize(f), os.path.getmtime(f)) for f in files
+    ]
+    key = hashlib.sha1(json.dumps(key).encode()).hexdigest()[:16]
+    return Util.joinpath(setting.main_dir, "output", "cache", f"{kind}_{key}.npz")
+
+
+def read_series(instance, kind, files):
+    # names and values (series x time slots) of the files of a kind
+    setting = instance.setting
+    # an NA meter reading is no load (some buildings have long runs of them),
+    # a missing price is a gap
+    if kind == "meter":
+        parse, skip, missing = parse_meter, 0, 0
+        utc_hours = setting.meter_utc_hours
+    else:
+        parse, skip, missing = parse_price, 1, None
+        utc_hours = setting.price_utc_hours
+    shift = get_shift(instance, utc_hours)
+    cache_file = get_cache_file(instance, kind, files, shift)
+    start_time = timeit.default_timer()
+    if setting.real_data_cache and Util.exists(cache_file):
+        with np.load(cache_file) as cache:
+            names, values = cache["names"].tolist(), cache["values"]
+        message = f"Cached {kind}: {cache_file}"
+    else:
+        time = instance.time
+        resampler = Resampler(
+            time.slots[0].interval.a, time.slot_minutes, len(time.slots)
+        )
+        periods = []
+        for file_path in files:
+            period = None
+            for chunk in read_chunks(file_path, setting.real_data_chunk, skip):
+                names, times, values = parse(chunk)
+                if period is None:
+                    period = get_period(names, times, time.slot_minutes)
+                    periods.append(period)
+                starts = times + np.timedelta64(shift, "m")
+                if kind == "price":
+                    starts -= np.timedelta64(period, "m")
+                resampler.add(names, starts, period, values, missing)
+        names, values = resampler.get_series(setting.real_data_max_gap)
+        if setting.real_data_cache:
+            Util.mkdir(Util.getDirFromPath(cache_file))
+            np.savez(cache_file, names=np.array(names), values=values)
+        message = (
+            f"Read {kind}: Files={len(files)} Periods={periods} Shift={shift} "
+            + " ".join(f"{name}={count}" for name, count in resampler.stats.items())
+        )
+    message += f" Series={len(names)} Time={timeit.default_timer() - start_time:.2f}"
+    Util.writeln(Util.joinpath(instance.folder, "real_data.log"), message)
+    return names, values
+
+
+def get_key(name):
+    digits = "".join(c for c in name if c.isdigit())
+    return int(digits) if digits else None
+
+
+def load_real_data(instance, scenario_dir):
+    meter_files = sorted(f for f in scenario_dir if "All_data" in f)
+    price_files = sorted(f for f in scenario_dir if "PRICE_AND_DEMAND" in f)
+    valid_buildings = [b.key for b in instance.buildings]
+    valid_solars = [b.solar_id for b in instance.buildings]
+    names, values = read_series(instance, "meter", meter_files)
+    base_load = np.zeros(len(instance.time.slots))
+    solar_load = np.zeros(len(instance.time.slots))
+    for name, series in zip(names, values):
+        if "Building" in name and get_key(name) in valid_buildings:
+            base_load += series
+        if "Solar" in name and get_key(name) in valid_solars:
+            solar_load += series
+    names, values = read_series(instance, "price", price_files)
+    scenario = instance.scenarios[0]
+    scenario.base_load = base_load.tolist()
+    scenario.solar_load = solar_load.tolist()
+    scenario.price = values[0].tolist()  # the first region
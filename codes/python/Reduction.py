@@ -0,0 +1,68 @@
+import copy
+import numpy as np
+from Instance import Instance
+import Util
+
+# Scenario reduction by fast forward selection (Heitsch and Roemisch, 2003).
+# Every scenario is described by its net load (base load - solar) and price
+# profiles, standardised over the whole ensemble, and scenarios are compared
+# with the L1 (Kantorovich) distance. The probability of every deleted
+# scenario is moved to its closest kept scenario.
+
+
+def get_features(scenarios):
+    net_load = np.array(
+        [np.subtract(s.base_load, s.solar_load) for s in scenarios], dtype=float
+    )
+    price = np.array([s.price for s in scenarios], dtype=float)
+    features = []
+    for block in (net_load, price):
+        scale = block.std()
+        features.append(block / scale if scale > 0 else block)
+    return np.hstack(features)
+
+
+def get_distances(features):
+    distances = np.empty((len(features), len(features)))
+    for i, row in enumerate(features):
+        distances[i] = np.abs(features - row).sum(axis=1)
+    return distances
+
+
+def fast_forward_selection(distances, probabilities, count):
+    probabilities = np.asarray(probabilities, dtype=float)
+    cost = distances.copy()
+    remaining = np.ones(len(probabilities), dtype=bool)
+    selected = []
+    for _ in range(min(count, len(probabilities))):
+        # sum of p_k * (distance of k to the kept set) if u is kept as well
+        scores = (probabilities * remaining) @ cost
+        scores[~remaining] = np.inf
+        u = int(np.argmin(scores))
+        selected.append(u)
+        remaining[u] = False
+        cost = np.minimum(cost, cost[:, [u]])
+    closest = np.argmin(distances[:, selected], axis=1)
+    weights = np.bincount(closest, weights=probabilities, minlength=len(selected))
+    error = float(probabilities @ distances[:, selected].min(axis=1))
+    return selected, weights, error
+
+
+def reduce_scenarios(instance: Instance, count):
+    scenarios = instance.full_scenarios
+    if count is None or count >= len(scenarios):
+        return
+    probabilities = [s.probability for s in scenarios]
+    distances = get_distances(get_features(scenarios))
+    selected, weights, error = fast_forward_selection(distances, probabilities, count)
+    instance.scenarios = []
+    for index, weight in zip(selected, weights):
+        scenario = copy.copy(scenarios[index])
+        scenario.probability = float(weight)
+        instance.scenarios.append(scenario)
+    reduced = " ".join(f"{s.name}({s.probability:.4f})" for s in instance.scenarios)
+    message = (
+        f"Reduced {len(scenarios)} scenarios to {len(selected)}: {reduced}, "
+        f"Kantorovich distance {error:.4f}"
+    )
+    Util.writeln(Util.joinpath(instance.folder, "reduction.log"), message, mode="w")
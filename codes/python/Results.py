@@ -0,0 +1,256 @@
+import sys
+import json
+import time
+import hashlib
+import numpy as np
+from Setting import Setting
+import Util
+
+# A store of the results of all runs in a SQLite database (write-ahead log, so
+# many processes write at once), instead of appending to summary.csv. A run is
+# keyed by instance, algorithm, settings hash, phase and seed; the hash covers
+# every setting except these keys, the name and the directories, and the
+# settings themselves are kept once per hash. A "summary" run has the columns
+# of SolutionInfo, an "evaluation" run (fixsol) the objective of every
+# scenario. export_csv writes the runs of one setting (name, algorithm,
+# settings hash and phase) in the layout of summary.csv (with the statistics
+# of the evaluations at the end); the columns of SolutionInfo have no type, so
+# a value is read back as it was written.
+#   python Results.py export [file] [name] [algorithm]   hash and phase of Setting
+#   python Results.py stats [field]       by algorithm and settings hash
+
+FIELDS = ["LB", "UB", "GAP", "CPU", "NOD", "ITR", "NNZ", "VARs", "CONs"]
+KEYS = ["instance", "algorithm", "settings_hash", "phase", "seed"]
+UNHASHED = ["name", "algorithm", "phase", "seed", "main_dir", "startsol_dir"]
+UNHASHED += ["input_dir"]
+STATISTICS = ["mean", "std", "min", "50%", "max", "count"]
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS settings (
+    hash TEXT PRIMARY KEY,
+    name TEXT,
+    settings TEXT
+);
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    instance TEXT NOT NULL,
+    algorithm INTEGER,
+    settings_hash TEXT REFERENCES settings (hash),
+    phase INTEGER,
+    seed INTEGER,
+    name TEXT,
+    kind TEXT NOT NULL,
+    folder TEXT,
+    created REAL,
+    {", ".join(FIELDS)},
+    STATUS INTEGER
+);
+CREATE INDEX IF NOT EXISTS runs_key ON runs ({", ".join(KEYS)});
+CREATE INDEX IF NOT EXISTS runs_group ON runs (kind, name, algorithm);
+CREATE TABLE IF NOT EXISTS objectives (
+    run_id INTEGER REFERENCES runs (id),
+    position INTEGER,
+    scenario TEXT,
+    objective REAL,
+    PRIMARY KEY (run_id, position)
+);
+"""
+
+
+def get_settings(setting: Setting):
+    values = {
+        key: vars(value) if key == "solver" else value
+        for key, value in vars(setting).items()
+    }
+    values["solver"] = {
+        key: value for key, value in values["solver"].items() if key not in UNHASHED
+    }
+    return {key: value for key, value in values.items() if key not in UNHASHED}
+
+
+def get_settings_hash(setting: Setting):
+    settings = json.dumps(get_settings(setting), sort_keys=True, default=str)
+    return hashlib.sha1(settings.encode()).hexdigest()[:16]
+
+
+class ResultStore:
+    def __init__(self, file_path):
+        self.file_path = file_path
+        Util.mkdir(Util.getDirFromPath(file_path))
+        self.connection = Util.connect(file_path)
+        self.connection.executescript(SCHEMA)
+
+    def add_run(self, instance, kind, info=None, objectives=()):
+        setting = instance.setting
+        settings_hash = get_settings_hash(setting)
+        values = [getattr(info, field) for field in FIELDS + ["STATUS"]] if info else []
+        columns = ["instance", "algorithm", "settings_hash", "phase", "seed", "name"]
+        columns += ["kind", "folder", "created"] + (FIELDS + ["STATUS"] if info else [])
+        connection = self.connection
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.execute(
+                "INSERT OR IGNORE INTO settings (hash, name, settings) VALUES (?, ?, ?)",
+                (
+                    settings_hash,
+                    setting.name,
+                    json.dumps(get_settings(setting), sort_keys=True, default=str),
+                ),
+            )
+            run_id = connection.execute(
+                f"INSERT INTO runs ({', '.join(columns)}) "
+                f"VALUES ({', '.join('?' * len(columns))})",
+                [
+                    instance.name,
+                    setting.algorithm,
+                    settings_hash,
+                    setting.phase,
+                    setting.solver.seed,
+                    setting.name,
+                    kind,
+                    instance.folder,
+                    time.time(),
+                ]
+                + values,
+            ).lastrowid
+            connection.executemany(
+                "INSERT INTO objectives (run_id, position, scenario, objective) "
+                "VALUES (?, ?, ?, ?)",
+                [
+                    (run_id, position, scenario, objective)
+                    for position, (scenario, objective) in enumerate(objectives)
+                ],
+            )
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return run_id
+
+    def add_summary(self, instance, info):
+        return self.add_run(instance, "summary", info)
+
+    def add_evaluation(self, solution):
+        objectives = [
+            (s.name.replace("_submission", ""), objective)
+            for s, objective in zip(
+                solution.instance.scenarios, solution.scenario_objectives
+            )
+        ]
+        return self.add_run(solution.instance, "evaluation", objectives=objectives)
+
+    def query(self, sql, params=()):
+        return [dict(row) for row in self.connection.execute(sql, params)]
+
+    def stats(
+        self, field="UB", by=("algorithm", "settings_hash"), where="1", params=()
+    ):
+        group = ", ".join(by)
+        return self.query(
+            f"SELECT {group}, COUNT(*) AS count, COUNT(DISTINCT instance) AS instances, "
+            f"AVG({field}) AS mean, MIN({field}) AS min, MAX({field}) AS max "
+            f"FROM runs WHERE kind = 'summary' AND {where} "
+            f"GROUP BY {group} ORDER BY {group}",
+            params,
+        )
+
+    def get_runs(self, kind, **keys):
+        # runs of a kind, with the given values of the columns (None is any)
+        where, params = ["kind = ?"], [kind]
+        for column, value in keys.items():
+            if column not in KEYS + ["name"]:
+                raise ValueError(f"Unknown key {column}")
+            if value is not None:
+                where.append(f"{column} = ?")
+                params.append(value)
+        return self.query(
+            f"SELECT * FROM runs WHERE {' AND '.join(where)} ORDER BY id", params
+        )
+
+    def export_csv(self, file_path, kind="summary", **keys):
+        # e.g. name, algorithm, settings_hash and phase (the evaluations of a
+        # table have the same scenarios)
+        runs = self.get_runs(kind, **keys)
+        writer = Util.Writer(file_path, sep=",")
+        if kind == "summary":
+            fields = ["KEY"] + FIELDS
+            writer.pretty_out(fields, len(fields))
+            for run in runs:
+                values = [run["instance"]] + [
+                    np.nan if run[field] is None else run[field] for field in FIELDS
+                ]
+                writer.pretty_out(values, len(values))
+            return len(runs)
+        objectives = {
+            run["id"]: self.query(
+                "SELECT scenario, objective FROM objectives WHERE run_id = ? "
+                "ORDER BY position",
+                (run["id"],),
+            )
+            for run in runs
+        }
+        scenarios = (
+            [row["scenario"] for row in objectives[runs[0]["id"]]] if runs else []
+        )
+        for run in runs:
+            if [row["scenario"] for row in objectives[run["id"]]] != scenarios:
+                raise ValueError(
+                    f"Run {run['id']} of {run['instance']} has other scenarios than "
+                    f"run {runs[0]['id']}"
+                )
+        fields = ["KEY"] + scenarios
+        writer.pretty_out(fields, len(fields))
+        for run in runs:
+            values = [run["instance"]] + [
+                row["objective"] for row in objectives[run["id"]]
+            ]
+            writer.pretty_out(values, len(values))
+        # the statistics of every scenario, as pandas' describe() wrote them
+        table = np.array(
+            [[row["objective"] for row in objectives[run["id"]]] for run in runs],
+            dtype=float,
+        ).reshape(len(runs), len(scenarios))
+        statistics = {
+            "mean": table.mean(axis=0),
+            "std": (
+                table.std(axis=0, ddof=1)
+                if len(runs) > 1
+                else [np.nan] * len(scenarios)
+            ),
+            "min": table.min(axis=0),
+            "50%": np.median(table, axis=0),
+            "max": table.max(axis=0),
+            "count": [float(len(runs))] * len(scenarios),
+        }
+        Util.writeln(file_path)
+        Util.writeln(file_path, "," + ",".join(scenarios))
+        for statistic in STATISTICS:
+            Util.writeln(
+                file_path,
+                ",".join([statistic] + [str(float(v)) for v in statistics[statistic]]),
+            )
+        return len(runs)
+
+
+if __name__ == "__main__":
+    setting = Setting()
+    store = ResultStore(setting.results_file)
+    command = sys.argv[1] if len(sys.argv) > 1 else "stats"
+    if command == "export":
+        file_path = sys.argv[2] if len(sys.argv) > 2 else setting.summary_file
+        name = sys.argv[3] if len(sys.argv) > 3 else setting.name
+        algorithm = int(sys.argv[4]) if len(sys.argv) > 4 else setting.algorithm
+        kind = "evaluation" if setting.solver.fixsol else "summary"
+        count = store.export_csv(
+            file_path,
+            kind,
+            name=name,
+            algorithm=algorithm,
+            settings_hash=get_settings_hash(setting),
+            phase=setting.phase,
+        )
+        print(f"Exported {count} runs")
+    else:
+        field = sys.argv[2] if len(sys.argv) > 2 else "UB"
+        for row in store.stats(field):
+            print(row)
@@ -0,0 +1,460 @@
+import sys
+import copy
+import json
+import math
+import heapq
+import itertools
+import threading
+import timeit
+import traceback
+import http.client
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import gurobipy as gp
+from gurobipy import GRB
+from Setting import Setting
+from Data import Data
+from Optimizer import Optimizer
+from Results import get_settings_hash
+import Util
+
+# A long-running optimisation service on localhost HTTP. It starts a pool of
+# gurobi environments once, keeps the parsed instances and the live models of
+# the solved instances warm, and runs jobs from a priority queue on one worker
+# thread per environment (gurobi releases the GIL while it solves). A live model
+# belongs to the environment it was built on (an environment is not shared by
+# two threads), so all jobs of an instance run on its environment. The parsed
+# instances and live models are keyed by the settings hash (Results.py) of the
+# service setting with the "settings" of the job, so only a job with other
+# settings parses and formulates again. Jobs (JSON):
+#   {"kind": "solve", "key": dataset key, "index": instance index,
+#    "runtime": seconds, "priority": higher runs first, "settings": {name:
+#    value}, optional "base_load", "solar_load", "price"}  solves the live
+#    model (with new forecasts, Optimizer.update_forecasts) from its incumbent
+#   {"kind": "evaluate", ..., "activity_start": {a: t},
+#    "battery_bt_mode": [[b, t, mode], ...]}  the objective of a schedule
+#   {"kind": "reoptimize", ..., "base_load", "solar_load", "price":
+#    scenarios x slots, "probabilities": optional}  new forecasts, from the
+#    incumbent of the live model (Optimizer.reoptimize)
+# Endpoints:
+#   POST /jobs                  submits a job, returns its id
+#   GET  /jobs, /jobs/<id>      the jobs, a job with its events and result
+#   GET  /jobs/<id>/events      streams the events of a job (one JSON per line)
+#                               until it ends
+#   POST /jobs/<id>/cancel      cancels a queued job or stops a running one
+#   GET  /status                environments, queue and cached instances
+
+KINDS = ["solve", "evaluate", "reoptimize"]
+ENDED = ["done", "failed", "cancelled"]
+
+
+class Job:
+    def __init__(self, job_id, request):
+        self.id = job_id
+        self.kind = request.get("kind", "solve")
+        self.key = request["key"]
+        self.index = int(request.get("index", 0))
+        self.runtime = float(request.get("runtime", 60))
+        self.priority = int(request.get("priority", 0))
+        self.settings = request.get("settings", {})
+        self.request = request
+        self.status = "queued"
+        self.cancelled = False
+        self.events = []
+        self.result = None
+        self.condition = threading.Condition()
+        self.start_time = timeit.default_timer()
+        self.add_event("queued")
+
+    def add_event(self, event, **values):
+        with self.condition:
+            self.events.append(
+                dict(
+                    event=event,
+                    time=round(timeit.default_timer() - self.start_time, 3),
+                    **values,
+                )
+            )
+            self.condition.notify_all()
+
+    def end(self, status, result=None):
+        self.status = status
+        self.result = result
+        self.add_event(status)
+
+    def describe(self, events=True):
+        values = OrderedDict(
+            id=self.id,
+            kind=self.kind,
+            key=self.key,
+            index=self.index,
+            runtime=self.runtime,
+            priority=self.priority,
+            settings=self.settings,
+            status=self.status,
+        )
+        if events:
+            values["events"] = list(self.events)
+            values["result"] = self.result
+        return values
+
+
+class JobCallback:
+    # progress and cancellation of the job running on a live model, chained
+    # with any callback the optimizer installs later (e.g. root cuts)
+    def __init__(self):
+        self.job = None
+
+    def __call__(self, model, where):
+        job = self.job
+        if job is None:
+            return
+        if job.cancelled:
+            model.terminate()
+        elif where == GRB.Callback.MIPSOL:
+            job.add_event(
+                "incumbent",
+                objective=model.cbGet(GRB.Callback.MIPSOL_OBJBST),
+                bound=model.cbGet(GRB.Callback.MIPSOL_OBJBND),
+            )
+
+
+class EnvPool:
+    def __init__(self, size):
+        self.envs = []
+        for _ in range(size):
+            env = gp.Env(empty=True)
+            env.setParam(GRB.Param.LogToConsole, 0)
+            env.start()
+            self.envs.append(env)
+        self.free = set(range(size))
+        self.condition = threading.Condition()
+
+    def acquire(self, index=None):
+        # a free environment, or the given one once it is free
+        with self.condition:
+            while not (self.free if index is None else index in self.free):
+                self.condition.wait()
+            index = min(self.free) if index is None else index
+            self.free.remove(index)
+            return index
+
+    def release(self, index):
+        with self.condition:
+            self.free.add(index)
+            self.condition.notify_all()
+
+    def close(self):
+        for env in self.envs:
+            env.dispose()
+
+
+class Service:
+    def __init__(self, setting: Setting):
+        self.setting = setting
+        self.pool = EnvPool(setting.service_envs)
+        self.data = {}  # (key, settings hash) -> Data
+        self.instances = {}  # (key, index, settings hash) -> parsed instance
+        self.models = {}  # (key, index, settings hash) -> (optimizer, callback)
+        self.affinity = {}  # (key, index) -> env index
+        self.jobs = OrderedDict()
+        self.queue = []
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+        self.condition = threading.Condition(self.lock)
+        self.workers = [
+            threading.Thread(target=self.work, daemon=True)
+            for _ in range(setting.service_envs)
+        ]
+        for worker in self.workers:
+            worker.start()
+
+    def submit(self, request):
+        if request.get("kind", "solve") not in KINDS:
+            raise ValueError(f"Unknown job kind {request.get('kind')}")
+        request.setdefault("key", self.setting.dataset_keys[0])
+        for name in request.get("settings", {}):
+            if name not in vars(self.setting) or name == "solver":
+                raise ValueError(f"Unknown setting {name}")
+        with self.condition:
+            job = Job(str(next(self.counter)), request)
+            self.jobs[job.id] = job
+            heapq.heappush(self.queue, (-job.priority, int(job.id), job))
+            self.condition.notify()
+        return job
+
+    def cancel(self, job: Job):
+        with self.condition:
+            if job.status in ENDED:
+                return False
+            job.cancelled = True
+            if job.status == "queued":
+                job.end("cancelled")
+        return True
+
+    def work(self):
+        while True:
+            with self.condition:
+                while not self.queue:
+                    self.condition.wait()
+                _, _, job = heapq.heappop(self.queue)
+                if job.cancelled:
+                    continue
+                job.status = "running"
+            env_index = self.acquire(job)
+            try:
+                job.add_event("started", env=env_index)
+                result = self.run(job, env_index)
+                job.end("cancelled" if job.cancelled else "done", result)
+            except Exception as error:
+                job.end("failed", {"error": repr(error)})
+                traceback.print_exc()
+            finally:
+                self.pool.release(env_index)
+
+    def acquire(self, job: Job):
+        # the environment of the instance, the first free one for a new instance
+        key = (job.key, job.index)
+        while True:
+            with self.condition:
+                index = self.affinity.get(key)
+            env_index = self.pool.acquire(index)
+            with self.condition:
+                if self.affinity.setdefault(key, env_index) == env_index:
+                    return env_index
+            self.pool.release(env_index)
+
+    def get_setting(self, job: Job):
+        setting = copy.copy(self.setting)
+        setting.dataset_keys = [job.key]
+        for name, value in job.settings.items():
+            setattr(setting, name, value)
+        return setting, get_settings_hash(setting)
+
+    def get_instance(self, key, index, setting, settings_hash):
+        # parsed outside the lock, which status() and submit() take
+        with self.condition:
+            instance = self.instances.get((key, index, settings_hash))
+            data = self.data.get((key, settings_hash))
+        if instance is None:
+            if data is None:
+                data = Data(setting)
+            instance = data.get_instance_by_index(key, index)
+            with self.condition:
+                self.data.setdefault((key, settings_hash), data)
+                instance = self.instances.setdefault(
+                    (key, index, settings_hash), instance
+                )
+        return instance
+
+    def get_optimizer(self, job: Job, env_index):
+        # the live model of the instance and settings, formulated once
+        setting, settings_hash = self.get_setting(job)
+        with self.condition:
+            live = self.models.get((job.key, job.index, settings_hash))
+        if live:
+            return live
+        instance = self.get_instance(job.key, job.index, setting, settings_hash)
+        instance = copy.deepcopy(instance)
+        instance.folder = Util.joinpath(instance.folder, "service", settings_hash)
+        Util.mkdir(instance.folder)
+        optimizer = Optimizer(instance, self.pool.envs[env_index])
+        optimizer.model.setParam(GRB.Param.LogToConsole, 0)
+        callback = optimizer.callback = JobCallback()
+        optimizer.formulate()
+        with self.condition:
+            self.models[job.key, job.index, settings_hash] = (optimizer, callback)
+        return optimizer, callback
+
+    def run(self, job: Job, env_index):
+        optimizer, callback = self.get_optimizer(job, env_index)
+        callback.job = job
+        optimizer.model.setParam(GRB.Param.TimeLimit, max(1, job.runtime))
+        try:
+            if job.kind == "solve":
+                request = job.request
+                optimizer.keep_schedule()
+                if "base_load" in request:
+                    optimizer.update_forecasts(
+                        request["base_load"],
+                        request["solar_load"],
+                        request["price"],
+                        request.get("probabilities"),
+                    )
+                info, diff = optimizer.solve(), None
+            elif job.kind == "evaluate":
+                info, diff = self.evaluate(optimizer, job.request), None
+            else:
+                request = job.request
+                info, diff = optimizer.reoptimize(
+                    request["base_load"],
+                    request["solar_load"],
+                    request["price"],
+                    request.get("probabilities"),
+                )
+        finally:
+            callback.job = None
+        # the fields of a solve without an incumbent are NaN, which is not JSON
+        result = OrderedDict(
+            info={
+                key: None if isinstance(value, float) and math.isnan(value) else value
+                for key, value in vars(info).items()
+            },
+            diff=diff,
+        )
+        if optimizer.model.SolCount:
+            activity_start, battery_bt_mode = optimizer.get_schedule()
+            result["activity_start"] = activity_start
+            result["battery_bt_mode"] = [
+                [b, t, mode] for (b, t), mode in battery_bt_mode.items()
+            ]
+        return result
+
+    def evaluate(self, optimizer: Optimizer, request):
+        # the schedule is fixed through bounds and restored afterwards, so it
+        # becomes the incumbent of the live model
+        activity_start = OrderedDict(
+            (int(a), int(t)) for a, t in request["activity_start"].items()
+        )
+        battery_bt_mode = OrderedDict(
+            ((int(b), int(t)), int(mode))
+            for b, t, mode in request.get("battery_bt_mode", [])
+        )
+        optimizer.save_bounds("evaluate")
+        try:
+            optimizer.fix_batteries(battery_bt_mode)
+            optimizer.restrict_activity_starts(activity_start, 0)
+            optimizer.set_attr(
+                GRB.Attr.LB,
+                [optimizer.Z_VAR[a, t] for a, t in activity_start.items()],
+                1,
+            )
+            return optimizer.solve()
+        finally:
+            optimizer.restore_bounds("evaluate")
+
+    def status(self):
+        with self.condition:
+            return OrderedDict(
+                envs=len(self.pool.envs),
+                free_envs=len(self.pool.free),
+                queued=len(self.queue),
+                jobs=len(self.jobs),
+                instances=[list(key) for key in self.instances],
+                models=[list(key) for key in self.models],
+            )
+
+
+class Handler(BaseHTTPRequestHandler):
+    service: Service = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def send(self, code, values):
+        body = json.dumps(values).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def get_job(self, parts):
+        job = self.service.jobs.get(parts[1]) if len(parts) > 1 else None
+        if job is None:
+            self.send(404, {"error": "unknown job"})
+        return job
+
+    def stream(self, job: Job):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        sent = 0
+        while True:
+            with job.condition:
+                while sent == len(job.events) and job.status not in ENDED:
+                    job.condition.wait()
+                events = job.events[sent:]
+                ended = job.status in ENDED
+            for event in events:
+                self.wfile.write((json.dumps(event) + "\n").encode())
+            self.wfile.flush()
+            sent += len(events)
+            if ended and sent == len(job.events):
+                return
+
+    def do_GET(self):
+        parts = self.path.strip("/").split("/")
+        if parts == ["status"]:
+            self.send(200, self.service.status())
+        elif parts == ["jobs"]:
+            jobs = list(self.service.jobs.values())
+            self.send(200, [job.describe(events=False) for job in jobs])
+        elif parts[0] == "jobs" and len(parts) in [2, 3]:
+            job = self.get_job(parts)
+            if job is None:
+                return
+            if len(parts) == 3 and parts[2] == "events":
+                self.stream(job)
+            else:
+                self.send(200, job.describe())
+        else:
+            self.send(404, {"error": "unknown path"})
+
+    def do_POST(self):
+        parts = self.path.strip("/").split("/")
+        if parts == ["jobs"]:
+            length = int(self.headers.get("Content-Length", 0))
+            try:
+                job = self.service.submit(json.loads(self.rfile.read(length) or "{}"))
+            except (ValueError, KeyError) as error:
+                self.send(400, {"error": repr(error)})
+                return
+            self.send(201, {"id": job.id})
+        elif parts[0] == "jobs" and len(parts) == 3 and parts[2] == "cancel":
+            job = self.get_job(parts)
+            if job is not None:
+                self.send(200, {"cancelled": self.service.cancel(job)})
+        else:
+            self.send(404, {"error": "unknown path"})
+
+
+def serve(setting: Setting):
+    Handler.service = Service(setting)
+    server = ThreadingHTTPServer(("127.0.0.1", setting.service_port), Handler)
+    server.daemon_threads = True
+    print(f"Serving on http://127.0.0.1:{setting.service_port}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        Handler.service.pool.close()
+
+
+def call(method, path, values=None, port=None):
+    # a client for the schedulers: the JSON response of a request
+    connection = http.client.HTTPConnection("127.0.0.1", port or Setting().service_port)
+    body = json.dumps(values) if values is not None else None
+    connection.request(method, path, body, {"Content-Type": "application/json"})
+    response = connection.getresponse()
+    result = json.loads(response.read() or "null")
+    connection.close()
+    return result
+
+
+def events(job_id, port=None):
+    # the events of a job as they arrive, until it ends
+    connection = http.client.HTTPConnection("127.0.0.1", port or Setting().service_port)
+    connection.request("GET", f"/jobs/{job_id}/events")
+    response = connection.getresponse()
+    for line in response:
+        yield json.loads(line)
+    connection.close()
+
+
+if __name__ == "__main__":
+    setting = Setting()
+    if len(sys.argv) > 1:
+        setting.service_port = int(sys.argv[1])
+    serve(setting)
@@ -17,6 +17,10 @@ class SolverSetting:
         # https://www.gurobi.com/documentation/9.1/refman/presolve.html#parameter:Presolve
         self.threads = 1
         # https://www.gurobi.com/documentation/9.1/refman/threads.html
+        self.workers = None
+        # worker processes of the decomposition engines, None: all cores
+        self.seed = 0
+        # gurobi seed and seed of the random choices of the heuristics
 
 
 class Setting:
@@ -24,23 +28,67 @@ class Setting:
         self.name = "default"
         self.solver = SolverSetting()
         self.algorithm = 7 if self.solver.setstart else 12
-        self.phase = 2
+        self.set_phase(2)
         self.use_multiple_scenarios = True
+        self.scenario_reduction = None  # number of kept scenarios, None keeps all
         self.use_real_data = False
-        self.use_utc_time = True if self.phase == 2 else False
-        self.start_date = "20-10-01" if self.phase == 1 else "20-11-01"
-        self.end_date = "20-10-31" if self.phase == 1 else "20-11-30"
+        self.real_data_chunk = 100000  # rows read at once from the real data files
+        self.real_data_max_gap = 4  # missing slots interpolated, longer gaps fail
+        self.real_data_cache = True  # series of the time slots kept in output/cache
+        self.meter_utc_hours = 0  # UTC offset of the meter timestamps
+        self.price_utc_hours = None  # UTC offset of the prices, None: slot clock
         self.slot_minutes = 15
+        self.battery_formulation = "binary"  # binary or compact
+        self.activity_formulation = "standard"  # standard or vfree
+        self.reduce_activity_times = True  # presolve of the start times
+        self.analyse_activities = True  # pruning and symmetric once-offs
+        self.cut_families = []  # root cuts: any of "peak", "clique" and "cover"
+        self.cut_rounds = 20  # separation rounds at the root node
+        self.cg_iterations = 100  # column generation iterations (algorithm 18)
+        self.sweep_grid = {  # factors of the battery and price parameters
+            "capacity": [0.5, 1, 2],
+            "max_power": [0.5, 1, 2],
+            "efficiency": [1],
+            "price": [1],
+        }
+        self.sweep_runtime = 60  # time limit of every sweep point in seconds
+        self.transfer_source = None  # (phase, index) of a solved similar instance
+        self.service_envs = 2  # gurobi environments (parallel jobs) of Service.py
+        self.service_port = 8765  # localhost port of Service.py
+        self.queue_lease = 600  # seconds a queue job is leased without heartbeat
+        self.queue_attempts = 3  # runs of a queue job before it fails
+        self.variables_format = "txt"  # txt, or npz (see VariableDump.py)
+        self.coarse_factor = 2  # coarse slots of coarse_factor * slot_minutes
+        self.coarse_width = 2  # fine slots around the projected starts
+        self.window_days = 7  # fix-and-optimize window
+        self.window_runtime = 60  # time limit of every window in seconds
+        self.window_randomise = False  # random instead of sliding windows
+        self.alns_size = 10  # activities freed by an ALNS destroy operator
+        self.alns_decay = 0.8  # weight of the history in the ALNS operator weights
         self.main_dir = self._get_main_dir()
         self.startsol_dir = Util.joinpath(self.main_dir, "startsol")
         self.input_dir = Util.joinpath(self.main_dir, "COMPETITION DATASET FILES")
-        self.dataset_keys = [f"phase_{self.phase}"]
         self.summary_file_name = "summary"
 
+    def set_phase(self, phase):
+        self.phase = phase
+        self.use_utc_time = True if self.phase == 2 else False
+        self.start_date = "20-10-01" if self.phase == 1 else "20-11-01"
+        self.end_date = "20-10-31" if self.phase == 1 else "20-11-30"
+        self.dataset_keys = [f"phase_{self.phase}"]
+
     @property
     def output_dir(self):
         return Util.joinpath(self.main_dir, "output", f"{self.name}_{self.algorithm}")
 
+    @property
+    def queue_file(self):
+        return Util.joinpath(self.main_dir, "output", "queue.db")
+
+    @property
+    def results_file(self):
+        return Util.joinpath(self.main_dir, "output", "results.db")
+
     @property
     def summary_file(self):
         return Util.joinpath(self.output_dir, f"{self.summary_file_name}.csv")
@@ -0,0 +1,61 @@
+import sys
+from multiprocessing import shared_memory
+import numpy as np
+
+# Numpy arrays in shared memory for the worker processes of a pool. An array
+# is published once by the parent and pickled as the name of its block, so a
+# worker (forked or spawned) maps the same pages instead of receiving a copy,
+# and its view is read-only. numpy does not keep the mapping alive, so every
+# block stays mapped in a process until release() (a worker keeps its blocks
+# until it exits); the views of a released block must not be used. Workers
+# must be children of the publishing process (they share its resource
+# tracker, which frees the blocks if the parent dies).
+
+TRACK = sys.version_info >= (3, 13)  # attach without a resource tracker entry
+_mapped = {}  # name -> SharedArray of the blocks mapped in this process
+
+
+class SharedArray:
+    def __init__(self, memory, shape, dtype, owner=False):
+        self.memory = memory
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.owner = owner
+        self.array = np.ndarray(self.shape, self.dtype, buffer=memory.buf)
+        self.array.flags.writeable = False
+        _mapped[memory.name] = self
+
+    @classmethod
+    def publish(cls, array):
+        array = np.ascontiguousarray(array)
+        memory = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        shared = np.ndarray(array.shape, array.dtype, buffer=memory.buf)
+        shared[...] = array
+        del shared
+        return cls(memory, array.shape, array.dtype, owner=True)
+
+    @classmethod
+    def attach(cls, name, shape, dtype):
+        if name in _mapped:
+            return _mapped[name]
+        if TRACK:
+            memory = shared_memory.SharedMemory(name=name, track=False)
+        else:
+            memory = shared_memory.SharedMemory(name=name)
+        return cls(memory, shape, dtype)
+
+    def __reduce__(self):
+        return SharedArray.attach, (self.memory.name, self.shape, self.dtype.str)
+
+    @property
+    def name(self):
+        return self.memory.name
+
+    def release(self):
+        # unmaps the block (and removes it if this process published it)
+        _mapped.pop(self.memory.name, None)
+        self.array = None
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+            self.owner = False
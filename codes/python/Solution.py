@@ -2,6 +2,7 @@ from collections import OrderedDict, defaultdict
 import gurobipy as gp
 from gurobipy import GRB
 from Optimizer import Optimizer
+import VariableDump
 import Util
 
 
@@ -26,20 +27,21 @@ class Solution:
             for t in optimizer.activities[a].start_times
             if optimizer.Z_VAR[a, t].x >= 0.5
         ]
-        self.vvar = [
-            (a, t)
-            for a in optimizer.activities
-            for t in optimizer.activities[a].progress_times
-            if optimizer.V_VAR[a, t].x >= 0.5
-        ]
+        # V is rebuilt from the starts, so it needs no variables in the model
+        self.vvar = []
+        for a, t in self.z:
+            progress_times = set(optimizer.activities[a].progress_times)
+            self.vvar.extend(
+                (a, tp)
+                for tp in range(t, t + optimizer.activities[a].duration)
+                if tp in progress_times
+            )
+        self.v = defaultdict(int, ((key, 1) for key in self.vvar))
         self.w = [a for a in optimizer.activities if optimizer.W_VAR[a].x >= 0.5]
         self.u = [a for a in optimizer.activities_o if optimizer.U_VAR[a].x >= 0.5]
         self.o = list(set(self.w).intersection(optimizer.activities_o))
-        self.l = [
-            [optimizer.L_VAR[t, s].x for s in optimizer.scenarios]
-            for t in optimizer.slot_indices
-        ]
-        self.eta_var = [optimizer.ETA_VAR[s].x for s in optimizer.scenarios]
+        self.l = optimizer.get_loads()
+        self.eta_var = optimizer.get_peaks()
         self.instance = optimizer.instance
         self.min_load = [
             min(self.l[t][s] for t in optimizer.slot_indices)
@@ -73,18 +75,27 @@ class Solution:
                     * self.instance.scenarios[s].price[t]
                     / (self.instance.time.slots_per_hour * 1000)
                 )
-                self.actual_obj += price_cost / len(self.instance.scenarios)
+                self.actual_obj += price_cost * self.instance.scenarios[s].probability
                 self.scenario_objectives[s] += price_cost
 
         for s in optimizer.scenarios:
             max_load_cost = 0.005 * self.max_abs_load[s] * self.max_abs_load[s]
-            self.actual_obj += max_load_cost / len(self.instance.scenarios)
+            self.actual_obj += max_load_cost * self.instance.scenarios[s].probability
             self.scenario_objectives[s] += max_load_cost
 
+        self.full_obj = self.actual_obj
+        if len(self.instance.full_scenarios) > len(self.instance.scenarios):
+            full_objectives = self.score_scenarios(self.instance.full_scenarios)
+            self.full_obj = sum(
+                obj * s.probability
+                for obj, s in zip(full_objectives, self.instance.full_scenarios)
+            )
+        self.reduction_error = self.actual_obj - self.full_obj
+
         if optimizer.instance.setting.solver.fixsol:
             return
 
-        self.m, a_b_m = self.get_building_allocation()
+        self.m, self.a_b_m = self.get_building_allocation()
 
         self.variables = []
         self.variables.append(
@@ -92,13 +103,17 @@ class Solution:
         )
         self.variables.append(f"actual_obj {self.actual_obj}")
         self.variables.append(f"linearized_obj {self.linearized_obj}")
+        self.variables.append(f"full_obj {self.full_obj}")
+        self.variables.append(f"reduction_error {self.reduction_error}")
         self.variables.append(f"min_load {' '.join(str(val) for val in self.min_load)}")
         self.variables.append(f"max_load {' '.join(str(val) for val in self.max_load)}")
         self.variables.append(f"eta_var {' '.join(str(val) for val in self.eta_var)}")
         self.variables.append(f"enforced_load_ub {self.enforced_load_ub}")
         self.variables.append(f"sched_count_r {self.sched_count_r}")
         self.variables.append(f"sched_count_o {self.sched_count_o}")
-        self.variables.extend(f"abm {key[0]} {key[1]} {a_b_m[key]}" for key in a_b_m)
+        self.variables.extend(
+            f"abm {key[0]} {key[1]} {self.a_b_m[key]}" for key in self.a_b_m
+        )
         self.variables.extend(f"w {i}" for i, v in enumerate(self.w) if v >= 0.5)
         self.variables.extend(f"u {i}" for i, v in enumerate(self.u) if v >= 0.5)
         self.variables.extend(f"z {v[0]} {v[1]}" for v in self.z)
@@ -106,6 +121,30 @@ class Solution:
         self.variables.extend(f"x {v[0]} {v[1]}" for v in self.x)
         self.variables.extend(f"y {v[0]} {v[1]}" for v in self.y)
 
+    def score_scenarios(self, scenarios):
+        # the controllable load (activities and batteries) does not depend on
+        # the scenario, so the schedule can be re-scored on any ensemble
+        base = self.instance.scenarios[0]
+        controllable = [
+            self.l[t][0] - base.base_load[t] + base.solar_load[t]
+            for t in self.optimizer.slot_indices
+        ]
+        fixed_obj = sum(self.instance.activities[a].penalty for a in self.u) - sum(
+            self.instance.activities[a].revenue for a in self.o
+        )
+        objectives = []
+        for scenario in scenarios:
+            load = [
+                controllable[t] + scenario.base_load[t] - scenario.solar_load[t]
+                for t in self.optimizer.slot_indices
+            ]
+            price_cost = sum(
+                load[t] * scenario.price[t] for t in self.optimizer.slot_indices
+            ) / (self.instance.time.slots_per_hour * 1000)
+            max_abs_load = max(abs(l) for l in load)
+            objectives.append(fixed_obj + price_cost + 0.005 * max_abs_load ** 2)
+        return objectives
+
     def csv_header(self, filepath):
         writer = Util.Writer(filepath, sep=",")
         fields = ["KEY"]
@@ -168,8 +207,11 @@ class Solution:
                     writer.outln(f"c {self.instance.batteries[b].key} {t} {2}")
 
     def export(self):
-        self.export_variables()
-        self.export_ppoi()
+        if self.instance.setting.variables_format == "npz":
+            VariableDump.dump_solution(self)
+        else:
+            self.export_variables()
+            self.export_ppoi()
         self.export_ppoi(
             Util.joinpath(
                 self.optimizer.setting.startsol_dir, f"{self.optimizer.solve_count}",
@@ -178,7 +220,7 @@ class Solution:
         )
 
     def get_building_allocation(self):
-        model = gp.Model()
+        model = self.optimizer.new_model()
         M_VAR = model.addVars(
             ((a, b) for a in self.w for b in self.instance.buildings),
             name="M",
@@ -189,14 +231,13 @@ class Solution:
             (
                 (
                     gp.quicksum(
-                        M_VAR[a, b] * self.optimizer.V_VAR[a, t].x
+                        M_VAR[a, b] * self.v[a, t]
                         for a in self.o
                         if self.instance.activities[a].small_rooms >= 1
                         and t in self.instance.activities[a].progress_times
                     )
                     + gp.quicksum(
-                        M_VAR[a, b]
-                        * self.optimizer.V_VAR[a, self.optimizer.map_time(t)].x
+                        M_VAR[a, b] * self.v[a, self.optimizer.map_time(t)]
                         for a in self.optimizer.activities_r
                         if self.instance.activities[a].small_rooms >= 1
                         and self.optimizer.map_time(t)
@@ -214,14 +255,13 @@ class Solution:
             (
                 (
                     gp.quicksum(
-                        M_VAR[a, b] * self.optimizer.V_VAR[a, t].x
+                        M_VAR[a, b] * self.v[a, t]
                         for a in self.o
                         if self.instance.activities[a].large_rooms >= 1
                         and t in self.instance.activities[a].progress_times
                     )
                     + gp.quicksum(
-                        M_VAR[a, b]
-                        * self.optimizer.V_VAR[a, self.optimizer.map_time(t)].x
+                        M_VAR[a, b] * self.v[a, self.optimizer.map_time(t)]
                         for a in self.optimizer.activities_r
                         if self.instance.activities[a].large_rooms >= 1
                         and self.optimizer.map_time(t)
@@ -0,0 +1,170 @@
+import os
+import sys
+import copy
+import itertools
+import numpy as np
+from gurobipy import GRB
+from Instance import Instance
+from Optimizer import Optimizer
+import Util
+
+# What-if sweep over the battery and tariff parameters of an instance. Every
+# grid point scales the capacity, max_power and efficiency of all batteries and
+# the prices of all scenarios. The points are split into contiguous chunks over
+# a pool of worker processes; a worker formulates the model once, changes the
+# battery coefficients (C8, C9, C11, C19) and the price coefficients in place
+# for each of its points, and solves it from the solution of the previous
+# (neighbouring) point. The results are written to "output/sweep". The
+# objective of a point can be checked against a cold build of the scaled
+# instance ("python Sweep.py <key> <index> check", capacity 2).
+
+PARAMETERS = ["capacity", "max_power", "efficiency", "price"]
+_instance = None
+
+
+def _init_worker(instance):
+    global _instance
+    _instance = instance
+
+
+def _solve_in_worker(args):
+    worker, points = args
+    instance = _instance
+    instance.folder = Util.joinpath(instance.folder, "sweep", str(worker))
+    Util.mkdir(instance.folder)
+    return solve_points(instance, points)
+
+
+def get_points(grid):
+    # the last parameter changes fastest, so consecutive points are neighbours
+    return [
+        dict(zip(PARAMETERS, values))
+        for values in itertools.product(*(grid.get(p, [1]) for p in PARAMETERS))
+    ]
+
+
+def solve_points(instance: Instance, points):
+    optimizer = Optimizer(instance)
+    optimizer.formulate()
+    optimizer.model.setParam(GRB.Param.TimeLimit, instance.setting.sweep_runtime)
+    batteries = [
+        (b.capacity, b.max_power, b.efficiency, b.initial_state)
+        for b in optimizer.batteries.values()
+    ]
+    base_load = [s.base_load for s in instance.scenarios]
+    solar_load = [s.solar_load for s in instance.scenarios]
+    price = np.array([s.price for s in instance.scenarios], dtype=float)
+    rows = []
+    for point in points:
+        schedule = optimizer.get_schedule() if optimizer.model.SolCount else None
+        for b, (capacity, max_power, efficiency, initial_state) in enumerate(batteries):
+            # the state of charge keeps its share of the capacity (a battery of
+            # a ppoi file starts full)
+            optimizer.update_battery(
+                b,
+                capacity * point["capacity"],
+                max_power * point["max_power"],
+                min(1, efficiency * point["efficiency"]),
+                initial_state * point["capacity"],
+            )
+        optimizer.update_forecasts(base_load, solar_load, price * point["price"])
+        if schedule:
+            optimizer.set_start(*schedule)
+        info = optimizer.solve()
+        rows.append(
+            [point[p] for p in PARAMETERS]
+            + [info.UB, info.LB, info.GAP, info.CPU, info.NOD, info.STATUS]
+        )
+    return rows
+
+
+def prepare(instance: Instance):
+    if instance.pruned_activities:
+        # the pruning depends on the prices and the batteries of the instance
+        raise ValueError(
+            f"{len(instance.pruned_activities)} once-offs of {instance.name} pruned "
+            "(load the instance with analyse_activities = False)"
+        )
+    setting = copy.copy(instance.setting)
+    setting.battery_formulation = "binary"
+    setting.solver = copy.copy(setting.solver)
+    setting.solver.setstart = False
+    setting.solver.fixsol = False
+    instance.setting = setting
+    return setting
+
+
+def check(instance: Instance, point):
+    # the objective of a point of the sweep and of a cold build of the instance
+    # with the scaled batteries (full, as in a ppoi file) and prices
+    prepare(instance)
+    swept = copy.deepcopy(instance)
+    swept.folder = Util.joinpath(instance.folder, "sweep", "check")
+    Util.mkdir(swept.folder)
+    row = solve_points(swept, [point])[0]
+    rebuilt = copy.deepcopy(instance)
+    rebuilt.folder = Util.joinpath(instance.folder, "sweep", "rebuilt")
+    Util.mkdir(rebuilt.folder)
+    for battery in rebuilt.batteries:
+        battery.capacity *= point["capacity"]
+        battery.initial_state = battery.capacity
+        battery.max_power *= point["max_power"]
+        battery.efficiency = min(1, battery.efficiency * point["efficiency"])
+    for scenario in rebuilt.scenarios:
+        scenario.price = [price * point["price"] for price in scenario.price]
+    optimizer = Optimizer(rebuilt)
+    optimizer.formulate()
+    optimizer.model.setParam(GRB.Param.TimeLimit, instance.setting.sweep_runtime)
+    return row[len(PARAMETERS)], optimizer.solve().UB
+
+
+def sweep(instance: Instance, grid=None):
+    setting = prepare(instance)
+    points = get_points(grid or setting.sweep_grid)
+    workers = min(setting.solver.workers or os.cpu_count(), len(points))
+    chunks = [
+        (worker, [points[i] for i in chunk])
+        for worker, chunk in enumerate(np.array_split(np.arange(len(points)), workers))
+        if len(chunk)
+    ]
+    if workers > 1:
+        # the workers attach to the forecasts instead of copying them
+        instance.share_scenarios()
+        pool = Util.get_pool(workers, _init_worker, (instance,))
+        try:
+            results = pool.map(_solve_in_worker, chunks)
+        finally:
+            pool.close()
+            pool.join()
+            instance.unshare_scenarios()
+    else:
+        _init_worker(instance)
+        results = [_solve_in_worker(chunk) for chunk in chunks]
+    folder = Util.joinpath(setting.main_dir, "output", "sweep")
+    Util.mkdir(folder)
+    writer = Util.Writer(
+        Util.joinpath(folder, f"{instance.name}_{Util.now()}.csv"), sep=","
+    )
+    fields = PARAMETERS + ["UB", "LB", "GAP", "CPU", "NOD", "STATUS"]
+    writer.pretty_out(fields, len(fields))
+    rows = [row for chunk in results for row in chunk]
+    for row in rows:
+        writer.pretty_out(row, len(row))
+    return rows
+
+
+if __name__ == "__main__":
+    from Setting import Setting
+    from Data import Data
+
+    setting = Setting()
+    key = sys.argv[1] if len(sys.argv) > 1 else setting.dataset_keys[0]
+    index = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+    setting.dataset_keys = [key]
+    setting.analyse_activities = False
+    instance = Data(setting).get_instance_by_index(key, index)
+    if len(sys.argv) > 3 and sys.argv[3] == "check":
+        point = dict(zip(PARAMETERS, [2, 1, 1, 1]))
+        print(f"Swept {point}: %s, rebuilt: %s" % check(instance, point))
+    else:
+        sweep(instance)
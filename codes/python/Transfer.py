@@ -0,0 +1,344 @@
+import sys
+import timeit
+from collections import OrderedDict, defaultdict
+import numpy as np
+from Instance import Instance, Type
+import Util
+
+# Transfer of a solution between structurally similar instances (the large
+# instances of a phase share buildings, batteries and many activities, and the
+# instances of the two phases share them across months). The activities of the
+# target are matched to those of the source by their attributes and their
+# position in the precedence graph, in tiers from an exact match to the same
+# type and duration. The starts and the battery modes are shifted by the
+# difference of the first_monday_slot of the two instances (so a start keeps
+# its weekday and time of day, and a recurring activity keeps its slot of the
+# weekly template) and wrapped by whole weeks into the horizon. The schedule is
+# repaired in the order of the precedence graph: an activity takes the start
+# time nearest to its mapped start that keeps the rooms, C6, C7 and the loads
+# (within max_load_ub, the range of the peak in C15) feasible (an unmatched
+# recurring activity takes the first such start time, and the loads are not
+# kept for a recurring activity without one), and a once-off activity without
+# such a start time is not scheduled. The battery modes are repaired by
+# simulating the states of charge and the loads (a mode that leaves the
+# capacity or the load range becomes idle). The result is the start solution
+# of the target.
+
+CHARGE, IDLE, DISCHARGE = 0, 1, 2  # as in battery_bt_mode
+
+
+def get_dependants(instance: Instance):
+    dependants = defaultdict(list)
+    for ap, activity in enumerate(instance.activities):
+        for a in activity.prerequisites:
+            dependants[a].append(ap)
+    return dependants
+
+
+def get_depths(instance: Instance):
+    # the length of the longest chain of prerequisites of every activity
+    depths = {}
+
+    def depth(a):
+        if a not in depths:
+            depths[a] = 0  # guards against cycles
+            depths[a] = max(
+                (depth(ap) + 1 for ap in instance.activities[a].prerequisites),
+                default=0,
+            )
+        return depths[a]
+
+    return [depth(a) for a in range(len(instance.activities))]
+
+
+def get_keys(instance: Instance):
+    dependants = get_dependants(instance)
+    depths = get_depths(instance)
+    tiers = [[], [], [], []]
+    for a, activity in enumerate(instance.activities):
+        rooms = (activity.type, activity.small_rooms, activity.large_rooms)
+        attributes = rooms + (
+            activity.load_per_room,
+            activity.duration,
+            activity.revenue,
+            activity.penalty,
+        )
+        position = (depths[a], len(activity.prerequisites), len(dependants[a]))
+        tiers[0].append(attributes + position)
+        tiers[1].append(attributes)
+        tiers[2].append(rooms + (activity.duration,))
+        tiers[3].append((activity.type, activity.duration))
+    return tiers
+
+
+def match_activities(source: Instance, target: Instance):
+    # target activity -> source activity, the same key (index within its type)
+    # wins among the candidates of a tier
+    source_tiers, target_tiers = get_keys(source), get_keys(target)
+    matches = OrderedDict()
+    used = set()
+    for source_keys, target_keys in zip(source_tiers, target_tiers):
+        candidates = defaultdict(list)
+        for a, key in enumerate(source_keys):
+            if a not in used:
+                candidates[key].append(a)
+        for a, key in enumerate(target_keys):
+            if a in matches or not candidates[key]:
+                continue
+            group = candidates[key]
+            same = [
+                ap
+                for ap in group
+                if source.activities[ap].key == target.activities[a].key
+            ]
+            ap = same[0] if same else group[0]
+            group.remove(ap)
+            matches[a] = ap
+            used.add(ap)
+    return OrderedDict(sorted(matches.items()))
+
+
+def match_batteries(source: Instance, target: Instance):
+    matches = OrderedDict()
+    used = set()
+    for tier in [True, False]:
+        for b, battery in enumerate(target.batteries):
+            if b in matches:
+                continue
+            candidates = [
+                bp
+                for bp, other in enumerate(source.batteries)
+                if bp not in used
+                and (
+                    not tier
+                    or (other.capacity, other.max_power, other.efficiency)
+                    == (battery.capacity, battery.max_power, battery.efficiency)
+                )
+            ]
+            if not candidates:
+                continue
+            same = [bp for bp in candidates if bp == b]
+            bp = same[0] if same else candidates[0]
+            matches[b] = bp
+            used.add(bp)
+    return matches
+
+
+def wrap(t, length, horizon, slots_per_week):
+    # moves t by whole weeks until [t, t + length) is in the horizon
+    while t + length > horizon and t - slots_per_week >= 0:
+        t -= slots_per_week
+    while t < 0 and t + slots_per_week + length <= horizon:
+        t += slots_per_week
+    return t
+
+
+class SolutionTransfer:
+    def __init__(self, source: Instance, target: Instance):
+        self.source = source
+        self.target = target
+        self.shift = target.first_monday_slot - source.first_monday_slot
+        self.horizon = len(target.planning_horizon)
+        time = target.time
+        self.slots_per_week = time.slots_per_week
+        self.mapped_slots = defaultdict(list)  # first-week slot -> slots
+        for t in range(self.horizon):
+            self.mapped_slots[self.map_time(t)].append(t)
+        self.small = [0] * self.horizon
+        self.large = [0] * self.horizon
+        self.loads = np.array(
+            [np.subtract(s.base_load, s.solar_load) for s in target.scenarios],
+            dtype=float,
+        )
+        self.max_load = target.max_load_ub
+        self.stats = OrderedDict(
+            (name, 0) for name in ["matched", "kept", "moved", "dropped", "placed"]
+        )
+
+    def map_time(self, t):
+        first_monday = self.target.first_monday_slot
+        if t < first_monday:
+            return t
+        return first_monday + (t - first_monday) % self.slots_per_week
+
+    def day(self, t):
+        time = self.target.time
+        return (t + time.utc_offset) // time.slots_per_day
+
+    def map_start(self, a, t):
+        activity = self.target.activities[a]
+        if activity.type == Type.R:
+            return self.map_time(t + self.shift)
+        return wrap(
+            t + self.shift, activity.duration, self.horizon, self.slots_per_week
+        )
+
+    def occupied(self, a, t):
+        activity = self.target.activities[a]
+        slots = range(t, t + activity.duration)
+        if activity.type == Type.R:
+            return [tp for slot in slots for tp in self.mapped_slots[slot]]
+        return list(slots)
+
+    def power(self, a):
+        activity = self.target.activities[a]
+        return activity.load_per_room * (activity.small_rooms + activity.large_rooms)
+
+    def fits(self, a, t, activity_start, loads=True):
+        activity = self.target.activities[a]
+        for ap in activity.prerequisites:
+            if ap not in activity_start:
+                return False
+            if self.day(activity_start[ap]) >= self.day(t):
+                return False
+        slots = self.occupied(a, t)
+        for tp in slots:
+            if self.small[tp] + activity.small_rooms > self.target.small_room_count:
+                return False
+            if self.large[tp] + activity.large_rooms > self.target.large_room_count:
+                return False
+        if not loads:
+            return True
+        return self.loads[:, slots].max() + self.power(a) <= self.max_load
+
+    def place(self, a, t, activity_start):
+        activity = self.target.activities[a]
+        slots = self.occupied(a, t)
+        for tp in slots:
+            self.small[tp] += activity.small_rooms
+            self.large[tp] += activity.large_rooms
+        self.loads[:, slots] += self.power(a)
+        activity_start[a] = t
+
+    def get_order(self):
+        # prerequisites first, recurring activities (always scheduled) first
+        # among the activities whose prerequisites are ordered
+        activities = self.target.activities
+        dependants = get_dependants(self.target)
+        remaining = {
+            a: len(set(activity.prerequisites)) for a, activity in enumerate(activities)
+        }
+        ready = [a for a, count in remaining.items() if count == 0]
+        order = []
+        while ready:
+            ready.sort(key=lambda a: (activities[a].type != Type.R, a))
+            a = ready.pop(0)
+            order.append(a)
+            for ap in set(dependants[a]):
+                remaining[ap] -= 1
+                if remaining[ap] == 0:
+                    ready.append(ap)
+        return order
+
+    def transfer_activities(self, activity_start):
+        matches = match_activities(self.source, self.target)
+        self.stats["matched"] = len(matches)
+        repaired = OrderedDict()
+        for a in self.get_order():
+            activity = self.target.activities[a]
+            if not activity.start_times:
+                continue
+            source_start = activity_start.get(matches.get(a))
+            if source_start is not None:
+                mapped = self.map_start(a, source_start)
+                candidates = sorted(activity.start_times, key=lambda t: abs(t - mapped))
+            elif activity.type == Type.R:
+                mapped = None
+                candidates = activity.start_times
+            else:
+                continue
+            t = next((t for t in candidates if self.fits(a, t, repaired)), None)
+            if t is None and activity.type == Type.R:
+                # always scheduled, the batteries may bring the load back
+                t = next(
+                    (t for t in candidates if self.fits(a, t, repaired, False)), None
+                )
+            if t is None:
+                self.stats["dropped"] += 1
+                continue
+            self.place(a, t, repaired)
+            if mapped is None:
+                self.stats["placed"] += 1
+            elif t == mapped:
+                self.stats["kept"] += 1
+            else:
+                self.stats["moved"] += 1
+        return OrderedDict(sorted(repaired.items()))
+
+    def transfer_batteries(self, battery_bt_mode):
+        source_horizon = len(self.source.planning_horizon)
+        slots_per_hour = self.target.time.slots_per_hour
+        repaired = OrderedDict()
+        for b, bp in match_batteries(self.source, self.target).items():
+            battery = self.target.batteries[b]
+            step = battery.max_power / slots_per_hour
+            charge = battery.max_power / np.sqrt(battery.efficiency)
+            discharge = -np.sqrt(battery.efficiency) * battery.max_power
+            state = battery.initial_state
+            for t in range(self.horizon):
+                tp = wrap(t - self.shift, 1, source_horizon, self.slots_per_week)
+                mode = battery_bt_mode.get((bp, tp), IDLE)
+                if mode == CHARGE and (
+                    state + step > battery.capacity + 1e-9
+                    or self.loads[:, t].max() + charge > self.max_load
+                ):
+                    mode = IDLE
+                if mode == DISCHARGE and (
+                    state - step < -1e-9
+                    or self.loads[:, t].min() + discharge < -self.max_load
+                ):
+                    mode = IDLE
+                if mode == CHARGE:
+                    state += step
+                    self.loads[:, t] += charge
+                elif mode == DISCHARGE:
+                    state -= step
+                    self.loads[:, t] += discharge
+                if mode != IDLE:
+                    repaired[b, t] = mode
+        return repaired
+
+    def run(self, activity_start, battery_bt_mode):
+        start_time = timeit.default_timer()
+        activity_start = self.transfer_activities(activity_start)
+        battery_bt_mode = self.transfer_batteries(battery_bt_mode)
+        message = (
+            f"Transfer from {self.source.name} to {self.target.name}: "
+            f"Shift={self.shift} "
+            + " ".join(f"{name}={count}" for name, count in self.stats.items())
+            + f" Scheduled={len(activity_start)}/{len(self.target.activities)}"
+            + f" BatterySlots={len(battery_bt_mode)}"
+            + f" Time={timeit.default_timer() - start_time:.2f}"
+        )
+        Util.writeln(Util.joinpath(self.target.folder, "transfer.log"), message)
+        return activity_start, battery_bt_mode
+
+
+def transfer_solution(source: Instance, target: Instance):
+    # the start solution of the source becomes the start solution of the target
+    activity_start, battery_bt_mode = SolutionTransfer(source, target).run(
+        source.sol_activity_start, source.sol_battery_bt_mode
+    )
+    target.sol_activity_start = activity_start
+    target.sol_battery_bt_mode = battery_bt_mode
+    return activity_start, battery_bt_mode
+
+
+if __name__ == "__main__":
+    from Setting import Setting
+    from Data import Data
+    from Optimizer import Optimizer
+
+    # python Transfer.py <source_phase> <source_index> <target_index>, the
+    # target is an instance of the phase of the setting
+    setting = Setting()
+    phase = int(sys.argv[1]) if len(sys.argv) > 1 else setting.phase
+    source_index = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+    target_index = int(sys.argv[3]) if len(sys.argv) > 3 else 1
+    setting.transfer_source = (phase, source_index)
+    data = Data(setting)
+    target = data.get_instance_by_index(setting.dataset_keys[0], target_index)
+    transfer_solution(data.get_transfer_source(), target)
+    optimizer = Optimizer(target)
+    optimizer.formulate()
+    optimizer.solve()
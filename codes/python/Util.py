@@ -3,6 +3,8 @@ import os
 import json
 import pathlib
 import shutil
+import sqlite3
+import multiprocessing
 from datetime import datetime as dt
 import numpy as np
 
@@ -22,6 +24,22 @@ ORDINAL = lambda n: "%d%s" % (
 DTFORMAT = "%Y-%m-%d-%H-%M"
 
 
+def get_pool(processes, initializer=None, initargs=()):
+    # fork (where available) keeps the workers from re-running Main.py
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context("fork" if "fork" in methods else None)
+    return context.Pool(processes, initializer, initargs)
+
+
+def connect(file_path):
+    # a SQLite database with a write-ahead log, for concurrent processes
+    connection = sqlite3.connect(file_path, timeout=60, isolation_level=None)
+    connection.row_factory = sqlite3.Row
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA busy_timeout=60000")
+    return connection
+
+
 def clearTerminal():
     os.system("cls" if os.name == "nt" else "clear")
 
@@ -0,0 +1,180 @@
+import sys
+import json
+import os
+from collections import OrderedDict, defaultdict
+import numpy as np
+import Util
+
+# A compact dump of the variables of a solve: one compressed numpy archive
+# ("variables_<solve>.npz") per solve instead of the variables_<solve>.txt and
+# instance_solution_<solve>.txt files, written with one call. The families
+# (z, v, x and y as index pairs, w, u and o as indices, abm as triples) are
+# integer arrays and the scalars and the per-scenario values are a JSON header,
+# together with the activity and battery keys the ppoi file needs. load(file)
+# gives a view with the attributes of a Solution, and convert writes the text
+# files of a dump (or of every dump of a folder) in their usual layout.
+#   python VariableDump.py <npz file or folder>
+
+VERSION = 1
+PAIRS = ["z", "vvar", "x", "y"]
+INDICES = ["w", "u", "o", "activities_r"]
+
+
+def pairs(values, width=2):
+    return np.array(values, dtype=np.int32).reshape(len(values), width)
+
+
+def dump_solution(solution, file_path=None):
+    optimizer = solution.optimizer
+    instance = solution.instance
+    if instance.setting.solver.fixsol:
+        return
+    if file_path is None:
+        file_path = Util.joinpath(
+            instance.folder, f"variables_{optimizer.solve_count}.npz"
+        )
+    header = {
+        "version": VERSION,
+        "name": instance.name,
+        "solve_count": optimizer.solve_count,
+        "scenarios": [s.name for s in instance.scenarios],
+        "scenario_objectives": list(solution.scenario_objectives),
+        "min_load": list(solution.min_load),
+        "max_load": list(solution.max_load),
+        "eta_var": list(solution.eta_var),
+        "counts": [
+            len(instance.buildings),
+            len(instance.batteries),
+            len(instance.activities_r),
+            len(instance.activities_o),
+        ],
+    }
+    for name in ["actual_obj", "linearized_obj", "full_obj", "reduction_error"]:
+        header[name] = getattr(solution, name)
+    for name in ["enforced_load_ub", "sched_count_r", "sched_count_o"]:
+        header[name] = getattr(solution, name)
+    arrays = {name: pairs(getattr(solution, name)) for name in PAIRS}
+    arrays["abm"] = pairs(
+        [(a, b, count) for (a, b), count in solution.a_b_m.items()], width=3
+    )
+    arrays["w"] = np.array(solution.w, dtype=np.int32)
+    arrays["u"] = np.array(solution.u, dtype=np.int32)
+    arrays["o"] = np.array(solution.o, dtype=np.int32)
+    arrays["activities_r"] = np.array(list(optimizer.activities_r), dtype=np.int32)
+    arrays["activity_key"] = np.array(
+        [a.key for a in instance.activities], dtype=np.int32
+    )
+    arrays["activity_rooms"] = np.array(
+        [a.small_rooms + a.large_rooms for a in instance.activities], dtype=np.int32
+    )
+    arrays["battery_key"] = np.array(
+        [b.key for b in instance.batteries], dtype=np.int32
+    )
+    np.savez_compressed(file_path, header=np.array(json.dumps(header)), **arrays)
+    return file_path
+
+
+class VariableDump:
+    def __init__(self, file_path):
+        self.file_path = file_path
+        with np.load(file_path) as archive:
+            header = json.loads(str(archive["header"]))
+            arrays = {name: archive[name] for name in archive.files if name != "header"}
+        self.header = header
+        for name, value in header.items():
+            setattr(self, name, value)
+        for name in PAIRS:
+            setattr(self, name, [tuple(pair) for pair in arrays[name].tolist()])
+        for name in INDICES:
+            setattr(self, name, arrays[name].tolist())
+        self.activity_key = arrays["activity_key"].tolist()
+        self.activity_rooms = arrays["activity_rooms"].tolist()
+        self.battery_key = arrays["battery_key"].tolist()
+        self.v = defaultdict(int, ((key, 1) for key in self.vvar))
+        self.a_b_m = OrderedDict()
+        self.m = defaultdict(list)
+        for a, b, count in arrays["abm"].tolist():
+            self.a_b_m[(a, b)] = count
+            self.m[a].extend(b for i in range(count))
+        self.start = {}
+        for a, t in self.z:
+            self.start.setdefault(a, t)
+
+    def get_start_time(self, a):
+        return self.start.get(a, -1)
+
+    @property
+    def variables(self):
+        # the lines of variables_<solve>.txt, as Solution builds them
+        variables = [f'Scenarios: {" ".join(self.scenarios)}']
+        variables.append(f"actual_obj {self.actual_obj}")
+        variables.append(f"linearized_obj {self.linearized_obj}")
+        variables.append(f"full_obj {self.full_obj}")
+        variables.append(f"reduction_error {self.reduction_error}")
+        variables.append(f"min_load {' '.join(str(val) for val in self.min_load)}")
+        variables.append(f"max_load {' '.join(str(val) for val in self.max_load)}")
+        variables.append(f"eta_var {' '.join(str(val) for val in self.eta_var)}")
+        variables.append(f"enforced_load_ub {self.enforced_load_ub}")
+        variables.append(f"sched_count_r {self.sched_count_r}")
+        variables.append(f"sched_count_o {self.sched_count_o}")
+        variables.extend(
+            f"abm {key[0]} {key[1]} {self.a_b_m[key]}" for key in self.a_b_m
+        )
+        variables.extend(f"w {i}" for i, v in enumerate(self.w) if v >= 0.5)
+        variables.extend(f"u {i}" for i, v in enumerate(self.u) if v >= 0.5)
+        variables.extend(f"z {v[0]} {v[1]}" for v in self.z)
+        variables.extend(f"v {v[0]} {v[1]}" for v in self.vvar)
+        variables.extend(f"x {v[0]} {v[1]}" for v in self.x)
+        variables.extend(f"y {v[0]} {v[1]}" for v in self.y)
+        return variables
+
+    def write_variables(self, file_path):
+        writer = Util.Writer(file_path, sep=", ")
+        writer.pretty_out(self.variables, max_words=1)
+
+    def write_ppoi(self, file_path):
+        # the layout of Solution.export_ppoi
+        buildings, batteries, recurring, onceoff = self.counts
+        writer = Util.Writer(file_path)
+        writer.outln(f"ppoi {buildings} {buildings} {batteries} {recurring} {onceoff}")
+        writer.outln(f"sched {self.sched_count_r} {self.sched_count_o}")
+        for entity, activities in [("r", self.activities_r), ("a", self.o)]:
+            for a in activities:
+                line = f"{entity} {self.activity_key[a]} {self.get_start_time(a)}"
+                line += f" {self.activity_rooms[a]}"
+                for b in self.m[a]:
+                    line += f" {b}"
+                writer.outln(line)
+        modes = OrderedDict(((b, t), 2) for b, t in self.y)
+        modes.update(((b, t), 0) for b, t in self.x)
+        for b, t in sorted(modes):
+            writer.outln(f"c {self.battery_key[b]} {t} {modes[b, t]}")
+
+    def convert(self, folder=None):
+        folder = folder or Util.getDirFromPath(self.file_path)
+        tag = f"_{self.solve_count}"
+        file_name = self.name.replace("instance", "instance_solution")
+        self.write_variables(Util.joinpath(folder, f"variables{tag}.txt"))
+        self.write_ppoi(Util.joinpath(folder, f"{file_name}{tag}.txt"))
+
+
+def load(file_path):
+    return VariableDump(file_path)
+
+
+def convert(path):
+    # a dump, or every dump below a folder
+    if not os.path.isdir(path):
+        load(path).convert()
+        return 1
+    count = 0
+    for root, _, files in os.walk(path):
+        for file_name in sorted(files):
+            if file_name.startswith("variables_") and file_name.endswith(".npz"):
+                load(Util.joinpath(root, file_name)).convert()
+                count += 1
+    return count
+
+
+if __name__ == "__main__":
+    print(f"Converted {convert(sys.argv[1])} dumps")